@@ -1,5 +1,9 @@
 import os
 
+# .env を読み込み（database.py などは import 時に環境変数を読むので、ほかの import より先に）
+from dotenv import load_dotenv
+load_dotenv()
+
 from flask import Flask
 from flask import render_template
 from flask import session
@@ -13,18 +17,17 @@ from blueprints.home import home_bp
 from blueprints.reservation import reservation_bp
 from blueprints.coupon import coupon_bp
 from blueprints.info import info_bp
+from blueprints.owner import owner_bp
+from blueprints.api import api_bp
 
-import requests
+from liff_auth import verify_id_token, VerifyError, VerifyTimeout
+import auth
+import sql_profiler
+import metrics
 
 from datetime import timedelta
 
-from database import *
-
-from dotenv import load_dotenv
-load_dotenv()
-
-# .env を読み込み
-load_dotenv()
+from database import db, Person
 
 def create_app():
     app = Flask(__name__)
@@ -42,27 +45,48 @@ def create_app():
     app.config["LINE_CHANNEL_SECRET"] = os.getenv("LINE_CHANNEL_SECRET")
     app.config["LINE_CHANNEL_ACCESS_TOKEN"] = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
     
+    # リクエスト・テンプレート・LINE API のメトリクスと /metrics（最初に登録して全体の時間を測る）
+    metrics.init_app(app)
+
     # Blueprint
     app.register_blueprint(top_bp, url_prefix='/top')
     app.register_blueprint(home_bp, url_prefix='/home')
     app.register_blueprint(reservation_bp, url_prefix='/reservation')
     app.register_blueprint(coupon_bp, url_prefix='/coupon')
     app.register_blueprint(info_bp, url_prefix='/info')
+    app.register_blueprint(owner_bp, url_prefix='/owner')
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+
+    # DB接続: リクエストごとに開いて、終わったら必ず閉じる（プール利用時はプールへ返却）
+    @app.before_request
+    def db_connect():
+        db.connect(reuse_if_open=True)
+
+    @app.teardown_request
+    def db_close(exc):
+        if not db.is_closed():
+            db.close()
+
+    # SQL_PROFILE=log|headers のときだけ SQL の本数・時間・N+1 を記録する（off なら何もしない）
+    sql_profiler.init_app(app, db)
 
     # テンプレ共通変数: current_user を常に使えるように
     @app.context_processor
     def inject_current_user():
+        identity = auth.current_identity()
         user = {
-            "line_id": session.get("line_id"),
-            "line_name": session.get("line_name"),
-            "line_picture": session.get("line_picture"),
-            "is_authenticated": bool(session.get("line_id")),
+            "id": identity["user_id"] if identity else None,
+            "role": identity["role"] if identity else None,
+            "line_id": session.get("line_id") if identity else None,
+            "line_name": identity["line_name"] if identity else None,
+            "line_picture": identity["line_picture"] if identity else None,
+            "is_authenticated": identity is not None,
         }
         return dict(current_user=user)
 
     @app.route('/')
     def index():
-        if not session.get("line_id"):
+        if auth.current_identity() is None:
             return redirect("/login")
         return redirect("/top")
 
@@ -91,48 +115,67 @@ def create_app():
         フロントから送られた id_token を LINE に検証依頼し、
         正当なら Flask セッションにユーザ情報を保存する。
         """
-        data = request.get_json(silent=True) or {}
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = {}
         id_token = data.get("id_token")
         profile_hint = data.get("profile")  # 参考用（サーバ側では信用しない）
 
-        if not id_token:
+        if not id_token or not isinstance(id_token, str):
             return jsonify({"ok": False, "error": "no id_token"}), 400
 
-        # LINE IDトークン検証API
+        # LINE IDトークン検証（HS256 はローカル検証、それ以外は verify API。結果は短時間キャッシュ）
         # https://api.line.me/oauth2/v2.1/verify
         if current_app.config["ENV"] != "local":
-            resp = requests.post(
-                    "https://api.line.me/oauth2/v2.1/verify",
-                    data={
-                        "id_token": id_token,
-                        "client_id": current_app.config["LINE_CHANNEL_ID"],
-                    },
-                    timeout=5,
+            try:
+                payload = verify_id_token(
+                    id_token,
+                    current_app.config["LINE_CHANNEL_ID"],
+                    current_app.config["LINE_CHANNEL_SECRET"],
                 )
-            if resp.status_code != 200:
-                return jsonify({"ok": False, "error": "verify_failed", "detail": resp.text}), 400
-            payload = resp.json()
+            except VerifyTimeout:
+                return jsonify({"ok": False, "error": "verify_timeout"}), 503, {"Retry-After": "1"}
+            except VerifyError as e:
+                return jsonify({"ok": False, "error": "verify_failed", "detail": e.detail}), 400
             # payload 例: {"iss": "...", "sub": "Uxxxxxxxx", "name": "...", "picture": "...", ...}
 
-            # セッションへ保存（ここだけを信頼ソースにする）
-            session.permanent = True
-            session["line_id"] = payload.get("sub")                 # ユーザID（必須）
-            session["line_name"] = payload.get("name") or (profile_hint or {}).get("displayName")
-            session["line_picture"] = payload.get("picture") or (profile_hint or {}).get("pictureUrl")
+            line_id = payload.get("sub")                 # ユーザID（必須）
+            line_name = payload.get("name") or (profile_hint or {}).get("displayName")
+            line_picture = payload.get("picture") or (profile_hint or {}).get("pictureUrl")
         else:
-            session["line_id"] = profile_hint.get("userId")
-            session["line_name"] = profile_hint.get("displayName")
-            session["line_picture"] = profile_hint.get("pictureUrl")
+            line_id = (profile_hint or {}).get("userId")
+            line_name = (profile_hint or {}).get("displayName")
+            line_picture = (profile_hint or {}).get("pictureUrl")
+        if not line_id:
+            return jsonify({"ok": False, "error": "no userId"}), 400
+
+        # User / UserChannelLink を UPSERT して LiffSession を発行（ここだけを信頼ソースにする）
+        identity = auth.login(
+            line_id, line_name, line_picture,
+            channel_id=current_app.config["LINE_CHANNEL_ID"],
+            channel_secret=current_app.config["LINE_CHANNEL_SECRET"],
+            access_token=current_app.config["LINE_CHANNEL_ACCESS_TOKEN"],
+            device_info=request.headers.get("User-Agent"),
+            lifetime=app.permanent_session_lifetime,
+        )
+        if identity is None:
+            session.clear()
+            return jsonify({"ok": False, "error": "inactive_user"}), 403
 
         return jsonify({"ok": True, "user": {
-            "line_id": session["line_id"],
-            "line_name": session.get("line_name"),
-            "line_picture": session.get("line_picture"),
+            "id": identity["user_id"],
+            "line_id": line_id,
+            "line_name": identity["line_name"],
+            "line_picture": identity["line_picture"],
         }})
 
     @app.route("/logout", methods=["POST"])
     def logout():
-        session.clear()
+        # {"all": true} なら全端末のセッションを失効させる
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = {}
+        auth.logout(everywhere=bool(data.get("all")))
         return jsonify({"ok": True})
     
     return app
@@ -0,0 +1,237 @@
+# 古い行の退避（アーカイブ）
+#
+# 増え続けるテーブルから、もう日常的には読まない行を別の SQLite ファイル（ATTACH して archive.<テーブル>）へ移す。
+# 元のテーブルの行と索引が減るので、予約・受信箱・ログインまわりの索引を引くクエリが軽くなる。
+#   reservations  : 完了・キャンセル・無断キャンセルで、終了から --months か月より前の予約
+#                   （ReservationChangeLog・ReminderSent の行も一緒に移す）
+#                   口コミ・クーポン利用のある予約は残す（評価の集計と「初回限定」などの利用回数が参照する）
+#   journal       : --months か月より前の月の予約イベントジャーナル（reservation_event_YYYYMM）のうち、
+#                   予約がもう元のテーブルに無い（退避済み・削除済み）行。空になった月のテーブルは消す
+#                   （まだ残っている予約の作成イベントなどを消すと replay() で組み立て直せなくなる）
+#   sessions      : 期限切れ、またはログアウトしてから --session-days 日過ぎた LiffSession
+#   notifications : 既読の個人宛てお知らせで、配信から --notification-days 日過ぎたもの
+#                   （全体向けはユーザごとの既読と未読数のカウンタが参照するので残す）
+#
+# どれも id 順に --chunk 件ずつ動かす。1チャンク = 1つの短い書き込みトランザクション
+# （archive 側へ INSERT OR REPLACE で写してから元を DELETE）で、チャンクの間に --pause 秒空けて
+# 予約などの書き込みが長くロックを待たされないようにする。
+# WAL では ATTACH したファイルをまたぐコミットは原子的でないが、写すのは主キー付きの INSERT OR REPLACE なので
+# 途中で止まってもやり直せば重複しない。
+# ※ SalonDailyStat は集計済みの値が残る。退避した期間を backfill_stats.py で作り直すとその分が消えるので注意
+# ※ SQLite 専用（ATTACH を使う）
+#
+#   python archive.py                                   # すべて（既定: 6か月・30日・90日）
+#   python archive.py --only reservations --months 12 --chunk 1000
+#   python archive.py --dry-run                         # 件数だけ数える
+#   ARCHIVE_DATABASE=/data/many_booking_archive.db python archive.py
+import argparse
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+from peewee import SqliteDatabase
+
+from dotenv import load_dotenv
+load_dotenv()   # database.py は import 時に DATABASE_URL などを読むので先に .env を読む
+from database import (
+    db, DATABASE_URL, reservation_event_partition,
+    Reservation, ReservationChangeLog, ReminderSent, CouponRedemption, Review,
+    LiffSession, Notification,
+)
+from blueprints.reservation.journal import partitions, month_of, _write_transaction
+
+TARGETS = ("reservations", "journal", "sessions", "notifications")
+ARCHIVED_STATUSES = (2, 3, 4)
+DEFAULT_MONTHS = 6
+DEFAULT_SESSION_DAYS = 30
+DEFAULT_NOTIFICATION_DAYS = 90
+DEFAULT_CHUNK = 500
+DEFAULT_PAUSE_SEC = 0.05
+SCHEMA = "archive"
+
+
+def default_archive_path(url=DATABASE_URL):
+    """many_booking.db → many_booking_archive.db（ARCHIVE_DATABASE で上書き）"""
+    path = os.getenv("ARCHIVE_DATABASE")
+    if path:
+        return path
+    base = url.split("///", 1)[-1].split("?", 1)[0]
+    root, ext = os.path.splitext(base)
+    return f"{root}_archive{ext or '.db'}"
+
+
+def attach(path):
+    """archive スキーマとして ATTACH する（トランザクションの外で、移す接続で1回）"""
+    if not isinstance(db, SqliteDatabase):
+        raise RuntimeError("archive.py は SQLite 専用です")
+    attached = [row[1] for row in db.execute_sql("PRAGMA database_list").fetchall()]
+    if SCHEMA not in attached:
+        db.execute_sql(f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def ensure_table(table):
+    """元と同じ定義（主キー・索引）の archive.<table> を作る"""
+    rows = db.execute_sql(
+        "SELECT type, name, sql FROM main.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL "
+        "ORDER BY type = 'index'", (table,)
+    ).fetchall()
+    for kind, name, sql in rows:
+        if kind == "table":
+            sql = re.sub(r"^CREATE TABLE (IF NOT EXISTS )?\S+",
+                         f"CREATE TABLE IF NOT EXISTS {SCHEMA}.{_quote(table)}", sql)
+        else:
+            sql = re.sub(r"^CREATE (UNIQUE )?INDEX (IF NOT EXISTS )?\S+",
+                         lambda m: f"CREATE {m.group(1) or ''}INDEX IF NOT EXISTS {SCHEMA}.{_quote(name)}", sql)
+        db.execute_sql(sql)
+
+
+def _move(table, column, ids):
+    """table の column が ids に含まれる行を archive へ写して消す（呼び出し側のトランザクション内）"""
+    placeholders = ", ".join("?" * len(ids))
+    where = f"{_quote(column)} IN ({placeholders})"
+    db.execute_sql(f"INSERT OR REPLACE INTO {SCHEMA}.{_quote(table)} SELECT * FROM main.{_quote(table)} "
+                   f"WHERE {where}", ids)
+    return db.execute_sql(f"DELETE FROM main.{_quote(table)} WHERE {where}", ids).rowcount
+
+
+def _chunks(model, condition, chunk):
+    """condition に合う行の id を id 順に chunk 件ずつ（読むたびに続きから探す）"""
+    last_id = 0
+    while True:
+        ids = [pk for (pk,) in (
+            model
+            .select(model.id)
+            .where(condition & (model.id > last_id))
+            .order_by(model.id)
+            .limit(chunk)
+            .tuples()
+        )]
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+class Archiver:
+    def __init__(self, now=None, months=DEFAULT_MONTHS, session_days=DEFAULT_SESSION_DAYS,
+                 notification_days=DEFAULT_NOTIFICATION_DAYS, chunk=DEFAULT_CHUNK, pause=DEFAULT_PAUSE_SEC,
+                 dry_run=False, log=print):
+        self.now = now or datetime.utcnow()
+        self.months = months
+        self.session_days = session_days
+        self.notification_days = notification_days
+        self.chunk = chunk
+        self.pause = pause
+        self.dry_run = dry_run
+        self.log = log
+        self.counts = {}
+
+    def _count(self, key, n):
+        self.counts[key] = self.counts.get(key, 0) + n
+
+    def _run(self, key, model, condition, related=()):
+        """condition に合う model の行を（related の子テーブルの行と一緒に）チャンクごとに移し、移した行数を返す"""
+        if self.dry_run:
+            n = model.select().where(condition).count()
+            self._count(key, n)
+            return n
+        for table, _ in related:
+            ensure_table(table)
+        ensure_table(model._meta.table_name)
+        moved = 0
+        for ids in _chunks(model, condition, self.chunk):
+            with _write_transaction():
+                for table, column in related:
+                    self._count(table, _move(table, column, ids))
+                moved += _move(model._meta.table_name, "id", ids)
+            time.sleep(self.pause)
+        self._count(key, moved)
+        self.log(f"{model._meta.table_name}: {moved}")
+        return moved
+
+    def cutoff_month(self):
+        first = self.now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        for _ in range(self.months):
+            first = (first - timedelta(days=1)).replace(day=1)
+        return first
+
+    def reservations(self):
+        cutoff = self.cutoff_month()
+        condition = (
+            Reservation.status.in_(ARCHIVED_STATUSES)
+            & (Reservation.end_at < cutoff)
+            & ~Reservation.id.in_(Review.select(Review.reservation))
+            & ~Reservation.id.in_(CouponRedemption.select(CouponRedemption.reservation))
+        )
+        related = (
+            (ReservationChangeLog._meta.table_name, "reservation_id"),
+            (ReminderSent._meta.table_name, "reservation_id"),
+        )
+        self._run("reservations", Reservation, condition, related)
+
+    def journal(self):
+        """締まった古い月のパーティションから、予約が退避済みの行を移し、空になったテーブルを消す"""
+        cutoff = month_of(self.cutoff_month())
+        for month in partitions():
+            if month >= cutoff:
+                continue
+            model = reservation_event_partition(month)
+            self._run("journal", model, model.reservation.not_in(Reservation.select(Reservation.id)))
+            if not self.dry_run and not model.select().exists():
+                # 空になった月は消す（read_since() は存在する月だけを見るので位置は壊れない）
+                model.drop_table(safe=True)
+
+    def sessions(self):
+        cutoff = self.now - timedelta(days=self.session_days)
+        condition = (
+            (LiffSession.expires_at < cutoff)
+            | ((LiffSession.revoked == True) & (LiffSession.updated_at < cutoff))
+        )
+        self._run("sessions", LiffSession, condition)
+
+    def notifications(self):
+        cutoff = self.now - timedelta(days=self.notification_days)
+        condition = (
+            Notification.user.is_null(False)
+            & (Notification.is_read == True)
+            & (Notification.delivered_at < cutoff)
+        )
+        self._run("notifications", Notification, condition)
+
+    def run(self, targets=TARGETS):
+        for target in targets:
+            getattr(self, target)()
+        return self.counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", choices=TARGETS, action="append", help="複数指定可（省略時はすべて）")
+    parser.add_argument("--months", type=int, default=DEFAULT_MONTHS, help="予約・ジャーナルを残す月数")
+    parser.add_argument("--session-days", type=int, default=DEFAULT_SESSION_DAYS)
+    parser.add_argument("--notification-days", type=int, default=DEFAULT_NOTIFICATION_DAYS)
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="1トランザクションで移す行数")
+    parser.add_argument("--pause", type=float, default=DEFAULT_PAUSE_SEC, help="チャンクの間に空ける秒数")
+    parser.add_argument("--archive-file", default=None, help="退避先（既定: ARCHIVE_DATABASE か <DB名>_archive.db）")
+    parser.add_argument("--dry-run", action="store_true", help="移さずに件数だけ数える")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with db.connection_context():
+        attach(args.archive_file or default_archive_path())
+        archiver = Archiver(months=args.months, session_days=args.session_days,
+                            notification_days=args.notification_days, chunk=args.chunk, pause=args.pause,
+                            dry_run=args.dry_run)
+        counts = archiver.run(args.only or TARGETS)
+    for key, n in counts.items():
+        print(f"{key:<24} {n:>10}")
+    print(f"({time.perf_counter() - started:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+# ログインユーザ関連のヘルパ
+#
+# LIFF ログイン時に User / UserChannelLink を UPSERT し、LiffSession を1行発行する。
+# Flask セッションには user_id と liff_session_id を持ち、リクエストごとの
+# 「ログイン中のユーザは誰か」はプロセス内の LRU キャッシュ（line_user_id → ユーザ情報）から引く。
+#   - User の更新（is_active など）・LiffSession の更新（revoked など）は on_write で即時に破棄
+#   - 別プロセスでのログアウト・失効・無効化はキャッシュに届かないので、セッションごとに
+#     AUTH_REVALIDATE_SEC に1回だけ主キーで LiffSession.revoked と User.is_active / updated_at を確かめる
+#     （変わっていれば読み直す）。それ以外のリクエストは DB を読まない。
+#     別プロセスでの失効が効くまで最大 AUTH_REVALIDATE_SEC 秒かかる（同じプロセス内なら即時）
+#   - エントリには TTL（AUTH_CACHE_TTL_SEC）も付けて、使われなくなったものを入れ替える
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import g, session
+
+from database import db, on_write, User, UserChannelLink, LiffSession, LineChannel
+
+CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+CACHE_TTL_SEC = int(os.getenv("AUTH_CACHE_TTL_SEC", "60"))
+REVALIDATE_SEC = float(os.getenv("AUTH_REVALIDATE_SEC", "5"))
+SESSION_LIFETIME = timedelta(days=7)
+
+
+class IdentityCache:
+    """
+    line_user_id → {user_id, role, line_name, line_picture, updated_at,
+                    sessions: {liff_session_id: expires_at}, checked: {liff_session_id: 最後に DB で確かめた時刻}}
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SEC, revalidate=REVALIDATE_SEC):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.revalidate = revalidate
+        self._entries = OrderedDict()
+        self._line_ids = {}   # user_id → line_user_id（User / LiffSession の変更から引くため）
+        self._lock = threading.Lock()
+
+    def get(self, line_id, session_id, now=None):
+        now = now or datetime.utcnow()
+        with self._lock:
+            entry = self._entries.get(line_id)
+            if entry is None:
+                return None
+            if entry["cached_at"] + self.ttl <= time.monotonic():
+                self._remove(line_id)
+                return None
+            expires_at = entry["sessions"].get(session_id)
+            if expires_at is None or expires_at <= now:
+                return None
+            self._entries.move_to_end(line_id)
+            return entry
+
+    def needs_check(self, entry, session_id):
+        """このセッションを DB で確かめる番か（AUTH_REVALIDATE_SEC に1回）。番なら確かめた時刻を進める"""
+        now = time.monotonic()
+        with self._lock:
+            checked_at = entry["checked"].get(session_id)
+            if checked_at is not None and now - checked_at < self.revalidate:
+                return False
+            entry["checked"][session_id] = now
+            return True
+
+    def put(self, line_id, identity, session_id, expires_at):
+        with self._lock:
+            entry = self._entries.get(line_id)
+            if entry is None or entry["user_id"] != identity["user_id"]:
+                entry = dict(identity, sessions={}, checked={}, cached_at=time.monotonic())
+                self._entries[line_id] = entry
+                self._line_ids[identity["user_id"]] = line_id
+            entry["sessions"][session_id] = expires_at
+            entry["checked"][session_id] = time.monotonic()   # 今 DB から読んだ
+            self._entries.move_to_end(line_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            return entry
+
+    def drop_user(self, user_id):
+        with self._lock:
+            line_id = self._line_ids.get(user_id)
+            if line_id is not None:
+                self._remove(line_id)
+
+    def drop_session(self, user_id, session_id):
+        with self._lock:
+            entry = self._entries.get(self._line_ids.get(user_id))
+            if entry is not None:
+                entry["sessions"].pop(session_id, None)
+                entry["checked"].pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._line_ids.clear()
+
+    def _remove(self, line_id):
+        entry = self._entries.pop(line_id, None)
+        if entry is not None:
+            self._line_ids.pop(entry["user_id"], None)
+
+
+identity_cache = IdentityCache()
+
+
+def _identity(user):
+    return {
+        "user_id": user["id"],
+        "role": user["role"],
+        "line_name": user["line_display_name"],
+        "line_picture": user["line_picture_url"],
+        "updated_at": user["updated_at"],
+    }
+
+
+def _channel(channel_id, channel_secret=None, access_token=None):
+    """ログインに使ったチャネルの LineChannel（無ければ設定値から作る）"""
+    if not channel_id:
+        return None
+    (LineChannel
+     .insert(name=channel_id, channel_id=channel_id, channel_secret=channel_secret or "",
+             channel_access_token=access_token or "")
+     .on_conflict_ignore()
+     .execute())
+    return LineChannel.select(LineChannel.id).where(LineChannel.channel_id == channel_id).scalar()
+
+
+def login(line_id, line_name=None, line_picture=None, channel_id=None, channel_secret=None,
+          access_token=None, device_info=None, lifetime=SESSION_LIFETIME):
+    """
+    検証済みの LINE userId でログインする（1トランザクション）。
+      User を UPSERT → UserChannelLink を作成（既存なら何もしない）→ LiffSession を発行
+    Flask セッションに user_id / liff_session_id を保存して identity を返す。
+    無効化されたユーザは None。
+    """
+    now = datetime.utcnow()
+    with db.atomic():
+        (User
+         .insert(line_user_id=line_id, line_display_name=line_name, line_picture_url=line_picture,
+                 created_at=now, updated_at=now)
+         .on_conflict(
+             conflict_target=[User.line_user_id],
+             update={
+                 User.line_display_name: line_name,
+                 User.line_picture_url: line_picture,
+                 User.updated_at: now,
+             },
+         )
+         .execute())
+        user = (
+            User
+            .select(User.id, User.role, User.is_active, User.line_display_name, User.line_picture_url,
+                    User.updated_at)
+            .where(User.line_user_id == line_id)
+            .dicts()
+            .get()
+        )
+        if not user["is_active"]:
+            return None
+        channel = _channel(channel_id, channel_secret, access_token)
+        if channel is not None:
+            (UserChannelLink
+             .insert(user=user["id"], channel=channel, channel_user_id=line_id, created_at=now, updated_at=now)
+             .on_conflict_ignore()
+             .execute())
+        liff_session = LiffSession.create(
+            user=user["id"], issued_at=now, expires_at=now + lifetime,
+            device_info=(device_info or "")[:255] or None,
+        )
+
+    # UPSERT は on_write を通らないので、表示名などが古いエントリはここで捨てる
+    identity_cache.drop_user(user["id"])
+    identity = identity_cache.put(line_id, _identity(user), liff_session.id, liff_session.expires_at)
+    session.permanent = True
+    session["line_id"] = line_id
+    session["line_name"] = line_name
+    session["line_picture"] = line_picture
+    session["user_id"] = user["id"]
+    session["liff_session_id"] = liff_session.id
+    g.identity = identity
+    return identity
+
+
+def logout(everywhere=False):
+    """今のセッション（everywhere なら全端末のセッション）を失効させて Flask セッションを消す"""
+    identity = current_identity()
+    if identity is not None:
+        if everywhere:
+            revoke_sessions(identity["user_id"])
+        else:
+            liff_session = LiffSession.get_or_none(LiffSession.id == session.get("liff_session_id"))
+            if liff_session is not None and not liff_session.revoked:
+                liff_session.revoked = True
+                liff_session.save()
+    session.clear()
+    g.identity = None
+
+
+def revoke_sessions(user_id):
+    """ユーザの有効なセッションをすべて失効させる（一括 UPDATE なのでキャッシュも明示的に破棄）"""
+    revoked = (
+        LiffSession
+        .update(revoked=True, updated_at=datetime.utcnow())
+        .where((LiffSession.user == user_id) & (LiffSession.revoked == False))
+        .execute()
+    )
+    identity_cache.drop_user(user_id)
+    return revoked
+
+
+def _load(line_id, session_id, now):
+    row = (
+        LiffSession
+        .select(LiffSession.expires_at, User.id, User.role, User.line_display_name, User.line_picture_url,
+                User.updated_at)
+        .join(User)
+        .where(
+            (LiffSession.id == session_id)
+            & (User.line_user_id == line_id)
+            & (LiffSession.revoked == False)
+            & (LiffSession.expires_at > now)
+            & (User.is_active == True)
+        )
+        .dicts()
+        .first()
+    )
+    if row is None:
+        return None
+    return identity_cache.put(line_id, _identity(row), session_id, row["expires_at"])
+
+
+def _still_valid(entry, session_id):
+    """キャッシュのエントリが今も使えるか（別プロセスでの失効・無効化・更新を主キーの1行で確かめる）"""
+    row = (
+        LiffSession
+        .select(LiffSession.revoked, User.is_active, User.updated_at)
+        .join(User)
+        .where(LiffSession.id == session_id)
+        .tuples()
+        .first()
+    )
+    return row is not None and not row[0] and row[1] and row[2] == entry["updated_at"]
+
+
+def current_identity():
+    """ログイン中ユーザの {user_id, role, line_name, line_picture}（未ログイン・失効済みは None）"""
+    if "identity" in g:
+        return g.identity
+    line_id = session.get("line_id")
+    session_id = session.get("liff_session_id")
+    identity = None
+    if line_id and session_id:
+        now = datetime.utcnow()
+        identity = identity_cache.get(line_id, session_id, now)
+        if (identity is not None and identity_cache.needs_check(identity, session_id)
+                and not _still_valid(identity, session_id)):
+            identity_cache.drop_user(identity["user_id"])
+            identity = None
+        identity = identity or _load(line_id, session_id, now)
+    g.identity = identity
+    return identity
+
+
+def current_user_id():
+    """ログイン中ユーザの User.id（未登録・無効ユーザ・失効したセッションは None）"""
+    identity = current_identity()
+    return identity["user_id"] if identity else None
+
+
+@on_write(User)
+def _on_user_write(user, action):
+    if action != "create":
+        identity_cache.drop_user(user.id)
+
+
+@on_write(LiffSession)
+def _on_liff_session_write(liff_session, action):
+    if action != "create":
+        identity_cache.drop_session(liff_session.user_id, liff_session.id)
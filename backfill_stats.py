@@ -0,0 +1,40 @@
+# オーナー向け集計（SalonDailyStat）の作り直し
+#
+#   python backfill_stats.py                                   # 全期間
+#   python backfill_stats.py --from 2025-01-01 --to 2025-12-31 --salon 3
+#   python backfill_stats.py --no-numpy                        # NumPy を使わずに計算
+#   （NumPy は requirements.txt にある。入っていない環境では警告を出して Python で計算する）
+import argparse
+import time
+from datetime import date
+
+from dotenv import load_dotenv
+load_dotenv()   # database.py は import 時に DATABASE_URL などを読むので先に .env を読む
+from database import db
+from blueprints.reservation.stats import backfill, rebuild_daily_stats, BACKFILL_CHUNK_DAYS
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--from", dest="start", type=date.fromisoformat)
+    parser.add_argument("--to", dest="end", type=date.fromisoformat)
+    parser.add_argument("--salon", type=int, action="append", help="複数指定可（省略時は全サロン）")
+    parser.add_argument("--chunk-days", type=int, default=BACKFILL_CHUNK_DAYS)
+    parser.add_argument("--no-numpy", action="store_true")
+    args = parser.parse_args()
+
+    use_numpy = False if args.no_numpy else None
+    started = time.perf_counter()
+    with db.connection_context():
+        if args.start is None and args.end is None and not args.salon:
+            rows = rebuild_daily_stats(use_numpy=use_numpy)
+        else:
+            if args.start is None or args.end is None:
+                parser.error("--from と --to は両方指定してください")
+            rows = backfill(args.start, args.end, salon_ids=args.salon,
+                            chunk_days=args.chunk_days, use_numpy=use_numpy)
+    print(f"rows: {rows} ({time.perf_counter() - started:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
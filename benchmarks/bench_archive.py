@@ -0,0 +1,181 @@
+# 退避（archive.py）前後のホットなクエリのレイテンシ
+#
+# seed_data.py の大量データモードで作ったDB（--db で既存ファイルも可。コピーして使うので元は変えない）に対して
+#   slots    : 空き枠の検索（find_free_slots）
+#   inbox    : お知らせ一覧の1ページ目（inbox_page）
+#   session  : ログイン中セッションの照合（auth._load）
+#   history  : ユーザの直近20件の予約
+# を退避前と後で --repeat 回ずつ実行して p50/p95 を比べ、テーブルの行数とファイルサイズも表示する。
+# 退避の最中は別スレッドが InboxCounter へ書き込み続け、その書き込みの最大・p99 の待ち時間を表示する
+# （チャンクを小さく保てば、退避中も通常の書き込みが長く待たされないことの確認）。
+#
+#   python -m benchmarks.bench_archive --salons 50 --users 5000 --reservations 200000
+#   python -m benchmarks.bench_archive --db bench.db --chunk 1000 --vacuum
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from database import (
+    db, Reservation, ReservationChangeLog, LiffSession, Notification, Service, User,
+)
+from blueprints.reservation.availability import find_free_slots
+from blueprints.info.inbox import inbox_page, bump
+from blueprints.reservation.journal import partitions, _write_transaction
+from benchmarks.bench_endpoints import generate, percentile
+import archive
+import auth
+
+TABLES = (Reservation, ReservationChangeLog, LiffSession, Notification)
+WRITER_KEY = "bench:archive_writer"
+
+
+def samples(rng, count):
+    """クエリに渡す (salon, service) / ユーザ / セッションを最初に決めておき、前後で同じものを使う"""
+    services = list(Service.select(Service.salon, Service.id).where(Service.is_active == True).tuples())
+    users = [uid for (uid,) in User.select(User.id).where(User.role == 0).tuples()]
+    sessions = list(
+        LiffSession
+        .select(LiffSession.id, User.line_user_id)
+        .join(User)
+        .where((LiffSession.revoked == False) & (LiffSession.expires_at > datetime.utcnow()))
+        .tuples()
+    )
+    return {
+        "slots": [rng.choice(services) for _ in range(count)],
+        "inbox": [rng.choice(users) for _ in range(count)],
+        "session": [rng.choice(sessions) for _ in range(count)] if sessions else [],
+        "history": [rng.choice(users) for _ in range(count)],
+    }
+
+
+def _history(user_id):
+    return list(
+        Reservation
+        .select()
+        .where(Reservation.user == user_id)
+        .order_by(Reservation.start_at.desc())
+        .limit(20)
+    )
+
+
+QUERIES = {
+    "slots": lambda s: find_free_slots(s[0], s[1], days=7),
+    "inbox": lambda user_id: inbox_page(user_id),
+    "session": lambda s: auth._load(s[1], s[0], datetime.utcnow()),
+    "history": _history,
+}
+
+
+def measure(sample):
+    result = {}
+    for name, query in QUERIES.items():
+        times = []
+        for arg in sample[name]:
+            auth.identity_cache.clear()
+            started = time.perf_counter()
+            query(arg)
+            times.append((time.perf_counter() - started) * 1000)
+        times.sort()
+        result[name] = (percentile(times, 50), percentile(times, 95))
+    return result
+
+
+def counts(path):
+    result = {model._meta.table_name: model.select().count() for model in TABLES}
+    result["reservation_event_*"] = len(partitions())
+    result["file (MB)"] = round(os.path.getsize(path) / 1e6, 1)
+    return result
+
+
+class Writer(threading.Thread):
+    """退避の間、短い書き込みトランザクションを繰り返して待ち時間を記録する"""
+
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.times = []
+        self.stop = threading.Event()
+
+    def run(self):
+        with db.connection_context():
+            while not self.stop.is_set():
+                started = time.perf_counter()
+                with _write_transaction():
+                    bump({WRITER_KEY: 1})
+                self.times.append((time.perf_counter() - started) * 1000)
+                time.sleep(self.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=None, help="既存の大量データDB（コピーして使う）")
+    parser.add_argument("--salons", type=int, default=50)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--reservations", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--months", type=int, default=archive.DEFAULT_MONTHS)
+    parser.add_argument("--chunk", type=int, default=archive.DEFAULT_CHUNK)
+    parser.add_argument("--pause", type=float, default=archive.DEFAULT_PAUSE_SEC)
+    parser.add_argument("--vacuum", action="store_true", help="退避後に VACUUM してファイルを縮める")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_archive_")
+    path = os.path.join(workdir, "bench.db")
+    if args.db:
+        shutil.copy(args.db, path)
+    else:
+        generate(path, args.salons, args.users, args.reservations, args.seed)
+    db.init(path)
+
+    with db.connection_context():
+        db.execute_sql("ANALYZE")
+        sample = samples(random.Random(args.seed), args.repeat)
+        before_counts = counts(path)
+        measure(sample)   # キャッシュを温める
+        before = measure(sample)
+
+        archive.attach(os.path.join(workdir, "bench_archive.db"))
+        writer = Writer()
+        writer.start()
+        started = time.perf_counter()
+        moved = archive.Archiver(months=args.months, chunk=args.chunk, pause=args.pause, log=lambda _: None).run()
+        elapsed = time.perf_counter() - started
+        writer.stop.set()
+        writer.join()
+
+        db.execute_sql("ANALYZE")
+        if args.vacuum:
+            db.execute_sql("VACUUM")
+        db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        after_counts = counts(path)
+        measure(sample)
+        after = measure(sample)
+
+    print(f"archived in {elapsed:.2f}s (chunk {args.chunk}, pause {args.pause}s)")
+    for key, n in moved.items():
+        print(f"  {key:<24} {n:>10}")
+    writes = sorted(writer.times)
+    if writes:
+        print(f"concurrent writes: {len(writes)}  p50 {percentile(writes, 50):.2f}ms  "
+              f"p99 {percentile(writes, 99):.2f}ms  max {writes[-1]:.2f}ms")
+    print()
+    print(f"{'table':<24} {'before':>12} {'after':>12}")
+    for key in before_counts:
+        print(f"{key:<24} {before_counts[key]:>12} {after_counts[key]:>12}")
+    print()
+    print(f"{'query (ms)':<12} {'p50 before':>11} {'p50 after':>11} {'p95 before':>11} {'p95 after':>11}")
+    for name in QUERIES:
+        if not sample[name]:
+            continue
+        (b50, b95), (a50, a95) = before[name], after[name]
+        print(f"{name:<12} {b50:>11.3f} {a50:>11.3f} {b95:>11.3f} {a95:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# 予約作成の競合ベンチマーク
+#
+# N プロセスが同じ日・同じ枠を奪い合うように予約を作成し、
+# 1) 同一担当者で時間が重なる予約が 0 件であること
+# 2) 成功した予約数 / 秒
+# を表示する。重なりが見つかった場合は終了コード 1。
+#
+#   python -m benchmarks.bench_booking --clients 8 --attempts 200
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, time as dtime
+
+from database import (
+    db, create_tables,
+    User, Salon, SalonStaff, WorkingHour, Service, Reservation
+)
+from blueprints.reservation.booking import create_reservation, BookingError, SlotUnavailable, DatabaseBusy
+
+
+def setup(path, staff_count):
+    db.init(path)
+    create_tables()
+    with db.atomic():
+        owner = User.create(line_user_id="U_bench_owner", role=2)
+        salon = Salon.create(name="Bench Salon", owner=owner)
+        for i in range(staff_count):
+            su = User.create(line_user_id=f"U_bench_staff_{i}", role=1)
+            SalonStaff.create(salon=salon, user=su, display_name=f"staff{i}")
+        for w in range(7):
+            WorkingHour.create(salon=salon, weekday=w, start=dtime(9, 0), end=dtime(21, 0))
+        service = Service.create(salon=salon, name="cut", duration_min=60, price_jpy=5000)
+    return salon.id, service.id
+
+
+def client(args):
+    path, client_no, salon_id, service_id, staff_ids, day, attempts, seed = args
+    db.init(path)
+    rnd = random.Random(seed)
+    user = User.create(line_user_id=f"U_bench_client_{client_no}")
+    # 30分刻みの開始時刻に 60 分のメニュー → 隣り合う枠同士も重なる
+    starts = [datetime.combine(day, dtime(9, 0)) + timedelta(minutes=30 * i) for i in range(23)]
+    ok = unavailable = busy = 0
+    for _ in range(attempts):
+        try:
+            create_reservation(
+                user.id, salon_id, service_id, rnd.choice(starts),
+                staff_id=rnd.choice(staff_ids + [None]),
+            )
+            ok += 1
+        except SlotUnavailable:
+            unavailable += 1
+        except DatabaseBusy:
+            busy += 1
+        except BookingError:
+            unavailable += 1
+    db.close()
+    return ok, unavailable, busy
+
+
+def count_overlaps(salon_id):
+    rows = (
+        Reservation
+        .select(Reservation.staff, Reservation.start_at, Reservation.end_at)
+        .where((Reservation.salon == salon_id) & (Reservation.status.not_in((3, 4))))
+        .order_by(Reservation.staff, Reservation.start_at)
+        .tuples()
+    )
+    overlaps = 0
+    last = {}
+    for staff_id, start_at, end_at in rows:
+        prev_end = last.get(staff_id)
+        if prev_end is not None and start_at < prev_end:
+            overlaps += 1
+        last[staff_id] = max(prev_end or end_at, end_at)
+    return overlaps
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--attempts", type=int, default=100, help="クライアント1つあたりの予約試行回数")
+    parser.add_argument("--staff", type=int, default=2)
+    parser.add_argument("--rounds", type=int, default=5, help="奪い合う日数（1日 = 1ラウンド）")
+    parser.add_argument("--db", default=None, help="SQLite ファイル（省略時は一時ファイル）")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="bench_booking_"), "bench.db")
+    salon_id, service_id = setup(path, args.staff)
+    staff_ids = [s.id for s in SalonStaff.select(SalonStaff.id).where(SalonStaff.salon == salon_id)]
+    db.close()
+
+    first_day = datetime.now().date() + timedelta(days=1)
+    total_ok = total_unavailable = total_busy = 0
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.clients) as pool:
+        for r in range(args.rounds):
+            day = first_day + timedelta(days=r)
+            jobs = [
+                (path, r * args.clients + c, salon_id, service_id, staff_ids, day,
+                 args.attempts // args.rounds or 1, r * 1000 + c)
+                for c in range(args.clients)
+            ]
+            for ok, unavailable, busy in pool.map(client, jobs):
+                total_ok += ok
+                total_unavailable += unavailable
+                total_busy += busy
+    elapsed = time.perf_counter() - started
+
+    db.init(path)
+    overlaps = count_overlaps(salon_id)
+    stored = Reservation.select().where(Reservation.salon == salon_id).count()
+    attempts = total_ok + total_unavailable + total_busy
+
+    print(f"db:            {path}")
+    print(f"clients:       {args.clients}")
+    print(f"attempts:      {attempts}")
+    print(f"booked:        {total_ok} (stored {stored})")
+    print(f"rejected:      {total_unavailable}")
+    print(f"busy:          {total_busy}")
+    print(f"elapsed:       {elapsed:.2f}s")
+    print(f"bookings/sec:  {total_ok / elapsed:.1f}")
+    print(f"attempts/sec:  {attempts / elapsed:.1f}")
+    print(f"overlaps:      {overlaps}")
+    if overlaps or stored != total_ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# DB接続モードごとのスループット比較
+#
+# seed_data.py で作ったDBを各モードで開き、複数スレッドから /home/ と /coupon/ を
+# 叩き続けて requests/sec を表示する。モードごとに別プロセスで起動するので
+# database.py の接続設定（環境変数）がそのまま反映される。
+#
+#   python -m benchmarks.bench_db_modes --threads 8 --seconds 5
+#   BENCH_POSTGRES_URL=postgres+pool://... python -m benchmarks.bench_db_modes
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = ["/home/", "/coupon/"]
+
+
+def modes(path):
+    legacy = {
+        "DATABASE_URL": f"sqlite:///{path}",
+        "SQLITE_JOURNAL_MODE": "delete",
+        "SQLITE_SYNCHRONOUS": "full",
+        "SQLITE_CACHE_SIZE": "-2000",
+        "SQLITE_MMAP_SIZE": "0",
+        "SQLITE_BUSY_TIMEOUT_MS": "5000",
+    }
+    result = [
+        ("sqlite (journal=delete, no tuning)", legacy),
+        ("sqlite (wal, tuned)", {"DATABASE_URL": f"sqlite:///{path}"}),
+        ("sqlite+pool (wal, tuned)", {"DATABASE_URL": f"sqlite+pool:///{path}"}),
+    ]
+    if os.getenv("BENCH_POSTGRES_URL"):
+        result.append(("postgres+pool", {"DATABASE_URL": os.environ["BENCH_POSTGRES_URL"]}))
+    return result
+
+
+def worker(threads, seconds):
+    from app import create_app
+
+    app = create_app()
+    counts = {p: 0 for p in PATHS}
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def run():
+        nonlocal errors
+        client = app.test_client()
+        local = {p: 0 for p in PATHS}
+        local_errors = 0
+        i = 0
+        while time.perf_counter() < deadline:
+            path = PATHS[i % len(PATHS)]
+            i += 1
+            if client.get(path).status_code == 200:
+                local[path] += 1
+            else:
+                local_errors += 1
+        with lock:
+            for p in PATHS:
+                counts[p] += local[p]
+            errors += local_errors
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    print(json.dumps({"rps": {p: counts[p] / seconds for p in PATHS}, "errors": errors}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.threads, args.seconds)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="bench_db_modes_")
+    seeded = os.path.join(workdir, "seed.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{seeded}", SQLITE_JOURNAL_MODE="delete")
+    subprocess.run([sys.executable, "seed_data.py"], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    print(f"{'mode':<36} {'/home/':>10} {'/coupon/':>10} {'errors':>7}")
+    path = os.path.join(workdir, "bench.db")
+    for name, mode_env in modes(path):
+        # モードごとにシード直後の状態から始める
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        shutil.copy(seeded, path)
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_db_modes", "--worker",
+             "--threads", str(args.threads), "--seconds", str(args.seconds)],
+            cwd=ROOT, env=dict(os.environ, **mode_env), check=True,
+            stdout=subprocess.PIPE, text=True,
+        )
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(f"{name:<36} {result['rps']['/home/']:>10.1f} {result['rps']['/coupon/']:>10.1f} "
+              f"{result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
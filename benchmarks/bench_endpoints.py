@@ -0,0 +1,324 @@
+# 主要エンドポイントのレイテンシ・SQL 本数
+#
+# seed_data.py の大量データモードで作ったDB（--db で既存ファイルも可）に対して create_app() を起動し、
+#   /home/  /home/detail/<id>  /coupon/  /info/  /reservation/  /liff-login（ローカルの LINE スタブで検証）
+# を叩いて、エンドポイントごとの p50/p95/p99・requests/sec・1リクエストあたりの SQL 本数を表示する。
+#   client : Flask のテストクライアント（ネットワークを通らないアプリ自体のコスト）
+#   http   : werkzeug のスレッド付きサーバを立て、--threads 本の requests.Session から叩く
+# 各スレッドは最初に /liff-login でログインし、以降は同じセッションで叩く。
+# --json で結果を書き出し、--compare で前回の JSON と比べる（p95 が --tolerance 以上悪化、
+# または SQL 本数が増えたエンドポイントがあれば終了コード 1）。
+#
+#   python -m benchmarks.bench_endpoints --salons 200 --users 20000 --reservations 300000 --json out.json
+#   python -m benchmarks.bench_endpoints --db bench.db --mode http --threads 8 --compare out.json
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ["/home/", "/home/detail/<id>", "/coupon/", "/info/", "/reservation/", "/liff-login"]
+SQL_HEADER = "X-Bench-SQL-Count"
+CHANNEL_ID = "30001"   # seed_data.py の大量データモードが作るチャネル
+
+
+def generate(path, salons, users, reservations, seed):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}")
+    subprocess.run(
+        [sys.executable, "seed_data.py", "--salons", str(salons), "--users", str(users),
+         "--reservations", str(reservations), "--seed", str(seed)],
+        cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+def percentile(values, p):
+    """最近傍順位法（values はソート済み）"""
+    if not values:
+        return None
+    k = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def install_sql_counter(app, db):
+    """リクエストごとの SQL 本数を数えてレスポンスヘッダで返す（テストクライアント・HTTP 共通）"""
+    local = threading.local()
+    execute_sql = db.execute_sql
+
+    def counting_execute_sql(*args, **kwargs):
+        local.count = getattr(local, "count", 0) + 1
+        return execute_sql(*args, **kwargs)
+
+    db.execute_sql = counting_execute_sql
+
+    @app.before_request
+    def reset_count():
+        local.count = 0
+
+    @app.after_request
+    def report_count(response):
+        response.headers[SQL_HEADER] = str(getattr(local, "count", 0))
+        return response
+
+
+class TestClientDriver:
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        return self.app.test_client()
+
+    def get(self, client, path):
+        resp = client.get(path)
+        return resp.status_code, resp.headers.get(SQL_HEADER)
+
+    def post_json(self, client, path, payload):
+        resp = client.post(path, json=payload)
+        return resp.status_code, resp.headers.get(SQL_HEADER)
+
+    def close(self):
+        pass
+
+
+class HttpDriver:
+    def __init__(self, app):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self._requests = requests
+        self._adapter = HTTPAdapter
+        self.server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def session(self):
+        session = self._requests.Session()
+        session.mount("http://", self._adapter(pool_connections=1, pool_maxsize=1))
+        return session
+
+    def get(self, client, path):
+        resp = client.get(self.base + path, timeout=30)
+        return resp.status_code, resp.headers.get(SQL_HEADER)
+
+    def post_json(self, client, path, payload):
+        resp = client.post(self.base + path, json=payload, timeout=30)
+        return resp.status_code, resp.headers.get(SQL_HEADER)
+
+    def close(self):
+        self.server.shutdown()
+
+
+def id_token(user_id):
+    """LINE スタブが受け付ける ID トークン（sub は大量データモードの顧客の line_user_id）"""
+    return f"stub:U_customer_{user_id:08d}:顧客{user_id}"
+
+
+def run_mode(driver, threads, requests_per_endpoint, warmup, salon_ids, customer_ids, seed):
+    """エンドポイントごとに threads 本で合計 requests_per_endpoint 回叩いて結果を返す"""
+    rng = random.Random(seed)
+    clients = []
+    for _ in range(threads):
+        client = driver.session()
+        status, _ = driver.post_json(client, "/liff-login", {"id_token": id_token(rng.choice(customer_ids))})
+        if status != 200:
+            raise SystemExit(f"login failed: HTTP {status}")
+        clients.append(client)
+    login_ids = iter(rng.sample(customer_ids, min(len(customer_ids), (requests_per_endpoint + warmup) * 2)))
+
+    def request(client, endpoint, local_rng):
+        if endpoint == "/liff-login":
+            # 毎回別ユーザのトークンにして、検証キャッシュに当たらない経路を測る
+            token = id_token(next(login_ids, local_rng.choice(customer_ids)))
+            return driver.post_json(client, endpoint, {"id_token": token})
+        if endpoint == "/home/detail/<id>":
+            return driver.get(client, f"/home/detail/{local_rng.choice(salon_ids)}")
+        return driver.get(client, endpoint)
+
+    results = {}
+    for endpoint in ENDPOINTS:
+        latencies, sql_counts = [], []
+        errors = 0
+        lock = threading.Lock()
+
+        def work(client, n, worker_seed, record):
+            nonlocal errors
+            local_rng = random.Random(worker_seed)
+            local_latencies, local_sql, local_errors = [], [], 0
+            for _ in range(n):
+                started = time.perf_counter()
+                status, sql_count = request(client, endpoint, local_rng)
+                elapsed = (time.perf_counter() - started) * 1000.0
+                if status >= 400:
+                    local_errors += 1
+                local_latencies.append(elapsed)
+                if sql_count is not None:
+                    local_sql.append(int(sql_count))
+            if record:
+                with lock:
+                    latencies.extend(local_latencies)
+                    sql_counts.extend(local_sql)
+                    errors += local_errors
+
+        def phase(total, record):
+            per_thread = [total // threads + (1 if i < total % threads else 0) for i in range(threads)]
+            pool = [threading.Thread(target=work, args=(clients[i], per_thread[i], rng.random(), record))
+                    for i in range(threads)]
+            started = time.perf_counter()
+            for t in pool:
+                t.start()
+            for t in pool:
+                t.join()
+            return time.perf_counter() - started
+
+        if warmup:
+            phase(warmup, record=False)
+        elapsed = phase(requests_per_endpoint, record=True)
+        latencies.sort()
+        results[endpoint] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "rps": len(latencies) / elapsed if elapsed else None,
+            "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "sql_mean": sum(sql_counts) / len(sql_counts) if sql_counts else None,
+            "sql_max": max(sql_counts) if sql_counts else None,
+        }
+    return results
+
+
+def print_results(mode, results):
+    print(f"\n[{mode}]")
+    print(f"{'endpoint':<20} {'req/s':>8} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'sql':>6} {'errors':>7}")
+    for endpoint, r in results.items():
+        print(f"{endpoint:<20} {r['rps']:>8.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+              f"{r['sql_mean']:>6.1f} {r['errors']:>7}")
+
+
+def compare(current, previous, tolerance):
+    """前回の結果と比べて悪化した項目の説明のリストを返す"""
+    regressions = []
+    print(f"\n{'mode':<7} {'endpoint':<20} {'p95 before':>11} {'p95 now':>9} {'sql before':>11} {'sql now':>8}")
+    for mode, results in current["results"].items():
+        for endpoint, now in results.items():
+            before = previous.get("results", {}).get(mode, {}).get(endpoint)
+            if before is None:
+                continue
+            print(f"{mode:<7} {endpoint:<20} {before['p95_ms']:>11.2f} {now['p95_ms']:>9.2f} "
+                  f"{before['sql_mean']:>11.1f} {now['sql_mean']:>8.1f}")
+            if now["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{mode} {endpoint}: p95 {before['p95_ms']:.2f} -> {now['p95_ms']:.2f} ms")
+            if now["sql_mean"] > before["sql_mean"] + 0.5:
+                regressions.append(f"{mode} {endpoint}: SQL {before['sql_mean']:.1f} -> {now['sql_mean']:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=None, help="既存の SQLite ファイル（省略時は一時ファイルに大量データを作る）")
+    parser.add_argument("--salons", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--reservations", type=int, default=300000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mode", choices=["client", "http", "both"], default="both")
+    parser.add_argument("--threads", type=int, default=8, help="http モードの同時接続数")
+    parser.add_argument("--client-threads", type=int, default=1, help="client モードのスレッド数")
+    parser.add_argument("--requests", type=int, default=500, help="エンドポイントごとのリクエスト数")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=30, help="LINE スタブの応答遅延")
+    parser.add_argument("--json", default=None, help="結果を書き出す JSON ファイル")
+    parser.add_argument("--compare", default=None, help="比較する前回の JSON ファイル")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="p95 の悪化を許す割合")
+    args = parser.parse_args()
+
+    path = args.db
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="bench_endpoints_"), "bench.db")
+        print(f"generating {path} ...", file=sys.stderr)
+        generate(path, args.salons, args.users, args.reservations, args.seed)
+
+    # database.py は import 時に接続先を決めるので、環境変数を整えてから読み込む
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["ENV"] = "bench"             # local 以外なら /liff-login が ID トークンを検証する
+    os.environ["LINE_CHANNEL_ID"] = CHANNEL_ID
+    os.environ["LINE_CHANNEL_SECRET"] = ""  # スタブのトークンは verify API 側で検証させる
+    import line_api
+    from benchmarks import line_stub
+    from app import create_app
+    from database import db, Salon, User
+
+    stub = line_stub.serve(latency_ms=args.latency_ms)
+    line_api.API_BASE = line_stub.base_url(stub)
+
+    app = create_app()
+    install_sql_counter(app, db)
+    with db.connection_context():
+        salon_ids = [sid for (sid,) in Salon.select(Salon.id).where(Salon.is_active == True).tuples()]
+        customer_ids = [uid for (uid,) in User.select(User.id).where(
+            (User.role == 0) & User.line_user_id.startswith("U_customer_")).tuples()]
+        counts = {"salons": len(salon_ids), "customers": len(customer_ids)}
+    if not salon_ids or not customer_ids:
+        raise SystemExit("no salons/customers in the database (generate it with seed_data.py --salons ...)")
+
+    modes = ["client", "http"] if args.mode == "both" else [args.mode]
+    output = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "db": path,
+            "dataset": counts,
+            "requests": args.requests,
+            "threads": {"client": args.client_threads, "http": args.threads},
+            "line_latency_ms": args.latency_ms,
+        },
+        "results": {},
+    }
+    for mode in modes:
+        if mode == "client":
+            driver, threads = TestClientDriver(app), args.client_threads
+        else:
+            driver, threads = HttpDriver(app), args.threads
+        try:
+            results = run_mode(driver, threads, args.requests, args.warmup, salon_ids, customer_ids, args.seed)
+        finally:
+            driver.close()
+        output["results"][mode] = results
+        print_results(mode, results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(output, json.load(f), args.tolerance)
+        if regressions:
+            print("\nregressions:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
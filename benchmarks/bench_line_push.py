@@ -0,0 +1,102 @@
+# LINE 配信ワーカーのスループット
+#
+# 一時DBに LINE 連携済みユーザと送信待ちのお知らせを作り、ローカルの LINE スタブに向けて
+# line_push を実行して messages/sec を表示する。比較用に、1人ずつ push する場合の速度も
+# 先頭 --baseline 人分だけ測って表示する。送信漏れ・二重送信があれば終了コード 1。
+#
+#   python -m benchmarks.bench_line_push --users 20000 --personal 2000 --latency-ms 30
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from database import db, create_tables, LineChannel, User, UserChannelLink, Notification
+import line_api
+import line_push
+from benchmarks import line_stub
+
+
+def setup(path, users, personal, broadcasts):
+    db.init(path)
+    create_tables()
+    now = datetime.utcnow()
+    with db.atomic():
+        channel = LineChannel.create(name="bench", channel_id="bench", channel_secret="secret",
+                                     channel_access_token="token")
+        for i in range(0, users, 1000):
+            n = min(1000, users - i)
+            User.insert_many(
+                [{"line_user_id": f"U{j:08d}", "created_at": now, "updated_at": now} for j in range(i, i + n)]
+            ).execute()
+        UserChannelLink.insert_from(
+            User.select(User.id, channel.id, User.line_user_id, User.created_at, User.updated_at),
+            [UserChannelLink.user, UserChannelLink.channel, UserChannelLink.channel_user_id,
+             UserChannelLink.created_at, UserChannelLink.updated_at],
+        ).execute()
+        rows = [
+            {"user": None, "title": f"キャンペーン {i}", "body": "本日限定", "type": "campaign",
+             "delivered_at": None, "created_at": now, "updated_at": now}
+            for i in range(broadcasts)
+        ]
+        rows += [
+            {"user": i % users + 1, "title": "明日のご予約", "body": f"予約番号 {i}", "type": "reminder",
+             "delivered_at": None, "created_at": now, "updated_at": now}
+            for i in range(personal)
+        ]
+        for i in range(0, len(rows), 500):
+            Notification.insert_many(rows[i:i + 500]).execute()
+    return users * broadcasts + personal
+
+
+def baseline(base, count):
+    """1人1リクエストで push した場合の messages/sec"""
+    session = line_api.http_session()
+    started = time.perf_counter()
+    for i in range(count):
+        session.post(line_api.url(line_api.MULTICAST_PATH, base),
+                     json={"to": [f"U{i:08d}"], "messages": [{"type": "text", "text": "x"}]},
+                     headers={"Authorization": "Bearer token"}, timeout=10)
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--broadcasts", type=int, default=1)
+    parser.add_argument("--personal", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=30)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--rate", type=float, default=line_push.DEFAULT_RATE_PER_SEC)
+    parser.add_argument("--concurrency", type=int, default=line_push.DEFAULT_CONCURRENCY)
+    parser.add_argument("--baseline", type=int, default=200)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_line_push_"), "bench.db")
+    expected = setup(path, args.users, args.personal, args.broadcasts)
+    server = line_stub.serve(latency_ms=args.latency_ms, rate_limit_every=args.rate_limit_every)
+    base = line_stub.base_url(server)
+
+    pusher = line_push.LinePusher(base_url=base, rate_per_sec=args.rate)
+    started = time.perf_counter()
+    sent = line_push.run(pusher, once=True, interval=0, concurrency=args.concurrency)
+    elapsed = time.perf_counter() - started
+    stats = server.state.stats()
+    pending = Notification.select().where(Notification.delivered_at.is_null()).count()
+
+    print(f"messages:   {sent} / expected {expected}")
+    print(f"requests:   {pusher.requests} (retries {pusher.retries}, 429 {stats['throttled']})")
+    print(f"elapsed:    {elapsed:.2f}s")
+    print(f"throughput: {sent / elapsed:.0f} messages/sec")
+    if args.baseline:
+        rate = baseline(base, args.baseline)
+        print(f"one-by-one: {rate:.0f} messages/sec ({expected / rate / 60:.1f} min for this campaign)")
+
+    if sent != expected or stats["messages"] != expected or pending:
+        print(f"NG: stub received {stats['messages']}, pending {pending}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# 近くのサロン検索（blueprints/home/nearby.py）のレイテンシ
+#
+# seed_data.py の大量データモードで作ったDB（--db で既存ファイルも可）に対して、地域の代表点の周りの
+# ランダムな地点から半径ごとに nearby_salons() を --repeat 回呼び、p50/p95 と平均件数を表示する。
+# 比較用に、今日のカードを全件読んで全サロンの距離を計算する方法（格子インデックスなし）も測る。
+#
+#   python -m benchmarks.bench_nearby --salons 5000 --users 2000 --reservations 20000
+#   python -m benchmarks.bench_nearby --db bench.db --radius 1 --radius 3 --radius 10
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date
+
+from database import db, SalonCard
+from blueprints.home.nearby import nearby_salons, distance_km, geocode
+from benchmarks.bench_endpoints import generate, percentile
+from seed_data import BULK_AREAS
+
+
+def full_scan(latitude, longitude, radius_km, today):
+    found = []
+    for salon_id, lat, lng in (
+        SalonCard
+        .select(SalonCard.salon, SalonCard.latitude, SalonCard.longitude)
+        .where((SalonCard.weekday == today.weekday()) & SalonCard.latitude.is_null(False))
+        .tuples()
+    ):
+        d = distance_km(latitude, longitude, lat, lng)
+        if d <= radius_km:
+            found.append((salon_id, d))
+    found.sort(key=lambda item: (item[1], item[0]))
+    return found[:50]
+
+
+def timed(fn, points):
+    times, sizes = [], []
+    for point in points:
+        started = time.perf_counter()
+        sizes.append(len(fn(*point)))
+        times.append((time.perf_counter() - started) * 1000)
+    times.sort()
+    return percentile(times, 50), percentile(times, 95), sum(sizes) / len(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=None, help="既存の大量データDB")
+    parser.add_argument("--salons", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--reservations", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--radius", type=float, action="append", help="半径 km（複数指定可。既定 1, 3, 10）")
+    args = parser.parse_args()
+
+    path = args.db
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix="bench_nearby_"), "bench.db")
+        generate(path, args.salons, args.users, args.reservations, args.seed)
+    db.init(path)
+
+    rng = random.Random(args.seed)
+    centers = [geocode(postal) for postal, _, _ in BULK_AREAS]
+    points = []
+    for _ in range(args.repeat):
+        lat, lng = rng.choice(centers)
+        points.append((lat + rng.gauss(0, 0.03), lng + rng.gauss(0, 0.03)))
+    today = date.today()
+
+    with db.connection_context():
+        salons = SalonCard.select().where(SalonCard.weekday == today.weekday()).count()
+        print(f"salon cards for today: {salons}")
+        print(f"{'radius':>7} {'method':<10} {'p50 ms':>8} {'p95 ms':>8} {'results':>8}")
+        for radius in args.radius or [1.0, 3.0, 10.0]:
+            for name, fn in (
+                ("grid", lambda lat, lng: nearby_salons(lat, lng, radius, today=today)),
+                ("full scan", lambda lat, lng: full_scan(lat, lng, radius, today)),
+            ):
+                fn(*points[0])   # キャッシュを温める
+                p50, p95, size = timed(fn, points)
+                print(f"{radius:>7g} {name:<10} {p50:>8.3f} {p95:>8.3f} {size:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# ワーカー起動時間
+#
+# 1) cold : 新しいプロセスで app を import して create_app() し、最初の /home/ に応答するまで
+#           （preload なしの gunicorn ワーカーや CLI の起動に相当）
+# 2) fork : app を読み込み済みの親プロセスから fork し、子が最初の /home/ に応答するまで
+#           （gunicorn の preload_app に相当）
+# をそれぞれ --runs 回測って中央値・最大を表示する。あわせて import と create_app() の間に
+# DB ファイルを作ったり接続を開いたりしていないか（import 時の I/O）を確かめる。
+#
+#   python -m benchmarks.bench_startup --runs 10
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLD = """
+import json, os, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+from database import db
+connected = not db.is_closed()
+probe = sys.argv[1]
+touched = os.path.exists(probe)
+status = app.test_client().get("/home/").status_code
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000, "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000, "total_ms": (served - started) * 1000,
+    "connected_at_import": connected, "db_file_created": touched, "status": status,
+}))
+"""
+
+
+def cold(db_path, probe_path, runs):
+    results = []
+    for _ in range(runs):
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}")
+        # import 時の I/O を確かめるため、存在しないDBを指す別プロセスでも import と create_app() だけ行う
+        probe_env = dict(os.environ, DATABASE_URL=f"sqlite:///{probe_path}")
+        subprocess.run([sys.executable, "-c", "from app import create_app; create_app()"],
+                       cwd=ROOT, env=probe_env, check=True)
+        out = subprocess.run([sys.executable, "-c", COLD, probe_path], cwd=ROOT, env=env, check=True,
+                             capture_output=True, text=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def fork(db_path, runs):
+    """親で app を読み込み、子で最初のリクエストに応答するまでの時間（fork 直前から計測）"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    sys.path.insert(0, ROOT)
+    from app import create_app
+
+    app = create_app()
+    app.test_client().get("/home/")   # 親でも接続を開いた状態で fork する（子が引き継がないこと）
+    results = []
+    for _ in range(runs):
+        read_fd, write_fd = os.pipe()
+        started = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = app.test_client().get("/home/").status_code
+            os.write(write_fd, json.dumps({
+                "total_ms": (time.perf_counter() - started) * 1000, "status": status,
+            }).encode())
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            payload = f.read()
+        os.waitpid(pid, 0)
+        results.append(json.loads(payload))
+    return results
+
+
+def summary(values):
+    values = sorted(values)
+    return {"median": statistics.median(values), "max": values[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--json", default=None, help="結果を書き出す JSON ファイル")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    db_path = os.path.join(workdir, "bench.db")
+    probe_path = os.path.join(workdir, "probe.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}")
+    subprocess.run([sys.executable, "seed_data.py"], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+
+    cold_runs = cold(db_path, probe_path, args.runs)
+    fork_runs = fork(db_path, args.runs)
+    result = {
+        "cold": {key: summary([r[key] for r in cold_runs])
+                 for key in ("import_ms", "create_app_ms", "first_request_ms", "total_ms")},
+        "fork": {"total_ms": summary([r["total_ms"] for r in fork_runs])},
+        "io_at_import": {
+            "connected": any(r["connected_at_import"] for r in cold_runs),
+            "db_file_created": os.path.exists(probe_path),
+        },
+        "errors": sum(1 for r in cold_runs + fork_runs if r["status"] != 200),
+    }
+
+    print(f"{'':<24} {'median ms':>10} {'max ms':>10}")
+    for key, value in result["cold"].items():
+        print(f"{'cold ' + key:<24} {value['median']:>10.1f} {value['max']:>10.1f}")
+    print(f"{'fork total_ms':<24} {result['fork']['total_ms']['median']:>10.1f} "
+          f"{result['fork']['total_ms']['max']:>10.1f}")
+    print(f"I/O at import: connected={result['io_at_import']['connected']} "
+          f"db_file_created={result['io_at_import']['db_file_created']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if result["errors"] or any(result["io_at_import"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# ローカル用の LINE API スタブ
+#
+# multicast と ID トークン検証だけを真似る。受け取った宛先数などは /stats で見られる。
+#   - POST /v2/bot/message/multicast  … 宛先数を数えて 200（同じ X-Line-Retry-Key の2回目以降は 409）
+#   - POST /oauth2/v2.1/verify         … id_token="stub:<sub>:<name>" を受け付ける
+#   - GET  /stats
+#
+#   python -m benchmarks.line_stub --port 8089 --latency-ms 20 --rate-limit-every 50
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import line_api
+
+
+class StubState:
+    def __init__(self, latency_ms=0, rate_limit_every=0):
+        self.latency = latency_ms / 1000.0
+        self.rate_limit_every = rate_limit_every
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.messages = 0
+        self.throttled = 0
+        self.duplicates = 0
+        self.retry_keys = set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "messages": self.messages,
+                "throttled": self.throttled,
+                "duplicates": self.duplicates,
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._reply(200, self.server.state.stats())
+        self._reply(404, {"message": "Not found"})
+
+    def do_POST(self):
+        state = self.server.state
+        raw = self._body()
+        if state.latency:
+            time.sleep(state.latency)
+
+        if self.path == line_api.MULTICAST_PATH:
+            payload = json.loads(raw or b"{}")
+            retry_key = self.headers.get("X-Line-Retry-Key")
+            with state.lock:
+                state.requests += 1
+                if state.rate_limit_every and state.requests % state.rate_limit_every == 0:
+                    state.throttled += 1
+                    throttled = True
+                else:
+                    throttled = False
+                    duplicate = retry_key is not None and retry_key in state.retry_keys
+                    if duplicate:
+                        state.duplicates += 1
+                    else:
+                        state.retry_keys.add(retry_key)
+                        state.messages += len(payload.get("to", []))
+            if throttled:
+                return self._reply(429, {"message": "The API rate limit has been exceeded."},
+                                   {"Retry-After": "0"})
+            if duplicate:
+                return self._reply(409, {"message": "The retry key is already accepted"})
+            return self._reply(200, {})
+
+        if self.path == line_api.VERIFY_PATH:
+            form = parse_qs(raw.decode("utf-8"))
+            token = (form.get("id_token") or [""])[0]
+            parts = token.split(":", 2)
+            with state.lock:
+                state.requests += 1
+            if len(parts) != 3 or parts[0] != "stub":
+                return self._reply(400, {"error": "invalid_request", "error_description": "Invalid IdToken."})
+            return self._reply(200, {
+                "iss": "https://access.line.me",
+                "sub": parts[1],
+                "aud": (form.get("client_id") or [""])[0],
+                "exp": int(time.time()) + 3600,
+                "iat": int(time.time()),
+                "name": parts[2],
+            })
+
+        self._reply(404, {"message": "Not found"})
+
+
+def serve(port=0, latency_ms=0, rate_limit_every=0):
+    """バックグラウンドで起動して server を返す（server.server_address で実際のポート）"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.state = StubState(latency_ms, rate_limit_every)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="N リクエストごとに 429 を返す")
+    args = parser.parse_args()
+    server = serve(args.port, args.latency_ms, args.rate_limit_every)
+    print(f"LINE stub listening on {base_url(server)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
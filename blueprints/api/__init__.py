@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+api_bp = Blueprint('api', __name__)
+
+from . import app_api
\ No newline at end of file
@@ -0,0 +1,300 @@
+from datetime import date, datetime
+from flask import request, jsonify, current_app
+from peewee import JOIN
+from . import api_bp
+
+from auth import current_user_id
+from database import (
+    Salon, Address, WorkingHour, BlackoutDate, Service, SalonImage, SalonRating, SalonCard
+)
+from pagination import decode_cursor, page_size, split_page
+from blueprints.home.search import search_salon_ids
+from blueprints.home.nearby import nearby_salons, DEFAULT_RADIUS_KM, MAX_RADIUS_KM
+from blueprints.home.salon_detail import detail_validators, UPCOMING_BLACKOUTS
+from blueprints.reservation.availability import find_free_slots, DEFAULT_STEP_MIN
+from blueprints.coupon.wallet import wallet_counts, wallet_page, TABS
+from blueprints.info.inbox import inbox_page, unread_count, FILTERS
+from .encoding import FieldError, requested_fields, columns, project, json_response, compress
+
+# 項目名 → 列。一覧・詳細とも選ばれた項目の列だけを SELECT する
+SALON_FIELDS = {
+    "id": SalonCard.salon,
+    "name": SalonCard.name,
+    "address": SalonCard.address_text,
+    "open_time": SalonCard.open_time,
+    "close_time": SalonCard.close_time,
+    "is_closed": SalonCard.is_closed,
+    "min_price_jpy": SalonCard.min_price_jpy,
+    "services": SalonCard.services,
+    "latitude": SalonCard.latitude,
+    "longitude": SalonCard.longitude,
+    "location_approximate": SalonCard.geo_approximate,   # 緯度経度が地域・都道府県の代表点
+    "rating_count": SalonRating.count,
+    "rating_average": SalonRating.average,
+}
+# メニュー・緯度経度は fields=services,latitude,longitude,location_approximate で明示したときだけ
+SALON_DEFAULT = [name for name in SALON_FIELDS
+                 if name not in ("services", "latitude", "longitude", "location_approximate")]
+
+DETAIL_FIELDS = {
+    "id": Salon.id,
+    "name": Salon.name,
+    "description": Salon.description,
+    "phone": Salon.phone,
+    "postal_code": Address.postal_code,
+    "prefecture": Address.prefecture,
+    "city": Address.city,
+    "line1": Address.line1,
+    "line2": Address.line2,
+    "rating_count": SalonRating.count,
+    "rating_average": SalonRating.average,
+}
+DETAIL_RELATIONS = ("hours", "services", "images", "blackouts")
+
+SERVICE_FIELDS = {
+    "id": Service.id,
+    "name": Service.name,
+    "description": Service.description,
+    "category": Service.category,
+    "duration_min": Service.duration_min,
+    "price_jpy": Service.price_jpy,
+}
+SLOT_FIELDS = ("start_at", "end_at", "staff_ids")
+COUPON_FIELDS = (
+    "id", "code", "name", "description", "type", "value", "scope", "salon", "service",
+    "use_limit", "starts_at", "ends_at", "used_count", "status",
+)
+NOTIFICATION_FIELDS = ("id", "salon", "title", "body", "type", "delivered_at", "is_read", "is_broadcast")
+
+api_bp.after_request(compress)
+
+
+@api_bp.errorhandler(FieldError)
+def unknown_fields(e):
+    return jsonify({"ok": False, "error": "unknown_fields", "fields": e.unknown}), 400
+
+
+def _card_query(names):
+    query = SalonCard.select(*columns(SALON_FIELDS, names))
+    if any(SALON_FIELDS[n].model is SalonRating for n in names):
+        query = query.join(SalonRating, JOIN.LEFT_OUTER, on=(SalonRating.salon == SalonCard.salon))
+    return query
+
+
+def _ranked_cards(names, salon_ids, weekday):
+    """検索結果をスコア順のカードにする（今日のカードが無いサロンは定休日扱い。home.search.cards_for と同じ）"""
+    if not salon_ids:
+        return []
+    chosen = {}
+    query = (_card_query(names)
+             .select_extend(SalonCard.weekday.alias("card_weekday"))
+             .where(SalonCard.salon.in_(salon_ids)))
+    for card in query.dicts():
+        card_weekday = card.pop("card_weekday")
+        if card_weekday == weekday:
+            chosen[card["id"]] = card
+        elif card["id"] not in chosen:
+            closed = {"is_closed": True, "open_time": None, "close_time": None}
+            chosen[card["id"]] = dict(card, **{k: v for k, v in closed.items() if k in card})
+    return [chosen[sid] for sid in salon_ids if sid in chosen]
+
+
+# サロン一覧（今日の曜日のカード、サロン id 順のキーセットページング）
+# 例: /api/v1/salons?fields=id,name,min_price_jpy&category=cut&limit=20&cursor=...
+#     /api/v1/salons?q=渋谷 カット   … キーワード検索（スコア順、ページングなし）
+@api_bp.route('/salons')
+def salons():
+    names = requested_fields(SALON_FIELDS, default=SALON_DEFAULT)
+    weekday = datetime.now().weekday()
+    q = request.args.get('q', '').strip()
+    category = request.args.get('category') or None
+    if q:
+        rows = _ranked_cards(names, search_salon_ids(q, category=category), weekday)
+        return json_response({"ok": True, "next_cursor": None, "salons": rows})
+
+    query = _card_query(names).where(SalonCard.weekday == weekday)
+    if category:
+        query = query.where(SalonCard.salon.in_(
+            Service.select(Service.salon).where((Service.category == category) & (Service.is_active == True))
+        ))
+    after = decode_cursor(request.args.get('cursor'), size=1)
+    if after:
+        query = query.where(SalonCard.salon > after[0])
+    limit = page_size(request.args.get('limit'))
+    rows, next_cursor = split_page(
+        query.order_by(SalonCard.salon).limit(limit + 1).dicts(), limit, key=lambda r: (r["id"],)
+    )
+    return json_response({"ok": True, "next_cursor": next_cursor, "salons": rows})
+
+
+# 近くのサロン（半径内を近い順。distance_km は小数第2位まで）
+# location_approximate が true のサロンは位置が地域・都道府県の代表点なので、distance_km もその点からの距離
+# 例: /api/v1/salons/nearby?lat=39.70&lng=141.15&radius_km=5&category=cut&open_today=1&limit=20
+@api_bp.route('/salons/nearby')
+def salons_nearby():
+    names = requested_fields(list(SALON_FIELDS) + ["distance_km"],
+                             default=SALON_DEFAULT + ["distance_km", "location_approximate"])
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lng', type=float)
+    if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return jsonify({"ok": False, "error": "lat and lng are required"}), 400
+    radius_km = request.args.get('radius_km', default=DEFAULT_RADIUS_KM, type=float)
+    if not 0 < radius_km <= MAX_RADIUS_KM:
+        return jsonify({"ok": False, "error": f"radius_km must be in (0, {MAX_RADIUS_KM:g}]"}), 400
+    today = date.today()
+    found = nearby_salons(
+        latitude, longitude, radius_km,
+        category=request.args.get('category') or None,
+        open_today=request.args.get('open_today') in ('1', 'true'),
+        today=today,
+        limit=page_size(request.args.get('limit')),
+    )
+    distances = dict(found)
+    cards = {}
+    if found:
+        card_names = [n for n in names if n != "distance_km"]
+        query = _card_query(card_names).where(
+            (SalonCard.weekday == today.weekday()) & SalonCard.salon.in_(list(distances))
+        )
+        cards = {card["id"]: card for card in query.dicts()}
+    rows = []
+    for salon_id, distance in found:
+        card = cards.get(salon_id)
+        if card is not None:
+            card["distance_km"] = round(distance, 2)
+            rows.append({n: card[n] for n in names})
+    return json_response({"ok": True, "salons": rows})
+
+
+def _relation(name, salon_id, today):
+    if name == "hours":
+        query = (WorkingHour
+                 .select(WorkingHour.weekday, WorkingHour.start, WorkingHour.end, WorkingHour.is_closed)
+                 .where(WorkingHour.salon == salon_id)
+                 .order_by(WorkingHour.weekday, WorkingHour.start))
+    elif name == "services":
+        query = (Service
+                 .select(*columns(SERVICE_FIELDS, SERVICE_FIELDS))
+                 .where((Service.salon == salon_id) & (Service.is_active == True))
+                 .order_by(Service.price_jpy, Service.id))
+    elif name == "images":
+        query = (SalonImage
+                 .select(SalonImage.url, SalonImage.alt)
+                 .where(SalonImage.salon == salon_id)
+                 .order_by(SalonImage.sort_order, SalonImage.id))
+    else:
+        query = (BlackoutDate
+                 .select(BlackoutDate.date, BlackoutDate.start, BlackoutDate.end, BlackoutDate.reason)
+                 .where((BlackoutDate.salon == salon_id) & (BlackoutDate.date >= today))
+                 .order_by(BlackoutDate.date, BlackoutDate.start)
+                 .limit(UPCOMING_BLACKOUTS))
+    return list(query.dicts())
+
+
+# サロン詳細（hours / services / images / blackouts は fields で選ばれたときだけ読む）
+# 関連行が変わっていなければ 304（ETag は /home/detail と同じ検証子。圧縮するので弱い ETag）
+@api_bp.route('/salons/<int:id>')
+def salon(id):
+    names = requested_fields(list(DETAIL_FIELDS) + list(DETAIL_RELATIONS))
+    today = date.today()
+    etag, last_modified = detail_validators(id, today=today)
+    if etag is None:
+        return jsonify({"ok": False, "error": "salon not found"}), 404
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = bool(request.if_modified_since and request.if_modified_since >= last_modified)
+
+    if not_modified:
+        resp = current_app.response_class(status=304)
+    else:
+        query = Salon.select(*columns(DETAIL_FIELDS, names))
+        if any(DETAIL_FIELDS[n].model is Address for n in names if n in DETAIL_FIELDS):
+            query = query.join(Address, JOIN.LEFT_OUTER, on=(Salon.address == Address.id))
+        if any(DETAIL_FIELDS[n].model is SalonRating for n in names if n in DETAIL_FIELDS):
+            query = query.join(SalonRating, JOIN.LEFT_OUTER, on=(SalonRating.salon == Salon.id))
+        row = query.where(Salon.id == id).dicts().first()
+        if row is None:
+            return jsonify({"ok": False, "error": "salon not found"}), 404
+        for name in names:
+            if name in DETAIL_RELATIONS:
+                row[name] = _relation(name, id, today)
+        resp = json_response({"ok": True, "salon": {n: row[n] for n in names}})
+    resp.set_etag(etag, weak=True)
+    resp.last_modified = last_modified
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
+
+
+# 公開中のメニュー（安い順）
+@api_bp.route('/salons/<int:id>/services')
+def services(id):
+    names = requested_fields(SERVICE_FIELDS)
+    rows = (Service
+            .select(*columns(SERVICE_FIELDS, names))
+            .where((Service.salon == id) & (Service.is_active == True))
+            .order_by(Service.price_jpy, Service.id)
+            .dicts())
+    return json_response({"ok": True, "services": list(rows)})
+
+
+# 空き枠（/reservation/slots と同じパラメータ。日数は availability.MAX_DAYS まで）
+# 例: /api/v1/salons/1/slots?service_id=2&days=14&fields=start_at
+@api_bp.route('/salons/<int:id>/slots')
+def slots(id):
+    names = requested_fields(SLOT_FIELDS, always=())
+    service_id = request.args.get('service_id', type=int)
+    if service_id is None:
+        return jsonify({"ok": False, "error": "service_id is required"}), 400
+    start_date = None
+    if request.args.get('date'):
+        try:
+            start_date = datetime.strptime(request.args['date'], '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({"ok": False, "error": "invalid date"}), 400
+
+    found = find_free_slots(
+        id, service_id,
+        days=request.args.get('days', default=7, type=int),
+        start_date=start_date,
+        staff_id=request.args.get('staff_id', type=int),
+        step_min=request.args.get('step', default=DEFAULT_STEP_MIN, type=int),
+    )
+    if found is None:
+        return jsonify({"ok": False, "error": "service not found"}), 404
+    return json_response({"ok": True, "slots": list(project(found, names))})
+
+
+# クーポン（/coupon と同じタブ・ページング）
+@api_bp.route('/coupons')
+def coupons():
+    names = requested_fields(COUPON_FIELDS)
+    tab = request.args.get('tab', 'available')
+    if tab not in TABS:
+        tab = 'available'
+    user_id = current_user_id()
+    rows, next_cursor = wallet_page(
+        user_id, tab,
+        cursor=request.args.get('cursor'),
+        limit=page_size(request.args.get('limit')),
+    )
+    envelope = {"ok": True, "tab": tab, "counts": wallet_counts(user_id), "next_cursor": next_cursor}
+    return json_response(dict(envelope, coupons=list(project(rows, names))))
+
+
+# お知らせ（/info と同じフィルタ・ページング）
+@api_bp.route('/notifications')
+def notifications():
+    names = requested_fields(NOTIFICATION_FIELDS)
+    status = request.args.get('filter', 'all')
+    if status not in FILTERS:
+        status = 'all'
+    user_id = current_user_id()
+    rows, next_cursor = inbox_page(
+        user_id, status,
+        cursor=request.args.get('cursor'),
+        limit=page_size(request.args.get('limit')),
+    )
+    envelope = {"ok": True, "filter": status, "unread": unread_count(user_id), "next_cursor": next_cursor}
+    return json_response(dict(envelope, notifications=list(project(rows, names))))
@@ -0,0 +1,157 @@
+# /api/v1 のレスポンス組み立て
+#
+# - ?fields=id,name,... で返す項目を選ぶ（一覧・詳細とも、選ばれた項目の列・サブクエリだけを読む）
+# - 件数に上限のある一覧（ページ・検索結果・空き枠など）は読み切ってから json_response で返す。
+#   stream() はページで区切れない一覧用（流し始めると 200 が確定するので、途中で DB エラーになると
+#   本文が切れたまま終わる。上限のある一覧には使わない）
+# - Accept-Encoding に応じて br / gzip で圧縮する。br は requirements.txt の Brotli を使う
+#   （入っていない環境では br を提示せず gzip だけになる）
+#   小さいレスポンスは圧縮しない。流すレスポンスは流しながら圧縮する
+import json
+import zlib
+from datetime import date, datetime, time
+
+from flask import Response, request, stream_with_context
+
+try:
+    import brotli
+except ImportError:  # requirements.txt にあるが、入っていなければ gzip だけを提示する
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1024
+STREAM_CHUNK = 16 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class FieldError(ValueError):
+    """?fields= に知らない項目名がある"""
+
+    def __init__(self, unknown):
+        super().__init__(", ".join(unknown))
+        self.unknown = unknown
+
+
+def _default(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def dumps(value):
+    return _encoder.encode(value)
+
+
+# ---- 項目の選択 ----
+def requested_fields(available, default=None, always=("id",)):
+    """
+    ?fields= で選ばれた項目名のリスト（未指定なら default、それも無ければ available 全部）。
+    always の項目（ページングのキーなど）は常に含める。知らない名前があれば FieldError。
+    """
+    raw = request.args.get("fields", "")
+    names = [n.strip() for n in raw.split(",") if n.strip()]
+    if not names:
+        names = list(default or available)
+    unknown = [n for n in names if n not in available]
+    if unknown:
+        raise FieldError(unknown)
+    missing = [n for n in always if n not in names]
+    return missing + list(dict.fromkeys(names))
+
+
+def columns(mapping, names):
+    """{項目名: 列} から選ばれた項目だけを項目名の別名付きで SELECT する列にする"""
+    return [mapping[n].alias(n) for n in names if n in mapping]
+
+
+def project(rows, names):
+    """読み込み済みの dict から選ばれた項目だけを残す（順序は names の通り）"""
+    for row in rows:
+        yield {n: row[n] for n in names}
+
+
+def json_response(value, status=200):
+    return Response(dumps(value), status=status, mimetype="application/json")
+
+
+# ---- 一覧を流す ----
+def _buffered(pieces, size=STREAM_CHUNK):
+    buffer = []
+    filled = 0
+    for piece in pieces:
+        data = piece.encode("utf-8")
+        buffer.append(data)
+        filled += len(data)
+        if filled >= size:
+            yield b"".join(buffer)
+            buffer = []
+            filled = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def stream(envelope, key, rows):
+    """envelope（dict）の key に rows を1行ずつ書き足した JSON を流すレスポンス"""
+    head = dumps(envelope)[:-1] + ("," if envelope else "") + dumps(key) + ":["
+
+    def generate():
+        yield head
+        for i, row in enumerate(rows):
+            yield ("," if i else "") + dumps(row)
+        yield "]}"
+
+    return Response(stream_with_context(_buffered(generate())), mimetype="application/json")
+
+
+# ---- 圧縮 ----
+def negotiate():
+    """Accept-Encoding から使う圧縮方式（br / gzip / None）"""
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+
+def _compressor(encoding):
+    if encoding == "br":
+        c = brotli.Compressor(quality=BROTLI_QUALITY)
+        return c.process, c.finish
+    c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress, c.flush
+
+
+def _compress_stream(chunks, encoding):
+    feed, finish = _compressor(encoding)
+    try:
+        for chunk in chunks:
+            data = feed(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def compress(response):
+    """after_request: JSON を Accept-Encoding に合わせて圧縮する"""
+    response.vary.add("Accept-Encoding")
+    if (response.status_code in (204, 304) or response.mimetype != "application/json"
+            or "Content-Encoding" in response.headers):
+        return response
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < MIN_COMPRESS_SIZE:
+            return response
+        feed, finish = _compressor(encoding)
+        response.set_data(feed(body) + finish())
+    response.headers["Content-Encoding"] = encoding
+    return response
@@ -1,9 +1,50 @@
-from flask import render_template, request, redirect, url_for
+from flask import render_template, request, redirect, url_for, jsonify
 from . import coupon_bp
 
-from database import Coupon
+from auth import current_user_id
+from database import Service
+from pagination import page_size
+from .engine import applicable_coupons
+from .wallet import wallet_counts, wallet_page, TABS
 
 @coupon_bp.route('/')
 def coupon():
-    coupons = Coupon.select()
-    return render_template('coupon.html', coupons=coupons)
\ No newline at end of file
+    tab = request.args.get('tab', 'available')
+    if tab not in TABS:
+        tab = 'available'
+    user_id = current_user_id()
+    coupons, next_cursor = wallet_page(
+        user_id, tab,
+        cursor=request.args.get('cursor'),
+        limit=page_size(request.args.get('limit')),
+    )
+    return render_template('coupon.html', coupons=coupons, tab=tab,
+                           counts=wallet_counts(user_id), next_cursor=next_cursor)
+
+# 会計時に使えるクーポン（割引額の大きい順、先頭が最安）
+# 例: /coupon/applicable?salon_id=1&service_id=2
+@coupon_bp.route('/applicable')
+def applicable():
+    salon_id = request.args.get('salon_id', type=int)
+    service_id = request.args.get('service_id', type=int)
+    service = (
+        Service
+        .select(Service.id, Service.price_jpy)
+        .where((Service.id == service_id) & (Service.salon == salon_id) & (Service.is_active == True))
+        .first()
+    )
+    if service is None:
+        return jsonify({"ok": False, "error": "service not found"}), 404
+
+    offers = applicable_coupons(current_user_id(), salon_id, service.id, service.price_jpy)
+    return jsonify({
+        "ok": True,
+        "price_jpy": service.price_jpy,
+        "amount_jpy": offers[0]["amount_jpy"] if offers else service.price_jpy,
+        "coupons": [{
+            "code": o["code"],
+            "name": o["name"],
+            "discount_jpy": o["discount_jpy"],
+            "amount_jpy": o["amount_jpy"],
+        } for o in offers],
+    })
@@ -0,0 +1,163 @@
+# クーポン適用判定と最安値計算
+#
+# 有効なクーポンを1クエリで読み、scope ごとの索引（全体 / サロン別 / メニュー別）を
+# プロセス内にキャッシュしておく。判定時に引くのは該当サロン・メニューの候補だけで、
+# 利用回数は候補分を CouponRedemption から GROUP BY 1クエリでまとめて数える。
+import os
+import threading
+import time
+from datetime import datetime
+
+from peewee import fn
+
+from database import on_write, Coupon, CouponRedemption
+
+CACHE_TTL_SEC = float(os.getenv("COUPON_CACHE_TTL_SEC", "30"))
+
+_FIELDS = (
+    Coupon.id, Coupon.code, Coupon.name, Coupon.description, Coupon.type, Coupon.value,
+    Coupon.scope, Coupon.salon, Coupon.service, Coupon.use_limit,
+    Coupon.starts_at, Coupon.ends_at,
+)
+
+
+class CouponIndex:
+    """有効クーポンの scope 別索引（読み取り専用。作り直すときは丸ごと差し替える）"""
+
+    def __init__(self, coupons):
+        self.global_ = []
+        self.by_salon = {}
+        self.by_service = {}
+        for c in coupons:
+            if c["scope"] == "global":
+                self.global_.append(c)
+            elif c["scope"] == "salon" and c["salon"] is not None:
+                self.by_salon.setdefault(c["salon"], []).append(c)
+            elif c["scope"] == "service" and c["service"] is not None:
+                self.by_service.setdefault(c["service"], []).append(c)
+
+    def candidates(self, salon_id, service_id):
+        return self.global_ + self.by_salon.get(salon_id, []) + self.by_service.get(service_id, [])
+
+
+_lock = threading.Lock()
+_cache = {"index": None, "expires": 0.0}
+
+
+def _load_index(now):
+    coupons = (
+        Coupon
+        .select(*_FIELDS)
+        .where(
+            (Coupon.is_active == True)
+            & (Coupon.ends_at.is_null() | (Coupon.ends_at >= now))
+        )
+        .dicts()
+    )
+    return CouponIndex(coupons)
+
+
+def coupon_index():
+    """キャッシュ済みの索引（自プロセスの書き込みで即時、他プロセス分は TTL で入れ替わる）"""
+    index = _cache["index"]
+    if index is not None and _cache["expires"] > time.monotonic():
+        return index
+    with _lock:
+        if _cache["index"] is None or _cache["expires"] <= time.monotonic():
+            _cache["index"] = _load_index(datetime.now())
+            _cache["expires"] = time.monotonic() + CACHE_TTL_SEC
+        return _cache["index"]
+
+
+def invalidate():
+    _cache["expires"] = 0.0
+
+
+@on_write(Coupon)
+def _on_coupon_write(coupon, action):
+    invalidate()
+
+
+def usage_counts(user_id, coupon_ids):
+    """ユーザのクーポン別利用回数（1クエリ）"""
+    if user_id is None or not coupon_ids:
+        return {}
+    return dict(
+        CouponRedemption
+        .select(CouponRedemption.coupon, fn.COUNT(CouponRedemption.id))
+        .where((CouponRedemption.user == user_id) & (CouponRedemption.coupon.in_(coupon_ids)))
+        .group_by(CouponRedemption.coupon)
+        .tuples()
+    )
+
+
+def discount_for(coupon, price_jpy):
+    if coupon["type"] == "percent":
+        discount = int(price_jpy * coupon["value"] / 100)
+    else:
+        discount = int(coupon["value"])
+    return max(0, min(discount, price_jpy))
+
+
+def check(coupon, salon_id, service_id, at, used=0):
+    """適用できなければ理由の文字列、できれば None"""
+    if coupon.get("is_active") is False:
+        return "coupon is not active"
+    if coupon["starts_at"] and at < coupon["starts_at"]:
+        return "coupon is not started"
+    if coupon["ends_at"] and at > coupon["ends_at"]:
+        return "coupon is expired"
+    if coupon["scope"] == "salon" and coupon["salon"] != salon_id:
+        return "coupon is not for this salon"
+    if coupon["scope"] == "service" and coupon["service"] != service_id:
+        return "coupon is not for this service"
+    if coupon["use_limit"] is not None and used >= coupon["use_limit"]:
+        return "coupon use limit reached"
+    return None
+
+
+def _offer(coupon, price_jpy):
+    discount = discount_for(coupon, price_jpy)
+    return dict(coupon, discount_jpy=discount, amount_jpy=price_jpy - discount)
+
+
+def applicable_coupons(user_id, salon_id, service_id, price_jpy, at=None):
+    """
+    (ユーザ, サロン, メニュー, 日時) に使えるクーポンを割引額の大きい順に返す。
+    各要素はクーポンの列に discount_jpy / amount_jpy（適用後の金額）を足した dict。
+    """
+    at = at or datetime.now()
+    candidates = coupon_index().candidates(salon_id, service_id)
+    limited = [c["id"] for c in candidates if c["use_limit"] is not None]
+    used = usage_counts(user_id, limited)  # 未ログインなら回数制限付きも「未使用」として表示
+    offers = [
+        _offer(c, price_jpy)
+        for c in candidates
+        if check(c, salon_id, service_id, at, used.get(c["id"], 0)) is None
+    ]
+    offers.sort(key=lambda o: (-o["discount_jpy"], o["id"]))
+    return offers
+
+
+def best_offer(user_id, salon_id, service_id, price_jpy, at=None):
+    """最も安くなるクーポン（無ければ None）と最終金額"""
+    offers = applicable_coupons(user_id, salon_id, service_id, price_jpy, at)
+    if not offers:
+        return None, price_jpy
+    return offers[0], offers[0]["amount_jpy"]
+
+
+def offer_for_code(code, user_id, salon_id, service_id, price_jpy, at=None):
+    """
+    コード指定の判定。キャッシュは使わず DB から読む（予約確定時用）。
+    戻り値は (offer, None) か (None, 理由)。
+    """
+    at = at or datetime.now()
+    coupon = Coupon.select(*_FIELDS, Coupon.is_active).where(Coupon.code == code).dicts().first()
+    if coupon is None:
+        return None, "coupon not found"
+    used = usage_counts(user_id, [coupon["id"]]).get(coupon["id"], 0)
+    reason = check(coupon, salon_id, service_id, at, used)
+    if reason:
+        return None, reason
+    return _offer(coupon, price_jpy), None
@@ -0,0 +1,110 @@
+# ユーザごとのクーポン一覧（利用可能 / 使用済み / 期限切れ）
+#
+# ユーザの利用回数を CouponRedemption から GROUP BY したサブクエリを LEFT JOIN し、
+# 状態の判定も SQL 側で行う。一覧は (ends_at IS NULL, ends_at, id) のキーセットページング
+# （期限なしは最後。database.py の coupon_wallet_order 索引の順に読む）。
+# タブは重ならない:
+#   使用済み   … ユーザが1回以上使った（利用履歴がある）クーポン。回数上限の無いクーポンも、使えばここに移る
+#   期限切れ   … 使っていないまま期限を過ぎた
+#   利用可能   … 使っていない・期限内・開始済み（開始前はどのタブにも出さない）
+# タブごとの件数は同じ条件を CASE にして、1回の GROUP BY で数える。
+from datetime import datetime
+
+from peewee import Case, JOIN, Tuple, fn
+
+from database import Coupon, CouponRedemption
+from pagination import decode_cursor, split_page, DEFAULT_PAGE_SIZE
+
+TABS = ("available", "used", "expired")
+
+_FIELDS = (
+    Coupon.id, Coupon.code, Coupon.name, Coupon.description, Coupon.type, Coupon.value,
+    Coupon.scope, Coupon.salon, Coupon.service, Coupon.use_limit,
+    Coupon.starts_at, Coupon.ends_at,
+)
+
+
+def _wallet_parts(user_id, now):
+    used_sq = (
+        CouponRedemption
+        .select(CouponRedemption.coupon, fn.COUNT(CouponRedemption.id).alias("used"))
+        .where(CouponRedemption.user == user_id)
+        .group_by(CouponRedemption.coupon)
+        .alias("r")
+    )
+    used = fn.COALESCE(used_sq.c.used, 0)
+    redeemed = used_sq.c.coupon_id.is_null(False)
+    unused = used_sq.c.coupon_id.is_null()
+    conditions = {
+        "used": redeemed,
+        "expired": unused & Coupon.ends_at.is_null(False) & (Coupon.ends_at < now),
+        "available": (
+            unused
+            & (Coupon.ends_at.is_null() | (Coupon.ends_at >= now))
+            & (Coupon.starts_at.is_null() | (Coupon.starts_at <= now))
+        ),
+    }
+    base = (
+        Coupon
+        .select()
+        .join(used_sq, JOIN.LEFT_OUTER, on=(used_sq.c.coupon_id == Coupon.id))
+        .where(Coupon.is_active == True)
+    )
+    return base, used, conditions
+
+
+def wallet_counts(user_id, now=None):
+    """タブごとの件数（_wallet_parts と同じ条件を CASE にして1回の GROUP BY で数える）"""
+    now = now or datetime.now()
+    base, _, conditions = _wallet_parts(user_id, now)
+    tab = Case(None, [(conditions[t], t) for t in ("used", "expired", "available")], None)
+    counts = dict.fromkeys(TABS, 0)
+    for name, n in base.select(tab.alias("tab"), fn.COUNT(Coupon.id)).group_by(tab).tuples():
+        if name is not None:
+            counts[name] = n
+    return counts
+
+
+def _after(no_end, ends_at, coupon_id, ascending):
+    """
+    並び順 (ends_at IS NULL, ends_at, id) でカーソルより後の行の条件。
+    ends_at が NULL の行は行値の比較が NULL になるので、期限あり・なしに分けて書く
+    """
+    if no_end:
+        rest = Coupon.ends_at.is_null() & ((Coupon.id > coupon_id) if ascending else (Coupon.id < coupon_id))
+        return rest if ascending else (rest | Coupon.ends_at.is_null(False))
+    key = Tuple(Coupon.ends_at, Coupon.id)
+    rest = Coupon.ends_at.is_null(False) & ((key > Tuple(ends_at, coupon_id)) if ascending
+                                           else (key < Tuple(ends_at, coupon_id)))
+    return (rest | Coupon.ends_at.is_null()) if ascending else rest
+
+
+def wallet_page(user_id, tab="available", cursor=None, limit=DEFAULT_PAGE_SIZE, now=None):
+    """
+    1タブ分のページを返す: (rows, next_cursor)
+    利用可能は期限の近い順、使用済み・期限切れは期限の新しい順。
+    """
+    if tab not in TABS:
+        tab = "available"
+    now = now or datetime.now()
+    base, used, conditions = _wallet_parts(user_id, now)
+    no_end = Coupon.ends_at.is_null()
+
+    query = base.select(*_FIELDS, used.alias("used_count"))
+    query = query.where(conditions[tab])
+
+    after = decode_cursor(cursor, size=3)
+    ascending = tab == "available"
+    if after:
+        query = query.where(_after(*after, ascending))
+    if ascending:
+        query = query.order_by(no_end, Coupon.ends_at, Coupon.id)
+    else:
+        query = query.order_by(no_end.desc(), Coupon.ends_at.desc(), Coupon.id.desc())
+
+    rows, next_cursor = split_page(
+        query.limit(limit + 1).dicts(), limit, key=lambda r: (r["ends_at"] is None, r["ends_at"], r["id"])
+    )
+    for r in rows:
+        r["status"] = tab
+    return rows, next_cursor
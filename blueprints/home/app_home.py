@@ -1,35 +1,85 @@
 from datetime import datetime
-from peewee import prefetch, JOIN
-from flask import render_template, request, redirect, url_for
+from flask import render_template, request, redirect, url_for, session, abort, make_response, current_app, jsonify
 from . import home_bp
 
-from database import Salon , Service , Address ,WorkingHour
+from database import SalonCard
+from pagination import page_size
+from . import salon_cards  # noqa: F401  書き込みフックの登録
+from .search import search_salon_ids, category_facets, cards_for, card_query
+from .ratings import review_page, top_rated_salon_ids, REVIEW_PAGE_SIZE
+from .keywords import counter as keyword_counter, trending_keywords
+from .salon_detail import detail_validators, load_detail
 
 @home_bp.route('/')
 def home():
+    # 読み取りモデルから今日の曜日のカードを1クエリで取得
     today_weekday = datetime.now().weekday()
-    salons_q = (
-        Salon
-        .select(Salon, Address, WorkingHour)
-        .join(Address)
-        .switch(Salon)
-        .join(WorkingHour)
-        .where(
-            WorkingHour.weekday == today_weekday
-        )
+    salons = (
+        card_query()
+        .where(SalonCard.weekday == today_weekday)
+        .order_by(SalonCard.salon)
+        .dicts()
     )
-    services_q = (
-        Service
-        .select()
-    )
-    salons = prefetch(salons_q, services_q)
-    return render_template('home.html', salons=salons)
+    return render_template('home.html', salons=salons, trending=trending_keywords())
+
+# サロン検索（キーワード: サロン名・メニュー・エリア / カテゴリ）
+@home_bp.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    category = request.args.get('category') or None
+    if not q and not category:
+        return redirect(url_for('home.home'))
+
+    if q:
+        keyword_counter.hit(q)  # メモリに数えるだけ。DB への反映はバックグラウンドでまとめて行う
+    salon_ids = search_salon_ids(q, category=category)
+    facets = category_facets(search_salon_ids(q) if category else salon_ids)
+    return render_template('home.html', salons=cards_for(salon_ids),
+                           q=q, category=category, facets=facets)
 
-@home_bp.route('/detail/<id>')
+# 評価の高いサロン（SalonRating の (average, count) 索引から読む）
+@home_bp.route('/ranking')
+def ranking():
+    return render_template('home.html', salons=cards_for(top_rated_salon_ids()), ranking=True)
+
+@home_bp.route('/detail/<int:id>')
 def detail(id):
-    salon = Salon.get(Salon.id == id)
-    services = Service.select().where(Service.salon == salon)
-    workinghour = WorkingHour.get(WorkingHour.id == id)
+    # 関連行が変わっていなければテンプレートを描画せずに 304 を返す
+    etag, last_modified = detail_validators(id, viewer=session.get("line_id"))
+    if etag is None:
+        abort(404)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = bool(request.if_modified_since and request.if_modified_since >= last_modified)
+
+    if not_modified:
+        resp = current_app.response_class(status=304)
+    else:
+        data = load_detail(id)
+        if data is None:
+            abort(404)
+        resp = make_response(render_template('home_detail.html', **data))
 
+    resp.set_etag(etag)
+    resp.last_modified = last_modified
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
 
-    return render_template('home_detail.html', salon=salon, services=services ,workinghour=workinghour)
\ No newline at end of file
+# 口コミ一覧（新しい順、JSON）
+# 例: /home/detail/1/reviews?cursor=...&limit=10
+@home_bp.route('/detail/<int:id>/reviews')
+def reviews(id):
+    rows, next_cursor = review_page(
+        id,
+        cursor=request.args.get('cursor'),
+        limit=page_size(request.args.get('limit'), default=REVIEW_PAGE_SIZE),
+    )
+    return jsonify({"ok": True, "next_cursor": next_cursor, "reviews": [{
+        "id": r["id"],
+        "rating": r["rating"],
+        "comment": r["comment"],
+        "user_name": r["user_name"],
+        "created_at": r["created_at"].isoformat(),
+    } for r in rows]})
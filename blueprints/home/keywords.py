@@ -0,0 +1,143 @@
+# 検索キーワードの集計（ライトビハインド）
+#
+# 検索のたびに SearchKeyword を UPDATE すると、SQLite の書き込みロックを
+# すべての検索リクエストが奪い合うことになる。リクエスト中はメモリ上で数えるだけにして、
+# バックグラウンドスレッドが一定時間・一定件数ごとにまとめて UPSERT する。
+import atexit
+import os
+import threading
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime
+
+from peewee import EXCLUDED, chunked
+
+from database import db, SearchKeyword
+
+FLUSH_INTERVAL_SEC = float(os.getenv("KEYWORD_FLUSH_INTERVAL_SEC", "5"))
+FLUSH_MAX_PENDING = int(os.getenv("KEYWORD_FLUSH_MAX_PENDING", "500"))
+TRENDING_TTL_SEC = 60
+MAX_KEYWORD_LENGTH = 64
+UPSERT_CHUNK = 100
+
+
+def normalize_keyword(keyword):
+    """全角英数・大文字小文字・前後空白の揺れをまとめる"""
+    keyword = unicodedata.normalize("NFKC", keyword or "").strip().lower()
+    return " ".join(keyword.split())[:MAX_KEYWORD_LENGTH]
+
+
+class KeywordCounter:
+    """
+    キーワードの出現回数をプロセス内で溜めておき、まとめて書き出すバッファ。
+    - hit() はロックを取ってメモリ上の Counter を増やすだけ（DB に触れない）
+    - FLUSH_INTERVAL_SEC ごと、または溜まった種類数が FLUSH_MAX_PENDING を超えたら
+      バックグラウンドスレッドが INSERT ... ON CONFLICT DO UPDATE count = count + ? で反映
+    - プロセス終了時にも残りを書き出す
+    """
+
+    def __init__(self, interval=FLUSH_INTERVAL_SEC, max_pending=FLUSH_MAX_PENDING):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def hit(self, keyword):
+        keyword = normalize_keyword(keyword)
+        if not keyword:
+            return
+        with self._lock:
+            self._pending[keyword] += 1
+            full = len(self._pending) >= self.max_pending
+        self._ensure_worker()
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        """溜まっている件数を書き出す（失敗したら次回に持ち越す）"""
+        with self._lock:
+            batch, self._pending = self._pending, Counter()
+        if not batch:
+            return 0
+        now = datetime.utcnow()
+        rows = [{"keyword": k, "count": n, "created_at": now, "updated_at": now} for k, n in batch.items()]
+        opened = db.is_closed()
+        try:
+            if opened:
+                db.connect()
+            with db.atomic():
+                for chunk in chunked(rows, UPSERT_CHUNK):
+                    (SearchKeyword
+                     .insert_many(chunk)
+                     .on_conflict(
+                         conflict_target=[SearchKeyword.keyword],
+                         update={
+                             SearchKeyword.count: SearchKeyword.count + EXCLUDED.count,
+                             SearchKeyword.updated_at: now,
+                         })
+                     .execute())
+        except Exception:
+            with self._lock:
+                self._pending.update(batch)
+            raise
+        finally:
+            if opened and not db.is_closed():
+                db.close()
+        return len(rows)
+
+    def _ensure_worker(self):
+        # gunicorn の fork 後は親のスレッドが存在しないので、プロセスごとに起動し直す
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="keyword-counter", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.interval)  # DB が混んでいるときは少し待ってから再試行
+
+
+counter = KeywordCounter()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        counter.flush()
+    except Exception:
+        pass
+
+
+_trending_cache = {"expires": 0.0, "limit": 0, "rows": []}
+
+
+def trending_keywords(limit=10):
+    """人気キーワード（TRENDING_TTL_SEC 秒キャッシュ、未書き出し分は含まない）"""
+    now = time.monotonic()
+    cache = _trending_cache
+    if cache["expires"] > now and cache["limit"] >= limit:
+        return cache["rows"][:limit]
+    rows = list(
+        SearchKeyword
+        .select(SearchKeyword.keyword, SearchKeyword.count)
+        .order_by(SearchKeyword.count.desc(), SearchKeyword.id)
+        .limit(limit)
+        .dicts()
+    )
+    _trending_cache.update(expires=now + TRENDING_TTL_SEC, limit=limit, rows=rows)
+    return rows
@@ -0,0 +1,179 @@
+# 近くのサロン検索（緯度経度の格子インデックス）
+#
+# サロンの位置は Address.latitude/longitude。未設定なら同梱の表で引く（ネットワークの住所検索は使わない）:
+#   1) postal_codes.csv の7桁の行、2) 同じ表の上3桁の地域の代表点、
+#   3) prefectures.csv の都道府県庁の位置（郵便番号の上3桁の範囲、または Address.prefecture から）
+# 2) 3) は代表点なので、Address.geo_approximate / SalonCard.geo_approximate に「おおよその位置」と記録し、
+# API の location_approximate で返す（同じ地域のサロンは同じ点になり、距離はその点からのもの）。
+# SalonCard に緯度経度と格子番号（CELL_DEG 度四方のマス）を持たせておき、検索では
+#   1) 半径を覆うマスの番号を列挙して (weekday, geo_cell) の索引で候補のカードだけを読み
+#   2) 候補だけ距離を計算して半径内を近い順に並べる
+# ので、全サロンの距離を毎回計算しない。
+import csv
+import math
+import os
+from datetime import date
+from functools import lru_cache
+
+from peewee import chunked
+
+from database import db, Address, BlackoutDate, Service, SalonCard
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+POSTAL_CSV = os.path.join(HERE, "postal_codes.csv")
+PREFECTURE_CSV = os.path.join(HERE, "prefectures.csv")
+CELL_DEG = 0.05                 # マスの大きさ（緯度で約5.5km、東京付近の経度で約4.5km）
+CELL_COLS = int(round(360 / CELL_DEG))
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180
+DEFAULT_RADIUS_KM = 3.0
+MAX_RADIUS_KM = 30.0
+MAX_RESULTS = 50
+UPDATE_CHUNK = 500
+
+
+# ---- 郵便番号・都道府県 → 緯度経度 ----
+@lru_cache(maxsize=1)
+def _postal_table():
+    with open(POSTAL_CSV, encoding="utf-8", newline="") as f:
+        return {row["postal_code"]: (float(row["latitude"]), float(row["longitude"])) for row in csv.DictReader(f)}
+
+
+@lru_cache(maxsize=1)
+def _prefecture_table():
+    """({都道府県名: (緯度, 経度)}, {郵便番号の上3桁: 都道府県名})"""
+    points, prefixes = {}, {}
+    with open(PREFECTURE_CSV, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            points[row["prefecture"]] = (float(row["latitude"]), float(row["longitude"]))
+            for span in row["postal_prefixes"].split():
+                first, _, last = span.partition("-")
+                for prefix in range(int(first), int(last or first) + 1):
+                    prefixes[f"{prefix:03d}"] = row["prefecture"]
+    return points, prefixes
+
+
+def locate(postal_code, prefecture=None):
+    """
+    郵便番号（'020-0001' / '0200001'）と都道府県名から (緯度, 経度, おおよそか)。
+    7桁の行で引けたときだけ「おおよそ」でない。どの表にも無ければ None
+    """
+    digits = "".join(ch for ch in postal_code or "" if ch.isdigit())
+    table = _postal_table()
+    if len(digits) == 7 and digits in table:
+        return table[digits] + (False,)
+    if len(digits) >= 3 and digits[:3] in table:
+        return table[digits[:3]] + (True,)
+    points, prefixes = _prefecture_table()
+    name = prefixes.get(digits[:3]) if len(digits) >= 3 else None
+    point = points.get(name) or points.get((prefecture or "").strip())
+    return point + (True,) if point else None
+
+
+def geocode(postal_code, prefecture=None):
+    """郵便番号（と都道府県名）の (緯度, 経度)。表に無ければ None"""
+    found = locate(postal_code, prefecture)
+    return found[:2] if found else None
+
+
+def coordinates(latitude, longitude, approximate, postal_code, prefecture):
+    """住所の (緯度, 経度, おおよそか)。緯度経度が入っていればそれを、無ければ表から"""
+    if latitude is not None and longitude is not None:
+        return latitude, longitude, bool(approximate)
+    return locate(postal_code, prefecture)
+
+
+def geocode_addresses():
+    """
+    緯度経度が未設定の Address を表から埋める（geo_approximate も記録。migrate.py のバージョン3・8）。
+    (埋めた件数, 郵便番号・都道府県のどちらでも引けなかった件数) を返す
+    """
+    found = {}
+    missing = 0
+    for address_id, postal_code, prefecture in (
+        Address
+        .select(Address.id, Address.postal_code, Address.prefecture)
+        .where(Address.latitude.is_null())
+        .tuples()
+    ):
+        point = locate(postal_code, prefecture)
+        if point:
+            found.setdefault(point, []).append(address_id)
+        else:
+            missing += 1
+    updated = 0
+    with db.atomic():
+        for (latitude, longitude, approximate), ids in found.items():
+            for chunk in chunked(ids, UPDATE_CHUNK):
+                updated += (Address
+                            .update(latitude=latitude, longitude=longitude, geo_approximate=approximate)
+                            .where(Address.id.in_(chunk))
+                            .execute())
+    return updated, missing
+
+
+# ---- 格子 ----
+def _row(latitude):
+    return int(math.floor((latitude + 90) / CELL_DEG))
+
+
+def _col(longitude):
+    return int(math.floor((longitude + 180) / CELL_DEG)) % CELL_COLS
+
+
+def cell_of(latitude, longitude):
+    return _row(latitude) * CELL_COLS + _col(longitude)
+
+
+def cells_around(latitude, longitude, radius_km):
+    """(latitude, longitude) から radius_km 以内を覆うマスの番号"""
+    dlat = radius_km / KM_PER_DEG
+    dlng = radius_km / (KM_PER_DEG * max(math.cos(math.radians(latitude)), 0.01))
+    rows = range(_row(max(latitude - dlat, -90)), _row(min(latitude + dlat, 90 - 1e-9)) + 1)
+    first = int(math.floor((longitude - dlng + 180) / CELL_DEG))
+    last = int(math.floor((longitude + dlng + 180) / CELL_DEG))
+    cols = {c % CELL_COLS for c in range(first, min(last, first + CELL_COLS - 1) + 1)}
+    return [row * CELL_COLS + col for row in rows for col in sorted(cols)]
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """大円距離（haversine）"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# ---- 検索 ----
+def nearby_salons(latitude, longitude, radius_km=DEFAULT_RADIUS_KM, category=None, open_today=False,
+                  today=None, limit=MAX_RESULTS):
+    """
+    半径 radius_km（MAX_RADIUS_KM まで）以内のサロンを近い順に [(salon_id, 距離km), ...] で返す。
+    today（省略時は今日）の曜日のカードがあるサロンだけが対象。category はそのカテゴリの公開中メニューがあるサロン、
+    open_today は今日が定休日でも終日休業（BlackoutDate）でもないサロンに絞る。
+    """
+    today = today or date.today()
+    radius_km = min(max(radius_km, 0.0), MAX_RADIUS_KM)
+    query = (
+        SalonCard
+        .select(SalonCard.salon, SalonCard.latitude, SalonCard.longitude)
+        .where((SalonCard.weekday == today.weekday())
+               & SalonCard.geo_cell.in_(cells_around(latitude, longitude, radius_km)))
+    )
+    if category:
+        query = query.where(SalonCard.salon.in_(
+            Service.select(Service.salon).where((Service.category == category) & (Service.is_active == True))
+        ))
+    if open_today:
+        query = query.where((SalonCard.is_closed == False) & SalonCard.salon.not_in(
+            BlackoutDate
+            .select(BlackoutDate.salon)
+            .where((BlackoutDate.date == today) & (BlackoutDate.start.is_null() | BlackoutDate.end.is_null()))
+        ))
+    found = []
+    for salon_id, lat, lng in query.tuples():
+        d = distance_km(latitude, longitude, lat, lng)
+        if d <= radius_km:
+            found.append((salon_id, d))
+    found.sort(key=lambda item: (item[1], item[0]))
+    return found[:limit]
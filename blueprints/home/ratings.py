@@ -0,0 +1,144 @@
+# サロンの口コミ集計（SalonRating）と口コミ一覧
+#
+# 平均点・件数・星ごとの件数は、Review の追加・削除のたびに同じトランザクションで
+# SalonRating に差分を反映する（追加は UPSERT、削除は UPDATE）。表示のたびに AVG()/COUNT() で Review を集計しない。
+# 口コミの点数を書き換えた（update）ときだけ、そのサロン分を数え直す。
+from datetime import datetime
+
+from peewee import Case, Tuple, fn
+
+from database import db, on_write, Review, Salon, SalonRating, User
+from pagination import decode_cursor, split_page
+
+STARS = (1, 2, 3, 4, 5)
+REVIEW_PAGE_SIZE = 10
+TOP_RATED_MIN_COUNT = 3   # ランキングに載せる最低件数
+TOP_RATED_LIMIT = 20
+
+
+def _star(rating):
+    return f"r{rating}"
+
+
+def _bump(salon_id, rating, sign):
+    """
+    口コミ1件分の差分を反映する。追加は UPSERT、削除は既存行の UPDATE のみ
+    （集計行が無いサロンで減算を INSERT すると件数が負になるので、そのときは Review から数え直す）
+    """
+    now = datetime.utcnow()
+    count = SalonRating.count + sign
+    total = SalonRating.total + sign * rating
+    update = {
+        SalonRating.count: count,
+        SalonRating.total: total,
+        SalonRating.average: Case(None, [(count > 0, total * 1.0 / count)], None),
+        getattr(SalonRating, _star(rating)): getattr(SalonRating, _star(rating)) + sign,
+        SalonRating.updated_at: now,
+    }
+    if sign < 0:
+        if not SalonRating.update(update).where(SalonRating.salon == salon_id).execute():
+            refresh_ratings([salon_id])
+        return
+    row = {"salon": salon_id, "count": 1, "total": rating, "average": float(rating),
+           "created_at": now, "updated_at": now}
+    row.update({_star(s): 1 if s == rating else 0 for s in STARS})
+    (SalonRating
+     .insert(row)
+     .on_conflict(conflict_target=[SalonRating.salon], update=update)
+     .execute())
+
+
+def refresh_ratings(salon_ids):
+    """指定サロンの集計を Review から数え直す"""
+    salon_ids = list({sid for sid in salon_ids if sid is not None})
+    if not salon_ids:
+        return
+    now = datetime.utcnow()
+    rows = {sid: {"salon": sid, "count": 0, "total": 0, "average": None, "created_at": now, "updated_at": now,
+                  **{_star(s): 0 for s in STARS}} for sid in salon_ids}
+    for salon_id, rating, n in (
+        Review
+        .select(Review.salon, Review.rating, fn.COUNT(Review.id))
+        .where(Review.salon.in_(salon_ids))
+        .group_by(Review.salon, Review.rating)
+        .tuples()
+    ):
+        row = rows[salon_id]
+        row[_star(rating)] = n
+        row["count"] += n
+        row["total"] += n * rating
+    for row in rows.values():
+        row["average"] = row["total"] / row["count"] if row["count"] else None
+    with db.atomic():
+        SalonRating.delete().where(SalonRating.salon.in_(salon_ids)).execute()
+        SalonRating.insert_many(list(rows.values())).execute()
+
+
+def rebuild_ratings():
+    """全サロンの集計を作り直す（一括投入後などに使う）"""
+    ids = [sid for (sid,) in Salon.select(Salon.id).order_by(Salon.id).tuples()]
+    with db.atomic():
+        SalonRating.delete().execute()
+        for i in range(0, len(ids), 200):
+            refresh_ratings(ids[i:i + 200])
+
+
+def rating_summary(row):
+    """SalonRating の dict（または None）を表示用に整える"""
+    if not row or not row.get("count"):
+        return {"count": 0, "average": None, "histogram": {s: 0 for s in STARS}}
+    return {
+        "count": row["count"],
+        "average": round(row["average"], 1),
+        "histogram": {s: row[_star(s)] for s in STARS},
+    }
+
+
+def ratings_for(salon_ids):
+    """{salon_id: 表示用の集計}（口コミの無いサロンは件数0）"""
+    rows = {
+        row["salon"]: row for row in
+        SalonRating.select().where(SalonRating.salon.in_(list(salon_ids))).dicts()
+    }
+    return {sid: rating_summary(rows.get(sid)) for sid in salon_ids}
+
+
+def review_page(salon_id, cursor=None, limit=REVIEW_PAGE_SIZE):
+    """新しい順の口コミ1ページ: (rows, next_cursor)。(created_at, id) のキーセットページング"""
+    query = (
+        Review
+        .select(Review.id, Review.rating, Review.comment, Review.created_at,
+                User.line_display_name.alias("user_name"))
+        .join(User, on=(Review.user == User.id))
+        .where(Review.salon == salon_id)
+    )
+    after = decode_cursor(cursor, size=2)
+    if after:
+        query = query.where(Tuple(Review.created_at, Review.id) < Tuple(*after))
+    rows = query.order_by(Review.created_at.desc(), Review.id.desc()).limit(limit + 1).dicts()
+    return split_page(rows, limit, key=lambda r: (r["created_at"], r["id"]))
+
+
+def top_rated_salon_ids(limit=TOP_RATED_LIMIT, min_count=TOP_RATED_MIN_COUNT):
+    """平均点の高い順（同点は件数の多い順）のサロン id。公開中のサロンのみ"""
+    return [
+        sid for (sid,) in
+        SalonRating
+        .select(SalonRating.salon)
+        .join(Salon, on=(SalonRating.salon == Salon.id))
+        .where((SalonRating.count >= min_count) & (Salon.is_active == True))
+        .order_by(SalonRating.average.desc(), SalonRating.count.desc(), SalonRating.salon)
+        .limit(limit)
+        .tuples()
+    ]
+
+
+@on_write(Review)
+def _on_review_write(review, action):
+    if action == "create":
+        _bump(review.salon_id, review.rating, 1)
+    elif action == "delete":
+        _bump(review.salon_id, review.rating, -1)
+    else:
+        # 書き換え前の点数が分からないので、そのサロン分だけ数え直す
+        refresh_ratings([review.salon_id])
@@ -0,0 +1,111 @@
+# /home 一覧用の読み取りモデル（SalonCard）の更新処理
+#
+# 一覧表示のたびに Salon→Address→WorkingHour を JOIN してメニューを読む代わりに、
+# 書き込み時に該当サロンのカード（曜日ごと7行まで）だけを作り直しておく。
+from peewee import JOIN
+
+from database import (
+    db, on_write,
+    Salon, Address, WorkingHour, Service, SalonCard
+)
+from .nearby import coordinates, cell_of
+
+REBUILD_CHUNK = 200
+
+
+def _address_text(prefecture, city, line1, line2):
+    return "".join(part for part in (prefecture, city, line1, line2) if part) or None
+
+
+def refresh_salon_cards(salon_ids):
+    """指定サロンのカードを作り直す（非公開・削除済みサロンはカードを消すだけ）"""
+    salon_ids = list({sid for sid in salon_ids if sid is not None})
+    if not salon_ids:
+        return
+
+    salons = (
+        Salon
+        .select(Salon.id, Salon.name, Address.prefecture, Address.city, Address.line1, Address.line2,
+                Address.latitude, Address.longitude, Address.geo_approximate, Address.postal_code)
+        .join(Address, on=(Salon.address == Address.id), join_type=JOIN.LEFT_OUTER)
+        .where((Salon.id.in_(salon_ids)) & (Salon.is_active == True))
+        .tuples()
+    )
+    hours = {}
+    for salon_id, weekday, start, end, is_closed in (
+        WorkingHour
+        .select(WorkingHour.salon, WorkingHour.weekday, WorkingHour.start, WorkingHour.end,
+                WorkingHour.is_closed)
+        .where(WorkingHour.salon.in_(salon_ids))
+        .tuples()
+    ):
+        # 同じ曜日に複数行（分割シフト）がある場合は最初の開始〜最後の終了でまとめる
+        opened = hours.setdefault((salon_id, weekday), [])
+        if not is_closed:
+            opened.append((start, end))
+
+    services = {}
+    for salon_id, service_id, name, price, category in (
+        Service
+        .select(Service.salon, Service.id, Service.name, Service.price_jpy, Service.category)
+        .where((Service.salon.in_(salon_ids)) & (Service.is_active == True))
+        .order_by(Service.price_jpy, Service.id)
+        .tuples()
+    ):
+        services.setdefault(salon_id, []).append(
+            {"id": service_id, "name": name, "price_jpy": price, "category": category}
+        )
+
+    rows = []
+    for salon_id, name, prefecture, city, line1, line2, latitude, longitude, approximate, postal_code in salons:
+        menu = services.get(salon_id, [])
+        point = coordinates(latitude, longitude, approximate, postal_code, prefecture)
+        for weekday in range(7):
+            opened = hours.get((salon_id, weekday))
+            if opened is None:
+                continue  # その曜日の営業時間が未登録なら一覧に出さない
+            rows.append({
+                "salon": salon_id,
+                "weekday": weekday,
+                "name": name,
+                "address_text": _address_text(prefecture, city, line1, line2),
+                "open_time": min(start for start, _ in opened) if opened else None,
+                "close_time": max(end for _, end in opened) if opened else None,
+                "is_closed": not opened,
+                "services": menu,
+                "min_price_jpy": min((m["price_jpy"] for m in menu), default=None),
+                "latitude": point[0] if point else None,
+                "longitude": point[1] if point else None,
+                "geo_cell": cell_of(*point[:2]) if point else None,
+                "geo_approximate": point[2] if point else False,
+            })
+
+    with db.atomic():
+        SalonCard.delete().where(SalonCard.salon.in_(salon_ids)).execute()
+        if rows:
+            SalonCard.insert_many(rows).execute()
+
+
+def rebuild_salon_cards():
+    """全サロンのカードを作り直す（一括投入後などに使う）"""
+    ids = [sid for (sid,) in Salon.select(Salon.id).order_by(Salon.id).tuples()]
+    SalonCard.delete().where(SalonCard.salon.not_in(Salon.select(Salon.id))).execute()
+    for i in range(0, len(ids), REBUILD_CHUNK):
+        refresh_salon_cards(ids[i:i + REBUILD_CHUNK])
+
+
+@on_write(Salon)
+def _on_salon_write(salon, action):
+    refresh_salon_cards([salon.id])
+
+
+@on_write(Address)
+def _on_address_write(address, action):
+    refresh_salon_cards(
+        sid for (sid,) in Salon.select(Salon.id).where(Salon.address == address.id).tuples()
+    )
+
+
+@on_write(WorkingHour, Service)
+def _on_salon_child_write(row, action):
+    refresh_salon_cards([row.salon_id])
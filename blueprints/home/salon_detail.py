@@ -0,0 +1,125 @@
+# サロン詳細ページのデータ取得と HTTP 条件付きキャッシュ用の検証子
+import hashlib
+from datetime import date, datetime, timezone
+
+from peewee import JOIN, fn
+
+from database import (
+    Salon, Address, WorkingHour, BlackoutDate, Service, SalonImage, SalonRating
+)
+from .ratings import rating_summary, review_page
+
+UPCOMING_BLACKOUTS = 10
+REVIEWS_ON_DETAIL = 5
+
+
+def _parts(salon_id, today):
+    """詳細ページに表示するテーブルごとの (MAX(updated_at), COUNT(*))"""
+    return [
+        Salon.select(fn.MAX(Salon.updated_at), fn.COUNT(Salon.id)).where(Salon.id == salon_id),
+        (Address
+         .select(fn.MAX(Address.updated_at), fn.COUNT(Address.id))
+         .join(Salon, on=(Salon.address == Address.id))
+         .where(Salon.id == salon_id)),
+        (WorkingHour
+         .select(fn.MAX(WorkingHour.updated_at), fn.COUNT(WorkingHour.id))
+         .where(WorkingHour.salon == salon_id)),
+        (BlackoutDate
+         .select(fn.MAX(BlackoutDate.updated_at), fn.COUNT(BlackoutDate.id))
+         .where((BlackoutDate.salon == salon_id) & (BlackoutDate.date >= today))),
+        (Service
+         .select(fn.MAX(Service.updated_at), fn.COUNT(Service.id))
+         .where(Service.salon == salon_id)),
+        (SalonImage
+         .select(fn.MAX(SalonImage.updated_at), fn.COUNT(SalonImage.id))
+         .where(SalonImage.salon == salon_id)),
+        # 口コミの追加・削除・変更で SalonRating.updated_at が更新される
+        (SalonRating
+         .select(fn.MAX(SalonRating.updated_at), fn.MAX(SalonRating.count))
+         .where(SalonRating.salon == salon_id)),
+    ]
+
+
+def _as_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def detail_validators(salon_id, viewer=None, today=None):
+    """
+    関連行の updated_at と件数から (ETag, Last-Modified) を1クエリで作る。
+    サロンが存在しなければ (None, None)。
+    - 件数も混ぜるので行の削除でも ETag が変わる
+    - 日付（休業日の「今後」判定）と閲覧ユーザ（ヘッダの表示名）も混ぜる
+    """
+    today = today or date.today()
+    parts = _parts(salon_id, today)
+    query = parts[0]
+    for part in parts[1:]:
+        query = query.union_all(part)
+    rows = [(_as_datetime(updated), count) for updated, count in query.tuples()]
+    if not rows or rows[0][1] == 0:
+        return None, None
+
+    seed = f"{salon_id}|{today.isoformat()}|{viewer or ''}|" + "|".join(
+        f"{updated.isoformat() if updated else '-'}:{count}" for updated, count in rows
+    )
+    etag = hashlib.sha1(seed.encode("utf-8")).hexdigest()
+    last_modified = max(updated for updated, _ in rows if updated is not None)
+    return etag, last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+
+def load_detail(salon_id, today=None):
+    """詳細ページ用のデータを6クエリで取得（サロンが無ければ None）"""
+    today = today or date.today()
+    salon = (
+        Salon
+        .select(Salon, Address, SalonRating)
+        .join(Address, JOIN.LEFT_OUTER)
+        .switch(Salon)
+        .join(SalonRating, JOIN.LEFT_OUTER, on=(SalonRating.salon == Salon.id), attr="rating_row")
+        .where(Salon.id == salon_id)
+        .first()
+    )
+    if salon is None:
+        return None
+
+    hours = list(
+        WorkingHour
+        .select()
+        .where(WorkingHour.salon == salon_id)
+        .order_by(WorkingHour.weekday, WorkingHour.start)
+    )
+    blackouts = list(
+        BlackoutDate
+        .select()
+        .where((BlackoutDate.salon == salon_id) & (BlackoutDate.date >= today))
+        .order_by(BlackoutDate.date, BlackoutDate.start)
+        .limit(UPCOMING_BLACKOUTS)
+    )
+    services = list(
+        Service
+        .select()
+        .where((Service.salon == salon_id) & (Service.is_active == True))
+        .order_by(Service.price_jpy, Service.id)
+    )
+    images = list(
+        SalonImage
+        .select()
+        .where(SalonImage.salon == salon_id)
+        .order_by(SalonImage.sort_order, SalonImage.id)
+    )
+    rating_row = getattr(salon, "rating_row", None)
+    reviews, next_cursor = review_page(salon_id, limit=REVIEWS_ON_DETAIL)
+    return {
+        "salon": salon,
+        "hours": hours,
+        "today_hours": [h for h in hours if h.weekday == today.weekday()],
+        "blackouts": blackouts,
+        "services": services,
+        "images": images,
+        "rating": rating_summary(rating_row.__data__ if rating_row and rating_row.salon_id else None),
+        "reviews": reviews,
+        "reviews_next_cursor": next_cursor,
+    }
@@ -0,0 +1,181 @@
+# サロン検索（SQLite FTS5 + trigram）
+#
+# サロン1件 = 検索インデックス1行（rowid = Salon.id）。
+# 書き込みフックで Salon / Service / Address の変更をインデックスへ反映する。
+from datetime import datetime
+
+from peewee import JOIN, SqliteDatabase, fn
+
+from database import (
+    db, on_write,
+    Salon, Address, Service, SalonCard, SalonRating, SalonSearch
+)
+
+MAX_RESULTS = 50
+REBUILD_CHUNK = 200
+TRIGRAM = 3  # trigram は3文字未満の語を MATCH できない
+
+# 列ごとの bm25 の重み（name, description, services, area）
+WEIGHTS = (10.0, 1.0, 4.0, 2.0)
+
+
+def fts_enabled():
+    return isinstance(db, SqliteDatabase)
+
+
+def _join(*parts):
+    return " ".join(p for p in parts if p)
+
+
+def refresh_search_index(salon_ids):
+    """指定サロンのインデックス行を作り直す（非公開・削除済みは消すだけ）"""
+    salon_ids = list({sid for sid in salon_ids if sid is not None})
+    if not salon_ids or not fts_enabled():
+        return
+
+    salons = (
+        Salon
+        .select(Salon.id, Salon.name, Salon.description,
+                Address.prefecture, Address.city, Address.line1, Address.line2)
+        .join(Address, JOIN.LEFT_OUTER, on=(Salon.address == Address.id))
+        .where((Salon.id.in_(salon_ids)) & (Salon.is_active == True))
+        .tuples()
+    )
+    menus = {}
+    for salon_id, name, category, description in (
+        Service
+        .select(Service.salon, Service.name, Service.category, Service.description)
+        .where((Service.salon.in_(salon_ids)) & (Service.is_active == True))
+        .tuples()
+    ):
+        menus.setdefault(salon_id, []).append(_join(name, category, description))
+
+    rows = [{
+        "rowid": salon_id,
+        "name": name,
+        "description": description or "",
+        "services": "\n".join(menus.get(salon_id, [])),
+        "area": _join(prefecture, city, line1, line2),
+    } for salon_id, name, description, prefecture, city, line1, line2 in salons]
+
+    with db.atomic():
+        SalonSearch.delete().where(SalonSearch.rowid.in_(salon_ids)).execute()
+        if rows:
+            SalonSearch.insert_many(rows).execute()
+
+
+def rebuild_search_index():
+    """インデックス全体を作り直す（一括投入後などに使う）"""
+    if not fts_enabled():
+        return
+    SalonSearch.delete().execute()
+    ids = [sid for (sid,) in Salon.select(Salon.id).order_by(Salon.id).tuples()]
+    for i in range(0, len(ids), REBUILD_CHUNK):
+        refresh_search_index(ids[i:i + REBUILD_CHUNK])
+
+
+def _match_expression(terms):
+    # 利用者の入力をそのまま MATCH に渡すと構文エラーになり得るので語ごとに引用符で囲む
+    return " ".join('"%s"' % t.replace('"', '""') for t in terms)
+
+
+def _short_term_condition(term):
+    pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    cond = None
+    for column in (SalonSearch.name, SalonSearch.description, SalonSearch.services, SalonSearch.area):
+        expr = fn.LIKE(pattern, column, "\\")
+        cond = expr if cond is None else (cond | expr)
+    return cond
+
+
+def search_salon_ids(q, category=None, limit=MAX_RESULTS):
+    """キーワード（空白区切りで AND）とカテゴリで絞り込んだサロン id をスコア順に返す"""
+    terms = [t for t in (q or "").split() if t]
+    in_category = None
+    if category:
+        in_category = (
+            Service
+            .select(Service.salon)
+            .where((Service.category == category) & (Service.is_active == True))
+        )
+
+    if not fts_enabled():
+        query = Salon.select(Salon.id).where(Salon.is_active == True)
+        for t in terms:
+            query = query.where(Salon.name.contains(t) | Salon.description.contains(t))
+        if in_category is not None:
+            query = query.where(Salon.id.in_(in_category))
+        return [sid for (sid,) in query.order_by(Salon.id).limit(limit).tuples()]
+
+    long_terms = [t for t in terms if len(t) >= TRIGRAM]
+    short_terms = [t for t in terms if len(t) < TRIGRAM]
+
+    query = SalonSearch.select(SalonSearch.rowid)
+    if long_terms:
+        query = query.where(SalonSearch.match(_match_expression(long_terms)))
+        query = query.order_by(SalonSearch.bm25(*WEIGHTS))
+    else:
+        query = query.order_by(SalonSearch.rowid)
+    for t in short_terms:
+        query = query.where(_short_term_condition(t))
+    if in_category is not None:
+        query = query.where(SalonSearch.rowid.in_(in_category))
+    return [sid for (sid,) in query.limit(limit).tuples()]
+
+
+def category_facets(salon_ids):
+    """ヒットしたサロンに含まれるカテゴリ別のサロン数"""
+    if not salon_ids:
+        return []
+    return list(
+        Service
+        .select(Service.category, fn.COUNT(fn.DISTINCT(Service.salon)).alias("count"))
+        .where(
+            (Service.salon.in_(salon_ids))
+            & (Service.is_active == True)
+            & (Service.category.is_null(False))
+        )
+        .group_by(Service.category)
+        .order_by(fn.COUNT(fn.DISTINCT(Service.salon)).desc(), Service.category)
+        .dicts()
+    )
+
+
+def card_query():
+    """カードと口コミ集計（件数・平均）を1クエリで読む"""
+    return (
+        SalonCard
+        .select(SalonCard, SalonRating.count.alias("rating_count"), SalonRating.average.alias("rating_average"))
+        .join(SalonRating, JOIN.LEFT_OUTER, on=(SalonRating.salon == SalonCard.salon))
+    )
+
+
+def cards_for(salon_ids, weekday=None):
+    """検索結果をスコア順のカードにする（今日の営業時間が無いサロンは定休日扱い）"""
+    if not salon_ids:
+        return []
+    weekday = datetime.now().weekday() if weekday is None else weekday
+    chosen = {}
+    for card in card_query().where(SalonCard.salon.in_(salon_ids)).dicts():
+        if card["weekday"] == weekday:
+            chosen[card["salon"]] = card
+        elif card["salon"] not in chosen or chosen[card["salon"]]["weekday"] != weekday:
+            chosen[card["salon"]] = dict(card, is_closed=True, open_time=None, close_time=None)
+    return [chosen[sid] for sid in salon_ids if sid in chosen]
+
+
+@on_write(Salon)
+def _on_salon_write(salon, action):
+    refresh_search_index([salon.id])
+
+
+@on_write(Address)
+def _on_address_write(address, action):
+    refresh_search_index(
+        sid for (sid,) in Salon.select(Salon.id).where(Salon.address == address.id).tuples()
+    )
+
+
+@on_write(Service)
+def _on_service_write(service, action):
+    refresh_search_index([service.salon_id])
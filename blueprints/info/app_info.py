@@ -1,9 +1,49 @@
-from flask import render_template, request, redirect, url_for
+from flask import render_template, request, redirect, url_for, jsonify
 from . import info_bp
 
-from database import Notification
+from auth import current_user_id
+from pagination import page_size
+from .inbox import inbox_page, unread_count, mark_read, mark_all_read, FILTERS
 
 @info_bp.route('/')
 def info():
-    notifications = Notification.select()
-    return render_template('info.html', notifications=notifications)
\ No newline at end of file
+    status = request.args.get('filter', 'all')
+    if status not in FILTERS:
+        status = 'all'
+    user_id = current_user_id()
+    notifications, next_cursor = inbox_page(
+        user_id, status,
+        cursor=request.args.get('cursor'),
+        limit=page_size(request.args.get('limit')),
+    )
+    return render_template('info.html', notifications=notifications, status=status,
+                           unread=unread_count(user_id), next_cursor=next_cursor)
+
+# 既読にする（JSON body: {"ids": [1, 2, 3]}）
+@info_bp.route('/read', methods=['POST'])
+def read():
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({"ok": False, "error": "login_required"}), 401
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"ok": False, "error": "invalid_request"}), 400
+    try:
+        ids = [int(i) for i in data.get("ids", [])]
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "invalid_request"}), 400
+    updated = mark_read(user_id, ids)
+    return jsonify({"ok": True, "updated": updated, "unread": unread_count(user_id)})
+
+# すべて既読にする
+@info_bp.route('/read-all', methods=['POST'])
+def read_all():
+    user_id = current_user_id()
+    if user_id is None:
+        if request.is_json:
+            return jsonify({"ok": False, "error": "login_required"}), 401
+        return redirect(url_for('info.info'))
+    updated = mark_all_read(user_id)
+    if request.is_json:
+        return jsonify({"ok": True, "updated": updated, "unread": 0})
+    return redirect(url_for('info.info'))
@@ -0,0 +1,285 @@
+# ユーザごとのお知らせ受信箱
+#
+# - 個人宛て（user あり）と全体向け（user が NULL）をそれぞれ (user, delivered_at, id) の索引で読み、
+#   新しい順にマージする
+# - 全体向けの宛先は salon で決める: salon が NULL なら全員、salon があればそのサロンを予約したことのある
+#   ユーザだけ（customer_salons。LINE への送信先も同じ。line_push.py）
+# - 全体向けはユーザごとに行を複製せず、既読だけを NotificationRead に持つ。既読にできるのは配信済みで
+#   そのユーザに届いているものだけ
+# - 未読数は InboxCounter を増減して返す（COUNT(*) しない）
+#     未読数 = unread:<user>
+#            + broadcast_total - broadcast_read:<user>                        （全員向け）
+#            + Σ broadcast_total:<salon> - broadcast_read:<user>:<salon>      （予約したサロンごと）
+import heapq
+from datetime import datetime
+
+from peewee import EXCLUDED, JOIN, Tuple, Value, fn
+
+from database import db, on_write, Notification, NotificationRead, InboxCounter, Reservation
+from pagination import decode_cursor, split_page, DEFAULT_PAGE_SIZE
+
+FILTERS = ("all", "unread", "read")
+BROADCAST_TOTAL = "broadcast_total"
+
+_FIELDS = (
+    Notification.id, Notification.user, Notification.salon, Notification.title,
+    Notification.body, Notification.type, Notification.delivered_at,
+)
+
+
+def unread_key(user_id):
+    return f"unread:{user_id}"
+
+
+def broadcast_total_key(salon_id=None):
+    return BROADCAST_TOTAL if salon_id is None else f"{BROADCAST_TOTAL}:{salon_id}"
+
+
+def broadcast_read_key(user_id, salon_id=None):
+    return f"broadcast_read:{user_id}" if salon_id is None else f"broadcast_read:{user_id}:{salon_id}"
+
+
+def customer_salons(user_id):
+    """ユーザが予約したことのあるサロン（サロンからの全体向けお知らせが届く）のサブクエリ"""
+    return Reservation.select(Reservation.salon).where(Reservation.user == user_id)
+
+
+def _audience(user_id):
+    """user_id に届いている（配信済みの）全体向けお知らせの条件"""
+    condition = Notification.user.is_null() & Notification.delivered_at.is_null(False)
+    if user_id is None:
+        return condition & Notification.salon.is_null()
+    return condition & (Notification.salon.is_null() | Notification.salon.in_(customer_salons(user_id)))
+
+
+def bump(deltas):
+    """{key: 増減} をまとめて1回の UPSERT で反映"""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    now = datetime.utcnow()
+    (InboxCounter
+     .insert_many([
+         {"key": k, "value": v, "created_at": now, "updated_at": now} for k, v in deltas.items()
+     ])
+     .on_conflict(
+         conflict_target=[InboxCounter.key],
+         update={InboxCounter.value: InboxCounter.value + EXCLUDED.value, InboxCounter.updated_at: now},
+     )
+     .execute())
+
+
+def unread_count(user_id):
+    if user_id is None:
+        return 0
+    salons = [sid for (sid,) in customer_salons(user_id).distinct().tuples()]
+    scopes = [None] + salons
+    keys = [unread_key(user_id)]
+    for salon_id in scopes:
+        keys += [broadcast_total_key(salon_id), broadcast_read_key(user_id, salon_id)]
+    values = dict(
+        InboxCounter
+        .select(InboxCounter.key, InboxCounter.value)
+        .where(InboxCounter.key.in_(keys))
+        .tuples()
+    )
+    unread = values.get(unread_key(user_id), 0)
+    for salon_id in scopes:
+        broadcast_unread = (values.get(broadcast_total_key(salon_id), 0)
+                            - values.get(broadcast_read_key(user_id, salon_id), 0))
+        unread += max(broadcast_unread, 0)
+    return unread
+
+
+def _personal(user_id, status, after, limit):
+    query = (
+        Notification
+        .select(*_FIELDS, Notification.is_read)
+        .where((Notification.user == user_id) & Notification.delivered_at.is_null(False))
+    )
+    if status == "unread":
+        query = query.where(Notification.is_read == False)
+    elif status == "read":
+        query = query.where(Notification.is_read == True)
+    if after:
+        query = query.where(Tuple(Notification.delivered_at, Notification.id) < Tuple(*after))
+    return query.order_by(Notification.delivered_at.desc(), Notification.id.desc()).limit(limit).dicts()
+
+
+def _broadcast(user_id, status, after, limit):
+    read = NotificationRead.alias("nr")
+    query = (
+        Notification
+        .select(*_FIELDS, read.id.is_null(False).alias("is_read"))
+        .join(read, JOIN.LEFT_OUTER,
+              on=((read.notification == Notification.id) & (read.user == user_id)))
+        .where(_audience(user_id))
+    )
+    if status == "unread":
+        query = query.where(read.id.is_null())
+    elif status == "read":
+        query = query.where(read.id.is_null(False))
+    if after:
+        query = query.where(Tuple(Notification.delivered_at, Notification.id) < Tuple(*after))
+    return query.order_by(Notification.delivered_at.desc(), Notification.id.desc()).limit(limit).dicts()
+
+
+def _sort_key(row):
+    return (row["delivered_at"], row["id"])
+
+
+def inbox_page(user_id, status="all", cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """新しい順の1ページ: (rows, next_cursor)。rows は dict（is_read はユーザから見た既読）"""
+    if status not in FILTERS:
+        status = "all"
+    after = decode_cursor(cursor, size=2)
+    streams = [_broadcast(user_id, status, after, limit + 1)]
+    if user_id is not None:
+        streams.append(_personal(user_id, status, after, limit + 1))
+    merged = heapq.merge(*streams, key=_sort_key, reverse=True)
+    rows = [row for _, row in zip(range(limit + 1), merged)]
+    for row in rows:
+        row["is_read"] = bool(row["is_read"])
+        row["is_broadcast"] = row["user"] is None
+    return split_page(rows, limit, key=_sort_key)
+
+
+def mark_read(user_id, notification_ids):
+    """指定したお知らせを既読にする（個人宛て・全体向けそれぞれ1文）。既読にした件数を返す"""
+    ids = [int(i) for i in notification_ids]
+    if not ids:
+        return 0
+    with db.atomic():
+        personal = (
+            Notification
+            .update(is_read=True, updated_at=datetime.utcnow())
+            .where(
+                (Notification.user == user_id)
+                & (Notification.id.in_(ids))
+                & (Notification.is_read == False)
+            )
+            .execute()
+        )
+        reads = _insert_reads(user_id, Notification.id.in_(ids))
+        bump(dict(reads, **{unread_key(user_id): -personal}))
+    return personal + sum(reads.values())
+
+
+def mark_all_read(user_id):
+    """受信箱のお知らせをすべて既読にする。既読にした件数を返す"""
+    with db.atomic():
+        personal = (
+            Notification
+            .update(is_read=True, updated_at=datetime.utcnow())
+            .where((Notification.user == user_id) & (Notification.is_read == False))
+            .execute()
+        )
+        reads = _insert_reads(user_id)
+        bump(dict(reads, **{unread_key(user_id): -personal}))
+    return personal + sum(reads.values())
+
+
+def _insert_reads(user_id, condition=None):
+    """
+    user_id に届いている全体向けお知らせ（condition に合うもの）の既読行を INSERT ... SELECT で作り、
+    新しく既読になった件数を既読数カウンタの増分 {key: 件数} で返す（宛先のサロンごとに1文）
+    """
+    audience = _audience(user_id)
+    if condition is not None:
+        audience &= condition
+    unread = (
+        Notification
+        .select(Notification.salon)
+        .join(NotificationRead, JOIN.LEFT_OUTER,
+              on=((NotificationRead.notification == Notification.id) & (NotificationRead.user == user_id)))
+        .where(audience & NotificationRead.id.is_null())
+        .distinct()
+    )
+    now = datetime.utcnow()
+    deltas = {}
+    for (salon_id,) in unread.tuples():
+        scope = Notification.salon.is_null() if salon_id is None else (Notification.salon == salon_id)
+        source = (
+            Notification
+            .select(Value(user_id), Notification.id, Value(now), Value(now))
+            .where(audience & scope)
+        )
+        query = (
+            NotificationRead
+            .insert_from(source, [NotificationRead.user, NotificationRead.notification,
+                                  NotificationRead.created_at, NotificationRead.updated_at])
+            .on_conflict_ignore()
+        )
+        deltas[broadcast_read_key(user_id, salon_id)] = db.execute(query).rowcount
+    return deltas
+
+
+def rebuild_inbox_counters():
+    """カウンタを集計し直す（一括投入後などに使う）"""
+    with db.atomic():
+        InboxCounter.delete().execute()
+        deltas = {}
+        for user_id, n in (
+            Notification
+            .select(Notification.user, fn.COUNT(Notification.id))
+            .where(
+                Notification.user.is_null(False)
+                & (Notification.is_read == False)
+                & Notification.delivered_at.is_null(False)
+            )
+            .group_by(Notification.user)
+            .tuples()
+        ):
+            deltas[unread_key(user_id)] = n
+        for user_id, salon_id, n in (
+            NotificationRead
+            .select(NotificationRead.user, Notification.salon, fn.COUNT(NotificationRead.id))
+            .join(Notification)
+            .group_by(NotificationRead.user, Notification.salon)
+            .tuples()
+        ):
+            deltas[broadcast_read_key(user_id, salon_id)] = n
+        for salon_id, n in (
+            Notification
+            .select(Notification.salon, fn.COUNT(Notification.id))
+            .where(Notification.user.is_null() & Notification.delivered_at.is_null(False))
+            .group_by(Notification.salon)
+            .tuples()
+        ):
+            deltas[broadcast_total_key(salon_id)] = n
+        keys = list(deltas)
+        for i in range(0, len(keys), 500):
+            bump({k: deltas[k] for k in keys[i:i + 500]})
+
+
+def delivered_deltas(rows):
+    """配信済みになった (user_id, salon_id, is_read) の並びからカウンタの増分を作る"""
+    deltas = {}
+    for user_id, salon_id, is_read in rows:
+        if user_id is None:
+            key = broadcast_total_key(salon_id)
+            deltas[key] = deltas.get(key, 0) + 1
+        elif not is_read:
+            deltas[unread_key(user_id)] = deltas.get(unread_key(user_id), 0) + 1
+    return deltas
+
+
+@on_write(Notification)
+def _on_notification_write(notification, action):
+    if notification.delivered_at is None or action == "update":
+        return
+    sign = 1 if action == "create" else -1
+    if notification.user_id is None and action == "delete":
+        # 消した全体向けお知らせを既読にしていたユーザの既読数も戻す
+        readers = [
+            uid for (uid,) in (
+                NotificationRead
+                .select(NotificationRead.user)
+                .where(NotificationRead.notification == notification.id)
+                .tuples()
+            )
+        ]
+        NotificationRead.delete().where(NotificationRead.notification == notification.id).execute()
+        bump({broadcast_read_key(uid, notification.salon_id): -1 for uid in readers})
+    deltas = delivered_deltas([(notification.user_id, notification.salon_id, notification.is_read)])
+    bump({k: v * sign for k, v in deltas.items()})
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+owner_bp = Blueprint('owner', __name__)
+
+from . import app_owner
\ No newline at end of file
@@ -0,0 +1,94 @@
+from datetime import date, timedelta
+
+from flask import request, jsonify
+from . import owner_bp
+
+from auth import current_identity
+from database import Salon, Reservation
+from blueprints.reservation.booking import change_status, BookingError, SlotUnavailable, DatabaseBusy
+from blueprints.reservation.stats import daily_stats
+
+OWNER_ROLES = (2, 3)  # owner / admin
+MAX_RANGE_DAYS = 366
+
+
+def _owned_salon_ids(identity):
+    query = Salon.select(Salon.id).order_by(Salon.id)
+    if identity["role"] != 3:
+        query = query.where(Salon.owner == identity["user_id"])
+    return [sid for (sid,) in query.tuples()]
+
+
+def _authorize(salon_id=None):
+    """(identity, 対象サロンid一覧) か、エラーレスポンス"""
+    identity = current_identity()
+    if identity is None:
+        return None, (jsonify({"ok": False, "error": "login_required"}), 401)
+    if identity["role"] not in OWNER_ROLES:
+        return None, (jsonify({"ok": False, "error": "forbidden"}), 403)
+    salon_ids = _owned_salon_ids(identity)
+    if salon_id is not None:
+        if salon_id not in salon_ids:
+            return None, (jsonify({"ok": False, "error": "forbidden"}), 403)
+        salon_ids = [salon_id]
+    return (identity, salon_ids), None
+
+
+# 日別の売上・予約件数と担当者の稼働率（集計済みの SalonDailyStat を読むだけ）
+# 例: /owner/stats?salon_id=1&from=2025-01-01&to=2025-01-31
+@owner_bp.route('/stats')
+def stats():
+    auth, error = _authorize(request.args.get('salon_id', type=int))
+    if error:
+        return error
+    _, salon_ids = auth
+    try:
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else date.today()
+        start = date.fromisoformat(request.args['from']) if request.args.get('from') else end - timedelta(days=29)
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid_request"}), 400
+    if start > end or (end - start).days >= MAX_RANGE_DAYS:
+        return jsonify({"ok": False, "error": "invalid_range"}), 400
+
+    return jsonify({
+        "ok": True,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "salons": [dict(daily_stats(salon_id, start, end), salon_id=salon_id) for salon_id in salon_ids],
+    })
+
+
+# 予約の状態・支払状態の変更（JSON body: {"status": 2, "payment_status": 1}）
+@owner_bp.route('/reservations/<int:reservation_id>/status', methods=['POST'])
+def reservation_status(reservation_id):
+    auth, error = _authorize()
+    if error:
+        return error
+    identity, salon_ids = auth
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"ok": False, "error": "invalid_request"}), 400
+    try:
+        status = int(data["status"]) if data.get("status") is not None else None
+        payment_status = int(data["payment_status"]) if data.get("payment_status") is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "invalid_request"}), 400
+    salon_id = Reservation.select(Reservation.salon).where(Reservation.id == reservation_id).scalar()
+    if salon_id is None or salon_id not in salon_ids:
+        return jsonify({"ok": False, "error": "not_found"}), 404
+
+    try:
+        r = change_status(reservation_id, status, payment_status,
+                          actor_id=identity["user_id"], salon_id=salon_id)
+    except SlotUnavailable as e:
+        return jsonify({"ok": False, "error": e.code}), 409
+    except DatabaseBusy as e:
+        return jsonify({"ok": False, "error": e.code}), 503
+    except BookingError as e:
+        return jsonify({"ok": False, "error": e.code, "detail": str(e)}), 400
+
+    return jsonify({"ok": True, "reservation": {
+        "id": r.id,
+        "status": r.status,
+        "payment_status": r.payment_status,
+    }})
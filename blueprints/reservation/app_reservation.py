@@ -1,6 +1,87 @@
-from flask import render_template, request, redirect, url_for
+from datetime import datetime
+from flask import render_template, request, redirect, url_for, jsonify
 from . import reservation_bp
 
+from auth import current_user_id
+from .availability import find_free_slots, DEFAULT_STEP_MIN
+from .booking import create_reservation, BookingError, SlotUnavailable, DatabaseBusy
+
 @reservation_bp.route('/')
 def reservation():
-    return render_template('reservation.html')
\ No newline at end of file
+    return render_template('reservation.html')
+
+# 空き枠一覧（JSON）
+# 例: /reservation/slots?salon_id=1&service_id=2&days=7
+@reservation_bp.route('/slots')
+def slots():
+    salon_id = request.args.get('salon_id', type=int)
+    service_id = request.args.get('service_id', type=int)
+    if salon_id is None or service_id is None:
+        return jsonify({"ok": False, "error": "salon_id and service_id are required"}), 400
+
+    days = request.args.get('days', default=7, type=int)
+    staff_id = request.args.get('staff_id', type=int)
+    step = request.args.get('step', default=DEFAULT_STEP_MIN, type=int)
+    start_date = None
+    if request.args.get('date'):
+        try:
+            start_date = datetime.strptime(request.args['date'], '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({"ok": False, "error": "invalid date"}), 400
+
+    found = find_free_slots(salon_id, service_id, days=days, start_date=start_date,
+                            staff_id=staff_id, step_min=step)
+    if found is None:
+        return jsonify({"ok": False, "error": "service not found"}), 404
+
+    return jsonify({"ok": True, "slots": [{
+        "start_at": s["start_at"].isoformat(),
+        "end_at": s["end_at"].isoformat(),
+        "staff_ids": s["staff_ids"],
+    } for s in found]})
+
+def _local_datetime(value):
+    """ISO 形式の日時。"+09:00" などのオフセット付きはサーバのローカル時刻（DB と同じ naive）に直す"""
+    value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+# 予約作成（JSON）
+# body: {"salon_id": 1, "service_id": 2, "start_at": "2025-01-01T10:00", "staff_id": null, "coupon_code": null}
+@reservation_bp.route('/book', methods=['POST'])
+def book():
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({"ok": False, "error": "login_required"}), 401
+
+    data = request.get_json(silent=True) or {}
+    try:
+        salon_id = int(data["salon_id"])
+        service_id = int(data["service_id"])
+        start_at = _local_datetime(data["start_at"])
+        staff_id = int(data["staff_id"]) if data.get("staff_id") is not None else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"ok": False, "error": "invalid_request"}), 400
+
+    try:
+        r = create_reservation(
+            user_id, salon_id, service_id, start_at,
+            staff_id=staff_id,
+            coupon_code=data.get("coupon_code"),
+            note=data.get("note"),
+        )
+    except SlotUnavailable as e:
+        return jsonify({"ok": False, "error": e.code}), 409
+    except DatabaseBusy as e:
+        return jsonify({"ok": False, "error": e.code}), 503
+    except BookingError as e:
+        return jsonify({"ok": False, "error": e.code, "detail": str(e)}), 400
+
+    return jsonify({"ok": True, "reservation": {
+        "id": r.id,
+        "staff_id": r.staff_id,
+        "start_at": r.start_at.isoformat(),
+        "end_at": r.end_at.isoformat(),
+        "amount_jpy": r.amount_jpy,
+    }})
@@ -0,0 +1,281 @@
+# 空き枠計算エンジン
+#
+# 営業時間・休業日・既存予約を数回の範囲クエリでまとめて取得し、
+# 1日 = 1440bit の整数ビットマップ（1bit = 1分）に展開して空き枠を計算する。
+# 候補枠ごとに DB へ問い合わせることはしない。
+from datetime import datetime, date, time, timedelta
+
+from database import Service, SalonStaff, WorkingHour, BlackoutDate, Reservation
+
+MINUTES_PER_DAY = 24 * 60
+FULL_DAY = (1 << MINUTES_PER_DAY) - 1
+INACTIVE_STATUSES = (3, 4)  # canceled / no_show は枠を占有しない
+DEFAULT_STEP_MIN = 15
+MAX_DAYS = 62
+
+
+def _minute(t):
+    return t.hour * 60 + t.minute
+
+
+def _span_mask(start_min, end_min):
+    """[start_min, end_min) の分に bit を立てたマスク"""
+    start_min = max(start_min, 0)
+    end_min = min(end_min, MINUTES_PER_DAY)
+    if end_min <= start_min:
+        return 0
+    return ((1 << (end_min - start_min)) - 1) << start_min
+
+
+def _runs_of(free, length):
+    """bit t が立つ ⇔ free の [t, t+length) がすべて空き"""
+    ok = free
+    covered = 1
+    while covered < length:
+        shift = min(covered, length - covered)
+        ok &= ok >> shift
+        covered += shift
+    return ok
+
+
+def _grid_mask(step_min):
+    mask = 0
+    for m in range(0, MINUTES_PER_DAY, step_min):
+        mask |= 1 << m
+    return mask
+
+
+_GRID_CACHE = {}
+
+
+def _grid(step_min):
+    mask = _GRID_CACHE.get(step_min)
+    if mask is None:
+        mask = _GRID_CACHE[step_min] = _grid_mask(step_min)
+    return mask
+
+
+def _bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Schedule:
+    """
+    サロン1件・期間分の営業枠と、担当者（レーン）ごとの埋まり状況。
+    - open_masks: {date: 営業している分のビットマップ}（休業日・部分休業を除外済み）
+    - lanes: {staff_id: {date: 予約で埋まっている分のビットマップ}}
+      スタッフ未登録のサロンは staff_id=None の1レーンのみ。
+    """
+
+    def __init__(self, salon_id, start_date, days, staff_ids):
+        self.salon_id = salon_id
+        self.start_date = start_date
+        self.days = days
+        self.staff_ids = list(staff_ids)
+        self.open_masks = {}
+        self.lanes = {sid: {} for sid in (self.staff_ids or [None])}
+
+    def dates(self):
+        return [self.start_date + timedelta(days=i) for i in range(self.days)]
+
+    def busy(self, lane, day):
+        return self.lanes.get(lane, {}).get(day, 0)
+
+    def occupy(self, lane, start_at, end_at):
+        for day, mask in _split_by_day(start_at, end_at):
+            day_masks = self.lanes.setdefault(lane, {})
+            day_masks[day] = day_masks.get(day, 0) | mask
+
+    def free_lanes(self, start_at, end_at, staff_id=None):
+        """[start_at, end_at) を営業時間内で受けられるレーン一覧"""
+        pieces = _split_by_day(start_at, end_at)
+        candidates = [staff_id] if staff_id is not None else list(self.lanes)
+        lanes = []
+        for lane in candidates:
+            if lane not in self.lanes:
+                continue
+            if all(
+                mask & ~self.open_masks.get(day, 0) == 0 and mask & self.busy(lane, day) == 0
+                for day, mask in pieces
+            ):
+                lanes.append(lane)
+        return lanes
+
+    def assign(self, start_at, end_at):
+        """担当者未指定の予約を、空いている最初のレーンに割り当てる"""
+        pieces = _split_by_day(start_at, end_at)
+        for lane in self.lanes:
+            if all(mask & self.busy(lane, day) == 0 for day, mask in pieces):
+                self.occupy(lane, start_at, end_at)
+                return lane
+        return None
+
+
+def _split_by_day(start_at, end_at):
+    """日付を跨ぐ区間を [(date, mask), ...] に分割"""
+    pieces = []
+    day = start_at.date()
+    while datetime.combine(day, time()) < end_at:
+        day_start = datetime.combine(day, time())
+        s = max(int((start_at - day_start).total_seconds() // 60), 0)
+        e = min(-int(-(end_at - day_start).total_seconds() // 60), MINUTES_PER_DAY)
+        mask = _span_mask(s, e)
+        if mask:
+            pieces.append((day, mask))
+        day += timedelta(days=1)
+    return pieces
+
+
+def load_open_masks(salon_id, start_date, days):
+    """期間内の日ごとの営業枠 {date: ビットマップ}（WorkingHour / BlackoutDate の2クエリ）"""
+    end_date = start_date + timedelta(days=days)
+
+    # 曜日ごとの営業時間（分割シフトは OR で合成）
+    weekly = {}
+    hours = (
+        WorkingHour
+        .select(WorkingHour.weekday, WorkingHour.start, WorkingHour.end, WorkingHour.is_closed)
+        .where(WorkingHour.salon == salon_id)
+        .tuples()
+    )
+    for weekday, start, end, is_closed in hours:
+        mask = 0 if is_closed else _span_mask(_minute(start), _minute(end))
+        weekly[weekday] = weekly.get(weekday, 0) | mask
+
+    open_masks = {}
+    for i in range(days):
+        day = start_date + timedelta(days=i)
+        open_masks[day] = weekly.get(day.weekday(), 0)
+
+    # 休業日（start/end が無ければ終日、あればその時間帯のみ）
+    blackouts = (
+        BlackoutDate
+        .select(BlackoutDate.date, BlackoutDate.start, BlackoutDate.end)
+        .where(
+            (BlackoutDate.salon == salon_id)
+            & (BlackoutDate.date >= start_date)
+            & (BlackoutDate.date < end_date)
+        )
+        .tuples()
+    )
+    for day, start, end in blackouts:
+        if day not in open_masks:
+            continue
+        if start is None or end is None:
+            open_masks[day] = 0
+        else:
+            open_masks[day] &= FULL_DAY ^ _span_mask(_minute(start), _minute(end))
+    return open_masks
+
+
+def load_schedule(salon_id, start_date, days, staff_ids=None):
+    """
+    期間内の営業枠と既存予約をまとめて読み込む。
+    クエリは WorkingHour / BlackoutDate / SalonStaff / Reservation の4本のみ。
+    """
+    days = max(1, min(int(days), MAX_DAYS))
+    end_date = start_date + timedelta(days=days)
+
+    if staff_ids is None:
+        staff_ids = [
+            sid for (sid,) in (
+                SalonStaff
+                .select(SalonStaff.id)
+                .where((SalonStaff.salon == salon_id) & (SalonStaff.is_active == True))
+                .order_by(SalonStaff.id)
+                .tuples()
+            )
+        ]
+    schedule = Schedule(salon_id, start_date, days, staff_ids)
+    schedule.open_masks = load_open_masks(salon_id, start_date, days)
+
+    # 既存予約（キャンセル・無断キャンセル以外）
+    window_start = datetime.combine(start_date, time())
+    window_end = datetime.combine(end_date, time())
+    reservations = (
+        Reservation
+        .select(Reservation.staff, Reservation.start_at, Reservation.end_at)
+        .where(
+            (Reservation.salon == salon_id)
+            & (Reservation.start_at < window_end)
+            & (Reservation.end_at > window_start)
+            & (Reservation.status.not_in(INACTIVE_STATUSES))
+        )
+        .order_by(Reservation.start_at)
+        .tuples()
+    )
+    unassigned = []
+    for staff_id, start_at, end_at in reservations:
+        if not staff_ids:
+            schedule.occupy(None, start_at, end_at)
+        elif staff_id is None:
+            unassigned.append((start_at, end_at))
+        else:
+            schedule.occupy(staff_id, start_at, end_at)
+
+    # 担当者未定の予約もいずれかのスタッフの手を塞ぐ
+    for start_at, end_at in unassigned:
+        schedule.assign(start_at, end_at)
+
+    return schedule
+
+
+def find_free_slots(salon_id, service_id, days=7, start_date=None, staff_id=None,
+                    step_min=DEFAULT_STEP_MIN, now=None):
+    """
+    サロン・メニュー・期間を指定して予約可能な枠を返す。
+    戻り値: [{"start_at": datetime, "end_at": datetime, "staff_ids": [...]}, ...]
+    メニューが存在しない（または非公開）の場合は None。
+    """
+    service = (
+        Service
+        .select(Service.id, Service.duration_min)
+        .where(
+            (Service.id == service_id)
+            & (Service.salon == salon_id)
+            & (Service.is_active == True)
+        )
+        .first()
+    )
+    if service is None:
+        return None
+
+    now = now or datetime.now()
+    start_date = start_date or now.date()
+    schedule = load_schedule(salon_id, start_date, days)
+    if staff_id is not None and staff_id not in schedule.lanes:
+        return []
+
+    duration = service.duration_min
+    grid = _grid(max(1, int(step_min)))
+    lanes = [staff_id] if staff_id is not None else list(schedule.lanes)
+
+    slots = []
+    for day in schedule.dates():
+        open_mask = schedule.open_masks[day]
+        if not open_mask:
+            continue
+        if day < now.date():
+            continue
+        if day == now.date():
+            # 過去の時刻は予約不可
+            open_mask &= FULL_DAY ^ _span_mask(0, _minute(now.time()) + 1)
+
+        starts = {}
+        for lane in lanes:
+            ok = _runs_of(open_mask & ~schedule.busy(lane, day), duration) & grid
+            for m in _bits(ok):
+                starts.setdefault(m, []).append(lane)
+
+        day_start = datetime.combine(day, time())
+        for m in sorted(starts):
+            start_at = day_start + timedelta(minutes=m)
+            slots.append({
+                "start_at": start_at,
+                "end_at": start_at + timedelta(minutes=duration),
+                "staff_ids": [lane for lane in starts[m] if lane is not None],
+            })
+    return slots
@@ -0,0 +1,200 @@
+# 予約作成サービス
+#
+# 区間の重なりを検査してから予約を書き込むまでを1トランザクションで行う。
+# SQLite では BEGIN IMMEDIATE で書き込みロックを先に取り、
+# 「検査してから書くまでの間に他の予約が割り込む」ことを防ぐ。
+# 変更イベントも同じトランザクションで予約イベントジャーナルに書く（journal.py）。
+import random
+import time
+from datetime import datetime, timedelta
+
+from peewee import OperationalError, SqliteDatabase
+
+from database import (
+    db, Salon, Service, Reservation, CouponRedemption
+)
+from blueprints.coupon.engine import offer_for_code
+from .stats import record_change, snapshot
+from .journal import record, event, state, diff
+from .availability import load_schedule, INACTIVE_STATUSES
+
+# status → イベントの action
+STATUS_ACTIONS = {0: "pending", 1: "confirm", 2: "complete", 3: "cancel", 4: "no_show"}
+PAYMENT_STATUSES = (0, 1, 2)
+
+MAX_RETRIES = 8
+RETRY_BASE_SEC = 0.01
+RETRY_MAX_SEC = 0.5
+
+
+class BookingError(Exception):
+    """予約できなかった理由（code は API のエラー文字列としてそのまま返す）"""
+    code = "booking_failed"
+
+    def __init__(self, message=None):
+        super().__init__(message or self.code)
+
+
+class InvalidRequest(BookingError):
+    code = "invalid_request"
+
+
+class SlotUnavailable(BookingError):
+    code = "slot_unavailable"
+
+
+class InvalidCoupon(BookingError):
+    code = "invalid_coupon"
+
+
+class DatabaseBusy(BookingError):
+    code = "busy"
+
+
+def _is_locked(exc):
+    msg = str(exc).lower()
+    return "locked" in msg or "busy" in msg
+
+
+def _write_transaction():
+    if isinstance(db, SqliteDatabase):
+        return db.atomic("IMMEDIATE")
+    return db.atomic()
+
+
+def run_with_retry(fn, *args, **kwargs):
+    """
+    書き込みトランザクションを実行し、`database is locked` のときだけ
+    指数バックオフ（ジッタ付き）で最大 MAX_RETRIES 回やり直す。
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return fn(*args, **kwargs)
+        except OperationalError as exc:
+            if not _is_locked(exc) or attempt == MAX_RETRIES:
+                if _is_locked(exc):
+                    raise DatabaseBusy(str(exc))
+                raise
+            delay = min(RETRY_MAX_SEC, RETRY_BASE_SEC * (2 ** attempt))
+            time.sleep(delay * (0.5 + random.random() / 2))
+
+
+def _create(user_id, salon_id, service_id, start_at, staff_id, coupon_code, note, actor_id):
+    with _write_transaction():
+        if not isinstance(db, SqliteDatabase):
+            # SQLite 以外はサロン行のロックで同一サロンへの書き込みを直列化
+            Salon.select(Salon.id).where(Salon.id == salon_id).for_update().first()
+
+        service = (
+            Service
+            .select()
+            .where(
+                (Service.id == service_id)
+                & (Service.salon == salon_id)
+                & (Service.is_active == True)
+            )
+            .first()
+        )
+        if service is None:
+            raise InvalidRequest("service not found")
+        end_at = start_at + timedelta(minutes=service.duration_min)
+
+        days = (end_at.date() - start_at.date()).days + 1
+        schedule = load_schedule(salon_id, start_at.date(), days)
+        lanes = schedule.free_lanes(start_at, end_at, staff_id)
+        if not lanes:
+            raise SlotUnavailable()
+        lane = lanes[0]
+
+        offer = None
+        amount = service.price_jpy
+        if coupon_code:
+            offer, reason = offer_for_code(
+                coupon_code, user_id, salon_id, service.id, service.price_jpy, at=start_at
+            )
+            if offer is None:
+                raise InvalidCoupon(reason)
+            amount = offer["amount_jpy"]
+
+        reservation = Reservation.create(
+            user=user_id,
+            salon=salon_id,
+            service=service.id,
+            staff=lane,
+            start_at=start_at,
+            end_at=end_at,
+            status=1,
+            amount_jpy=amount,
+            note=note,
+        )
+        if offer is not None:
+            CouponRedemption.create(coupon=offer["id"], user=user_id, reservation=reservation)
+        record_change(None, snapshot(reservation))
+        record(reservation.id, [event("create", after=state(reservation), actor=actor_id or user_id)])
+    return reservation
+
+
+def create_reservation(user_id, salon_id, service_id, start_at, staff_id=None,
+                       coupon_code=None, note=None, actor_id=None, now=None):
+    """
+    予約を1件作成する。
+    - 同じ担当者（担当者なしのサロンはサロン全体）で時間が重なる予約があれば SlotUnavailable
+    - 担当者未指定ならその時間に空いているスタッフを割り当てる
+    - 予約・クーポン利用履歴・集計・作成イベントを同一トランザクションで書き込む
+    """
+    now = now or datetime.now()
+    if start_at < now:
+        raise InvalidRequest("start_at is in the past")
+    return run_with_retry(
+        _create, user_id, salon_id, service_id, start_at, staff_id, coupon_code, note, actor_id
+    )
+
+
+def _change_status(reservation_id, status, payment_status, actor_id, salon_id):
+    with _write_transaction():
+        query = Reservation.select().where(Reservation.id == reservation_id)
+        if salon_id is not None:
+            query = query.where(Reservation.salon == salon_id)
+        reservation = query.first()
+        if reservation is None:
+            raise InvalidRequest("reservation not found")
+        if status is not None and status != reservation.status and status not in INACTIVE_STATUSES \
+                and reservation.status in INACTIVE_STATUSES:
+            # キャンセル済みの枠には別の予約が入っているかもしれないので、戻すときは空きを確かめる
+            schedule = load_schedule(reservation.salon_id, reservation.start_at.date(),
+                                     (reservation.end_at.date() - reservation.start_at.date()).days + 1)
+            if not schedule.free_lanes(reservation.start_at, reservation.end_at, reservation.staff_id):
+                raise SlotUnavailable()
+
+        before = snapshot(reservation)
+        previous = state(reservation)
+        actions = []
+        if status is not None and status != reservation.status:
+            reservation.status = status
+            actions.append((STATUS_ACTIONS[status], ("status",)))
+        if payment_status is not None and payment_status != reservation.payment_status:
+            reservation.payment_status = payment_status
+            actions.append(("payment", ("payment_status",)))
+        if not actions:
+            return reservation
+        reservation.save()
+        record_change(before, snapshot(reservation))
+        current = state(reservation)
+        events = []
+        for action, keys in actions:
+            changed_before, changed_after = diff(previous, current, keys)
+            events.append(event(action, before=changed_before, after=changed_after, actor=actor_id))
+        record(reservation.id, events)
+    return reservation
+
+
+def change_status(reservation_id, status=None, payment_status=None, actor_id=None, salon_id=None):
+    """
+    予約の状態・支払状態を変更する（オーナー向け集計・変更イベントも同じトランザクションで書く）。
+    salon_id を渡すとそのサロンの予約に限る。
+    """
+    if status is not None and status not in STATUS_ACTIONS:
+        raise InvalidRequest("invalid status")
+    if payment_status is not None and payment_status not in PAYMENT_STATUSES:
+        raise InvalidRequest("invalid payment_status")
+    return run_with_retry(_change_status, reservation_id, status, payment_status, actor_id, salon_id)
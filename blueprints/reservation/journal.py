@@ -0,0 +1,279 @@
+# 予約イベントジャーナル（月別パーティション）
+#
+# 予約の作成・状態変更ごとに ReservationChangeLog へ1行ずつ書く代わりに、変更前後の値をイベントとして
+# 予約と同じトランザクションで書く（コミットされた予約のイベントは失われない）。
+#   - record() は予約を書いた書き込みトランザクションの中で呼ぶ。そのトランザクションのイベントを
+#     月ごとに1回の INSERT にまとめる（状態変更で複数のイベントができても1文）
+#   - パーティションはイベント時刻（at、UTC）の月のテーブル（reservation_event_YYYYMM）。
+#     書いた時刻では分けないので、月末に作った予約のイベントが翌月のテーブルに入ることはない
+#   - イベントは {"action", "at", "actor", "before", "after"}。before/after は変わった列だけ
+#     （作成は after に全列）。JSON を共通の語を並べたプリセット辞書付きの zlib で圧縮して持つ
+#   - 締まった月は compact() で予約ごとに1行へまとめて圧縮し直せる（退避は月ごとのテーブル単位）。
+#     まとめた行はその予約の最後の行の id を引き継ぐので、read_since() の位置はずれない
+#   - history() は予約の作成月（Reservation.created_at）以降のパーティションだけを読む
+#   - replay() でイベントを畳み込み、任意の時点の予約の状態を組み立て直す
+#   - read_since() は「ここまで読んだ」位置（'YYYYMM:id'）から後に書かれた行を追いかける
+#
+#   python reservation_journal.py --list | --compact 202501 | --replay 123 --at 2025-01-01T10:00
+import json
+import re
+import zlib
+from datetime import datetime
+
+from peewee import OperationalError, SqliteDatabase, chunked
+
+from database import db, Reservation, reservation_event_partition, EVENT_TABLE_PREFIX
+
+INSERT_CHUNK = 500
+
+# 予約の状態として記録する列
+STATE_FIELDS = (
+    "user", "salon", "service", "staff", "start_at", "end_at",
+    "status", "payment_status", "amount_jpy", "note",
+)
+DATETIME_KEYS = ("at", "start_at", "end_at")
+
+# 圧縮形式（先頭1バイト）。ZDICT は書いたデータの復元に使うので、変えるときは FORMAT を上げて残す
+FORMAT = 1
+ZDICT = (
+    b'"before":null,"after":{"user":"salon":"service":"staff":null,"start_at":"2025-01-01T00:00:00",'
+    b'"end_at":"2025-01-01T00:30:00","status":1,"payment_status":0,"amount_jpy":"note":null}'
+    b'"detail":[{"action":"create","at":"2025-01-01T00:00:00.000000","actor":'
+    b'"confirm""pending""complete""cancel""no_show""payment""status":3'
+)
+_MONTH = re.compile(r"^" + re.escape(EVENT_TABLE_PREFIX) + r"(\d{6})$")
+
+
+# ---- エンコード ----
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode(events):
+    raw = json.dumps(events, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+    c = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY, ZDICT)
+    return bytes([FORMAT]) + c.compress(raw) + c.flush()
+
+
+def _parse_datetimes(values):
+    for key in DATETIME_KEYS:
+        if isinstance(values.get(key), str):
+            values[key] = datetime.fromisoformat(values[key])
+
+
+def decode(payload):
+    payload = bytes(payload)
+    if payload[0] != FORMAT:
+        raise ValueError(f"unknown journal format: {payload[0]}")
+    d = zlib.decompressobj(-zlib.MAX_WBITS, ZDICT)
+    events = json.loads(d.decompress(payload[1:]) + d.flush())
+    for event in events:
+        _parse_datetimes(event)
+        for key in ("before", "after"):
+            if event.get(key):
+                _parse_datetimes(event[key])
+    return events
+
+
+# ---- イベント ----
+def state(reservation):
+    """予約の状態（STATE_FIELDS の dict）"""
+    return {name: getattr(reservation, f"{name}_id" if name in ("user", "salon", "service", "staff") else name)
+            for name in STATE_FIELDS}
+
+
+def diff(before, after, keys=STATE_FIELDS):
+    """変わった列だけの (before, after)"""
+    changed = [k for k in keys if before.get(k) != after.get(k)]
+    return {k: before.get(k) for k in changed}, {k: after.get(k) for k in changed}
+
+
+def event(action, before=None, after=None, actor=None, at=None, **extra):
+    return dict({"action": action, "at": at or datetime.utcnow(), "actor": actor,
+                 "before": before, "after": after}, **extra)
+
+
+# ---- パーティション ----
+def month_of(at):
+    return f"{at:%Y%m}"
+
+
+def partitions():
+    """存在するパーティションの月（'YYYYMM'）を古い順に"""
+    return sorted(m.group(1) for m in map(_MONTH.match, db.get_tables()) if m)
+
+
+_created = set()
+
+
+def _partition(month):
+    model = reservation_event_partition(month)
+    if month not in _created:
+        model.create_table(safe=True)
+        _created.add(month)
+    return model
+
+
+def drop_partitions():
+    """全パーティションを消す（seed_data.py で作り直すとき用）"""
+    for month in partitions():
+        reservation_event_partition(month).drop_table(safe=True)
+    _created.clear()
+
+
+def _write_transaction():
+    if isinstance(db, SqliteDatabase):
+        return db.atomic("IMMEDIATE")
+    return db.atomic()
+
+
+def _rows(batch):
+    """[(reservation_id, event)] → 1イベント1行"""
+    for reservation_id, e in batch:
+        yield (reservation_id, e["at"], e["at"], 1, encode([e]))
+
+
+def _insert(model, rows):
+    fields = [model.reservation, model.first_at, model.last_at, model.events, model.payload]
+    for chunk in chunked(rows, INSERT_CHUNK):
+        model.insert_many(chunk, fields=fields).execute()
+
+
+def append(batch):
+    """
+    [(reservation_id, event)] をイベント時刻の月のパーティションに書く（呼び出し側のトランザクションの中で）。
+    月ごとに1回の INSERT
+    """
+    by_month = {}
+    for reservation_id, e in batch:
+        by_month.setdefault(month_of(e["at"]), []).append((reservation_id, e))
+    for month, events in by_month.items():
+        try:
+            _insert(_partition(month), list(_rows(events)))
+        except OperationalError:
+            # テーブルを作ったトランザクションがロールバックされていれば、次の呼び出しで作り直す
+            _created.discard(month)
+            raise
+    return sum(len(events) for events in by_month.values())
+
+
+def record(reservation_id, events):
+    """予約のイベント（event() の戻り値のリスト）を書く。予約を書いたトランザクションの中で呼ぶ"""
+    return append([(reservation_id, e) for e in events])
+
+
+def import_events(batch):
+    """[(reservation_id, event)] を1トランザクションで書く（移行・データ投入用）"""
+    with db.atomic():
+        return append(batch)
+
+
+# ---- 読み出し ----
+def _months(reservation_id, until=None):
+    """予約のイベントがありうるパーティション（作成月から until の月まで。予約が無ければ全部）"""
+    months = partitions()
+    created_at = Reservation.select(Reservation.created_at).where(Reservation.id == reservation_id).scalar()
+    if created_at is not None:
+        months = [m for m in months if m >= month_of(created_at)]
+    if until is not None:
+        months = [m for m in months if m <= month_of(until)]
+    return months
+
+
+def history(reservation_id, until=None):
+    """予約のイベントを時刻順に（until 以前のみ）"""
+    events = []
+    for month in _months(reservation_id, until):
+        model = reservation_event_partition(month)
+        query = model.select(model.payload).where(model.reservation == reservation_id)
+        if until is not None:
+            query = query.where(model.first_at <= until)
+        for (payload,) in query.order_by(model.id).tuples():
+            events.extend(decode(payload))
+    if until is not None:
+        events = [e for e in events if e["at"] <= until]
+    events.sort(key=lambda e: e["at"])
+    return events
+
+
+def replay(reservation_id, at=None):
+    """
+    at（UTC、省略時は最新）時点の予約の状態をイベントから組み立てる。
+    まだ作成されていなければ None。戻り値は STATE_FIELDS と id・version（適用したイベント数）・updated_at と
+    missing_create（最初のイベントが作成でない = 作成イベントが無く、変わった列しか分からない）
+    """
+    current = None
+    for e in history(reservation_id, until=at):
+        if e["action"] == "create" or current is None:
+            current = {"id": reservation_id, "version": 0, "missing_create": e["action"] != "create"}
+        current.update(e.get("after") or {})
+        current["version"] += 1
+        current["updated_at"] = e["at"]
+    return current
+
+
+def latest_position():
+    months = partitions()
+    if not months:
+        return f"{month_of(datetime.utcnow())}:0"
+    model = reservation_event_partition(months[-1])
+    last_id = model.select(model.id).order_by(model.id.desc()).scalar() or 0
+    return f"{months[-1]}:{last_id}"
+
+
+def read_since(position, limit):
+    """position（'YYYYMM:id'）より後に書かれた行の予約 id と、読んだ後の位置"""
+    month, _, last_id = position.partition(":")
+    last_id = int(last_id or 0)
+    for m in partitions():
+        if m < month:
+            continue
+        model = reservation_event_partition(m)
+        rows = list(
+            model
+            .select(model.id, model.reservation)
+            .where(model.id > (last_id if m == month else 0))
+            .order_by(model.id)
+            .limit(limit)
+            .tuples()
+        )
+        if rows:
+            return [rid for _, rid in rows], f"{m}:{rows[-1][0]}"
+    return [], position
+
+
+# ---- 保守 ----
+def compact(month):
+    """
+    締まった月（今月より前）のパーティションを予約ごとに1行へまとめて圧縮し直す。
+    (行数, まとめた後の行数, payload のバイト数, まとめた後のバイト数) を返す
+    """
+    if month >= month_of(datetime.utcnow()):
+        raise ValueError(f"{month} is not closed yet")
+    if month not in partitions():
+        raise ValueError(f"no partition for {month}")
+    model = reservation_event_partition(month)
+    with _write_transaction():
+        grouped = {}
+        rows = size = 0
+        for row_id, reservation_id, payload in (
+            model.select(model.id, model.reservation, model.payload).order_by(model.id).tuples()
+        ):
+            entry = grouped.setdefault(reservation_id, [row_id, []])
+            entry[0] = row_id
+            entry[1].extend(decode(payload))
+            rows += 1
+            size += len(payload)
+        packed = []
+        for reservation_id, (last_id, events) in grouped.items():
+            events.sort(key=lambda e: e["at"])
+            packed.append((last_id, reservation_id, events[0]["at"], events[-1]["at"], len(events), encode(events)))
+        model.delete().execute()
+        # id は予約の最後の行のものを使う。位置 'YYYYMM:n' まで読んだ読み手には、n より後の行を含んでいた予約
+        # だけがもう一度見え、読み終えていた予約は見えない（id を振り直すと読み直しや読み飛ばしが起きる）
+        fields = [model.id, model.reservation, model.first_at, model.last_at, model.events, model.payload]
+        for chunk in chunked(packed, INSERT_CHUNK):
+            model.insert_many(chunk, fields=fields).execute()
+    return rows, len(packed), size, sum(len(row[-1]) for row in packed)
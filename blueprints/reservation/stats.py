@@ -0,0 +1,305 @@
+# オーナー向けの売上・稼働集計
+#
+# SalonDailyStat（サロン×担当者×日）に、予約1件ぶんの寄与を差分で加算・減算する。
+#   作成        : +寄与(新)
+#   状態変更など : -寄与(旧) +寄与(新)
+# ダッシュボードは SalonDailyStat を日付範囲で読むだけで、Reservation は走査しない。
+# 過去分の作り直し（backfill）は分単位の占有配列を NumPy（requirements.txt）でまとめて計算する。
+# use_numpy=False なら同じ値を Python で計算する（遅い）。use_numpy=None は入っていれば NumPy を使い、
+# 無ければ警告を出して Python で計算する。use_numpy=True で NumPy が無ければ RuntimeError。
+import warnings
+from datetime import datetime, date, time, timedelta
+
+from peewee import EXCLUDED, fn
+
+from database import db, Reservation, Salon, SalonStaff, SalonDailyStat
+from .availability import (
+    INACTIVE_STATUSES, MINUTES_PER_DAY, load_open_masks, _split_by_day,
+)
+
+STATUS_COLUMNS = ("pending", "confirmed", "completed", "canceled", "no_show")  # status 0..4
+AMOUNT_COLUMNS = ("revenue_jpy", "unpaid_jpy", "refunded_jpy")
+COLUMNS = ("bookings",) + STATUS_COLUMNS + AMOUNT_COLUMNS + ("booked_min",)
+BACKFILL_CHUNK_DAYS = 31
+
+_FIELDS = (
+    Reservation.id, Reservation.salon, Reservation.staff, Reservation.start_at, Reservation.end_at,
+    Reservation.status, Reservation.payment_status, Reservation.amount_jpy,
+)
+
+
+def snapshot(reservation):
+    """集計に効く列だけを dict にする（変更前の値を覚えておくため）"""
+    return {
+        "salon": reservation.salon_id,
+        "staff": reservation.staff_id,
+        "start_at": reservation.start_at,
+        "end_at": reservation.end_at,
+        "status": reservation.status,
+        "payment_status": reservation.payment_status,
+        "amount_jpy": reservation.amount_jpy,
+    }
+
+
+def _amount_column(status, payment_status):
+    if payment_status == 1:
+        return "revenue_jpy"
+    if payment_status == 2:
+        return "refunded_jpy"
+    if status not in INACTIVE_STATUSES:
+        return "unpaid_jpy"
+    return None
+
+
+def contribution(r, sign=1):
+    """予約1件の寄与 {(salon_id, staff_id, day): {列: 値}}"""
+    key = (r["salon"], r["staff"] or 0, r["start_at"].date())
+    row = {"bookings": sign, STATUS_COLUMNS[r["status"]]: sign}
+    column = _amount_column(r["status"], r["payment_status"])
+    if column and r["amount_jpy"]:
+        row[column] = sign * r["amount_jpy"]
+    deltas = {key: row}
+    if r["status"] not in INACTIVE_STATUSES:
+        for day, mask in _split_by_day(r["start_at"], r["end_at"]):
+            piece = deltas.setdefault((key[0], key[1], day), {})
+            piece["booked_min"] = piece.get("booked_min", 0) + sign * bin(mask).count("1")
+    return deltas
+
+
+def _merge(total, deltas):
+    for key, row in deltas.items():
+        acc = total.setdefault(key, {})
+        for column, value in row.items():
+            acc[column] = acc.get(column, 0) + value
+    return total
+
+
+def apply(deltas):
+    """差分をまとめて UPSERT で加算する"""
+    now = datetime.utcnow()
+    rows = []
+    for (salon_id, staff_id, day), row in deltas.items():
+        if not any(row.values()):
+            continue
+        rows.append(dict(
+            {column: row.get(column, 0) for column in COLUMNS},
+            salon=salon_id, staff_id=staff_id, day=day, created_at=now, updated_at=now,
+        ))
+    if not rows:
+        return
+    update = {getattr(SalonDailyStat, c): getattr(SalonDailyStat, c) + getattr(EXCLUDED, c) for c in COLUMNS}
+    update[SalonDailyStat.updated_at] = now
+    for i in range(0, len(rows), 200):
+        (SalonDailyStat
+         .insert_many(rows[i:i + 200])
+         .on_conflict(
+             conflict_target=[SalonDailyStat.salon, SalonDailyStat.day, SalonDailyStat.staff_id],
+             update=update,
+         )
+         .execute())
+
+
+def record_change(before, after):
+    """予約の作成（before=None）・変更を集計に反映する。予約の書き込みと同じトランザクション内で呼ぶ"""
+    deltas = {}
+    if before is not None:
+        _merge(deltas, contribution(before, -1))
+    if after is not None:
+        _merge(deltas, contribution(after, 1))
+    apply(deltas)
+
+
+# ---- 読み出し ----
+def daily_stats(salon_id, start_date, end_date):
+    """
+    [start_date, end_date] の集計を返す。
+    days: 日ごとの合計、staff: 担当者ごとの予約分数・営業分数・稼働率
+    """
+    rows = list(
+        SalonDailyStat
+        .select()
+        .where(
+            (SalonDailyStat.salon == salon_id)
+            & (SalonDailyStat.day >= start_date)
+            & (SalonDailyStat.day <= end_date)
+        )
+        .order_by(SalonDailyStat.day, SalonDailyStat.staff_id)
+        .dicts()
+    )
+    days = {}
+    staff = {}
+    for row in rows:
+        day = days.setdefault(row["day"], {c: 0 for c in COLUMNS})
+        for column in COLUMNS:
+            day[column] += row[column]
+        staff[row["staff_id"]] = staff.get(row["staff_id"], 0) + row["booked_min"]
+
+    # 営業時間はサロン単位なので、担当者ごとの受け入れ可能分数は同じ
+    span = (end_date - start_date).days + 1
+    capacity = sum(bin(mask).count("1") for mask in load_open_masks(salon_id, start_date, span).values())
+    names = dict(
+        SalonStaff
+        .select(SalonStaff.id, SalonStaff.display_name)
+        .where((SalonStaff.salon == salon_id) & (SalonStaff.is_active == True))
+        .tuples()
+    )
+    for staff_id in names:
+        staff.setdefault(staff_id, 0)
+
+    return {
+        "days": [dict(row, day=d.isoformat()) for d, row in sorted(days.items())],
+        "staff": [{
+            "staff_id": staff_id or None,
+            "name": names.get(staff_id),
+            "booked_min": booked,
+            "capacity_min": capacity,
+            "occupancy": round(booked / capacity, 4) if capacity else None,
+        } for staff_id, booked in sorted(staff.items())],
+    }
+
+
+# ---- backfill ----
+def _load_reservations(salon_id, window_start, window_end, since=None):
+    """
+    期間に掛かる予約。since を渡すと start_at >= since のものだけ読む
+    （前の期間から続く予約は呼び出し側が持ち越すので、(salon, start_at) 索引を期間の頭から引ける）
+    """
+    query = (
+        Reservation
+        .select(*_FIELDS)
+        .where((Reservation.salon == salon_id) & (Reservation.start_at < window_end))
+    )
+    if since is None:
+        query = query.where(Reservation.end_at > window_start)
+    else:
+        query = query.where(Reservation.start_at >= since)
+    return list(query.dicts())
+
+
+def _aggregate_python(salon_id, reservations, start_date, days):
+    end_date = start_date + timedelta(days=days)
+    total = {}
+    for r in reservations:
+        for key, row in contribution(r).items():
+            if start_date <= key[2] < end_date:
+                _merge(total, {key: row})
+    return total
+
+
+def _aggregate_numpy(np, salon_id, reservations, start_date, days):
+    """
+    担当者（レーン）ごとに期間全体の分単位配列を作り、開始 +1・終了 -1 を置いて累積和を取る。
+    日ごとの合計が booked_min、件数・金額は (レーン, 日) の添字に np.add.at でまとめて加算。
+    """
+    if not reservations:
+        return {}
+    window_start = datetime.combine(start_date, time())
+    span = days * MINUTES_PER_DAY
+    lanes = sorted({r["staff"] or 0 for r in reservations})
+    lane_index = {lane: i for i, lane in enumerate(lanes)}
+
+    lane = np.array([lane_index[r["staff"] or 0] for r in reservations], dtype=np.int64)
+    start = np.array([(r["start_at"] - window_start).total_seconds() // 60 for r in reservations], dtype=np.int64)
+    end = np.array([-((window_start - r["end_at"]).total_seconds() // 60) for r in reservations], dtype=np.int64)
+    status = np.array([r["status"] for r in reservations], dtype=np.int64)
+    payment = np.array([r["payment_status"] for r in reservations], dtype=np.int64)
+    amount = np.array([r["amount_jpy"] or 0 for r in reservations], dtype=np.int64)
+    active = ~np.isin(status, INACTIVE_STATUSES)
+
+    # 分単位の占有（期間外は切り落とす）
+    diff = np.zeros((len(lanes), span + 1), dtype=np.int32)
+    s = np.clip(start, 0, span)[active]
+    e = np.clip(end, 0, span)[active]
+    np.add.at(diff, (lane[active], s), 1)
+    np.add.at(diff, (lane[active], e), -1)
+    occupancy = np.cumsum(diff[:, :span], axis=1)
+    booked = occupancy.reshape(len(lanes), days, MINUTES_PER_DAY).sum(axis=2)
+
+    # 件数・金額は開始日に計上（開始日が期間外のものは除く）
+    start_day = np.floor_divide(start, MINUTES_PER_DAY)
+    inside = (start_day >= 0) & (start_day < days)
+    columns = {name: np.zeros((len(lanes), days), dtype=np.int64) for name in COLUMNS if name != "booked_min"}
+    idx = (lane[inside], start_day[inside])
+    np.add.at(columns["bookings"], idx, 1)
+    for code, name in enumerate(STATUS_COLUMNS):
+        np.add.at(columns[name], idx, (status[inside] == code).astype(np.int64))
+    paid = payment[inside] == 1
+    refunded = payment[inside] == 2
+    unpaid = (payment[inside] == 0) & active[inside]
+    np.add.at(columns["revenue_jpy"], idx, np.where(paid, amount[inside], 0))
+    np.add.at(columns["refunded_jpy"], idx, np.where(refunded, amount[inside], 0))
+    np.add.at(columns["unpaid_jpy"], idx, np.where(unpaid, amount[inside], 0))
+    columns["booked_min"] = booked
+
+    total = {}
+    nonzero = np.argwhere(sum(np.abs(v) for v in columns.values()) > 0)
+    for li, di in nonzero:
+        key = (salon_id, lanes[li], start_date + timedelta(days=int(di)))
+        total[key] = {name: int(values[li, di]) for name, values in columns.items()}
+    return total
+
+
+def _numpy(use_numpy):
+    """use_numpy（True / None / False）に応じて numpy モジュールか None を返す"""
+    if use_numpy is False:
+        return None
+    try:
+        import numpy
+    except ImportError:
+        if use_numpy:
+            raise RuntimeError("NumPy がインストールされていません（pip install -r requirements.txt。"
+                               "Python で計算するなら use_numpy=False / --no-numpy）")
+        warnings.warn("NumPy が無いので集計の作り直しを Python で計算します（遅い）", RuntimeWarning, stacklevel=3)
+        return None
+    return numpy
+
+
+def backfill(start_date, end_date, salon_ids=None, chunk_days=BACKFILL_CHUNK_DAYS, use_numpy=None):
+    """
+    [start_date, end_date] の集計をサロンごと・chunk_days 日ごとに作り直す。
+    作り直した行数を返す。use_numpy はモジュール先頭のコメント参照
+    """
+    np = _numpy(use_numpy)
+    if salon_ids is None:
+        salon_ids = [sid for (sid,) in Salon.select(Salon.id).order_by(Salon.id).tuples()]
+    written = 0
+    for salon_id in salon_ids:
+        chunk_start = start_date
+        previous = None
+        while chunk_start <= end_date:
+            days = min(chunk_days, (end_date - chunk_start).days + 1)
+            window_start = datetime.combine(chunk_start, time())
+            window_end = window_start + timedelta(days=days)
+            if previous is None:
+                reservations = _load_reservations(salon_id, window_start, window_end)
+            else:
+                # 前の期間から跨いでいる予約を持ち越し、新しく始まる分だけ読む
+                reservations = [r for r in previous if r["end_at"] > window_start]
+                reservations += _load_reservations(salon_id, window_start, window_end, since=window_start)
+            previous = reservations
+            if np is not None:
+                total = _aggregate_numpy(np, salon_id, reservations, chunk_start, days)
+            else:
+                total = _aggregate_python(salon_id, reservations, chunk_start, days)
+            with db.atomic():
+                (SalonDailyStat
+                 .delete()
+                 .where(
+                     (SalonDailyStat.salon == salon_id)
+                     & (SalonDailyStat.day >= chunk_start)
+                     & (SalonDailyStat.day < chunk_start + timedelta(days=days))
+                 )
+                 .execute())
+                apply(total)
+            written += len(total)
+            chunk_start += timedelta(days=days)
+    return written
+
+
+def rebuild_daily_stats(use_numpy=None):
+    """全期間を作り直す（一括投入後などに使う）"""
+    first, last = Reservation.select(fn.MIN(Reservation.start_at), fn.MAX(Reservation.end_at)).tuples().get()
+    SalonDailyStat.delete().execute()
+    if first is None:
+        return 0
+    return backfill(first.date(), last.date(), use_numpy=use_numpy)
@@ -1,3 +1,6 @@
+from dotenv import load_dotenv
+load_dotenv()   # database.py は import 時に DATABASE_URL などを読むので先に .env を読む
+
 from database import *
 
 aoi = Person(name='たぐちあおい', age=14)
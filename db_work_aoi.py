@@ -1,5 +1,7 @@
 # あおい作業用
 
+from dotenv import load_dotenv
+load_dotenv()   # database.py は import 時に DATABASE_URL などを読むので先に .env を読む
 from database import *
 
 shironingen = Person(name='しろにんげん', age=32)
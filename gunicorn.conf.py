@@ -0,0 +1,30 @@
+# gunicorn の設定
+#
+#   gunicorn -c gunicorn.conf.py
+#
+# preload_app: マスターで1回だけ app を読み込み、ワーカーは fork するだけで起動する。
+#   database.py は import 時に接続も DDL もしないので、マスターが DB 接続を持ったまま fork することはない
+#   （持っていても database.reset_after_fork が子プロセスで手放す）。
+# MIGRATE_ON_START=1 ならマスターの起動時に1回だけ python migrate.py 相当を実行する。
+import glob
+import os
+
+wsgi_app = "app:create_app()"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5001")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+
+def on_starting(server):
+    # 前回起動時のワーカーのメトリクスを残さない（METRICS_DIR は metrics.py 参照）
+    metrics_dir = os.getenv("METRICS_DIR")
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+            os.remove(path)
+    if os.getenv("MIGRATE_ON_START") == "1":
+        import migrate
+
+        migrate.upgrade(log=server.log.info)
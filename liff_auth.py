@@ -0,0 +1,204 @@
+# LIFF の ID トークン検証
+#
+# - 検証結果はトークンの SHA-256 をキーに短時間キャッシュ（LIFF の再読み込みで毎回 LINE に問い合わせない）
+# - HS256（チャネルシークレットで署名）のトークンはローカルで署名・クレームを検証する
+#   それ以外（ES256 など）は LINE の verify API に問い合わせる（line_api の共有セッションを使う）
+# - LIFF_VERIFY_MODE=concurrent のときは専用スレッドプールで検証し、同じトークンの同時検証は1回にまとめ、
+#   呼び出し側は LIFF_VERIFY_BUDGET_MS だけ待つ（超えたら VerifyTimeout）
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import line_api
+
+ISSUER = "https://access.line.me"
+CACHE_TTL_SEC = int(os.getenv("LIFF_VERIFY_CACHE_TTL_SEC", "300"))
+CACHE_MAX_ENTRIES = 10000
+VERIFY_MODE = os.getenv("LIFF_VERIFY_MODE", "sync")   # sync | concurrent
+VERIFY_BUDGET_SEC = int(os.getenv("LIFF_VERIFY_BUDGET_MS", "3000")) / 1000.0
+VERIFY_WORKERS = int(os.getenv("LIFF_VERIFY_WORKERS", "16"))
+REMOTE_TIMEOUT_SEC = 5
+CLOCK_SKEW_SEC = 60
+
+
+class VerifyError(Exception):
+    def __init__(self, detail):
+        super().__init__(detail)
+        self.detail = detail
+
+
+class VerifyTimeout(VerifyError):
+    pass
+
+
+_lock = threading.Lock()
+_cache = {}       # token hash -> (expires_at, payload)
+_inflight = {}    # token hash -> Future
+_executor = {"pid": None, "pool": None}
+
+
+def _token_key(id_token):
+    return hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+
+
+def _cached(key):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del _cache[key]
+            return None
+        return entry[1]
+
+
+def _remember(key, payload):
+    # トークン自体の期限を超えてはキャッシュしない
+    expires_at = min(time.time() + CACHE_TTL_SEC, payload.get("exp") or float("inf"))
+    with _lock:
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            now = time.time()
+            for k in [k for k, (exp, _) in _cache.items() if exp <= now]:
+                del _cache[k]
+            if len(_cache) >= CACHE_MAX_ENTRIES:
+                _cache.pop(next(iter(_cache)))
+        _cache[key] = (expires_at, payload)
+
+
+def _b64decode(part):
+    return base64.urlsafe_b64decode(part + "=" * (-len(part) % 4))
+
+
+def _split(id_token):
+    try:
+        header_b64, payload_b64, signature_b64 = id_token.split(".")
+        header = json.loads(_b64decode(header_b64))
+        payload = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except ValueError:
+        raise VerifyError("malformed id_token")
+    # JSON として読めても object でなければ（"[]" や "1" など）不正なトークン
+    if not isinstance(header, dict) or not isinstance(payload, dict):
+        raise VerifyError("malformed id_token")
+    return header, payload, signature, f"{header_b64}.{payload_b64}".encode("ascii")
+
+
+def _check_claims(payload, channel_id, nonce=None):
+    now = time.time()
+    if payload.get("iss") != ISSUER:
+        raise VerifyError("invalid iss")
+    if channel_id and payload.get("aud") != channel_id:
+        raise VerifyError("invalid aud")
+    if not isinstance(payload.get("exp"), (int, float)) or payload["exp"] + CLOCK_SKEW_SEC < now:
+        raise VerifyError("IdToken expired")
+    if nonce is not None and payload.get("nonce") != nonce:
+        raise VerifyError("invalid nonce")
+    if not payload.get("sub"):
+        raise VerifyError("no sub")
+
+
+def verify_local(id_token, channel_id, channel_secret, nonce=None):
+    """
+    HS256 のトークンをローカルで検証して payload を返す。
+    ローカルで検証できない形式なら None（呼び出し側で verify API に回す）。
+    """
+    if not channel_secret or id_token.count(".") != 2:
+        return None
+    header, payload, signature, signing_input = _split(id_token)
+    if header.get("alg") != "HS256":
+        return None
+    expected = hmac.new(channel_secret.encode("utf-8"), signing_input, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature):
+        raise VerifyError("invalid signature")
+    _check_claims(payload, channel_id, nonce)
+    return payload
+
+
+def verify_remote(id_token, channel_id, nonce=None, timeout=REMOTE_TIMEOUT_SEC):
+    data = {"id_token": id_token, "client_id": channel_id}
+    if nonce is not None:
+        data["nonce"] = nonce
+    try:
+        resp = line_api.http_session().post(
+            line_api.url(line_api.VERIFY_PATH), data=data, timeout=timeout
+        )
+    except Exception as e:
+        raise VerifyError(f"verify request failed: {e}")
+    if resp.status_code >= 500:
+        raise VerifyError(f"verify request failed: HTTP {resp.status_code}")
+    if resp.status_code != 200:
+        raise VerifyError(resp.text[:200])
+    # 200 でも本文が JSON の object でなければ（プロキシのエラーページなど）検証できなかった扱い
+    try:
+        payload = resp.json()
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        raise VerifyError("verify request failed: invalid response")
+    return payload
+
+
+def _verify(key, id_token, channel_id, channel_secret, nonce):
+    payload = verify_local(id_token, channel_id, channel_secret, nonce)
+    if payload is None:
+        payload = verify_remote(id_token, channel_id, nonce)
+    _remember(key, payload)
+    return payload
+
+
+def _pool():
+    if _executor["pid"] != os.getpid():
+        with _lock:
+            if _executor["pid"] != os.getpid():
+                _executor.update(
+                    pid=os.getpid(),
+                    pool=ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix="liff-verify"),
+                )
+    return _executor["pool"]
+
+
+def verify_async(id_token, channel_id, channel_secret=None, nonce=None):
+    """検証を専用プールに投げて Future を返す。同じトークンの検証中ならその Future を共有する"""
+    key = _token_key(id_token)
+    pool = _pool()
+    with _lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        future = pool.submit(_verify, key, id_token, channel_id, channel_secret, nonce)
+        _inflight[key] = future
+
+    def done(_):
+        with _lock:
+            if _inflight.get(key) is future:
+                del _inflight[key]
+
+    future.add_done_callback(done)
+    return future
+
+
+def verify_id_token(id_token, channel_id, channel_secret=None, nonce=None, mode=None, budget=None):
+    """
+    ID トークンを検証して payload（sub, name, picture など）を返す。
+    不正なら VerifyError、concurrent モードで時間切れなら VerifyTimeout。
+    """
+    key = _token_key(id_token)
+    payload = _cached(key)
+    if payload is not None:
+        _check_claims(payload, channel_id, nonce)
+        return payload
+
+    if (mode or VERIFY_MODE) != "concurrent":
+        return _verify(key, id_token, channel_id, channel_secret, nonce)
+
+    future = verify_async(id_token, channel_id, channel_secret, nonce)
+    try:
+        return future.result(timeout=VERIFY_BUDGET_SEC if budget is None else budget)
+    except FutureTimeout:
+        # 検証自体は続けるので、完了すれば再送時にキャッシュから返る
+        raise VerifyTimeout("verify timed out")
@@ -0,0 +1,39 @@
+# LINE API 用の共有 HTTP セッション
+#
+# 呼び出しごとに requests.post すると毎回 TCP/TLS 接続からやり直しになるので、
+# プロセスごとに1つの Session（keep-alive の接続プール付き）を使い回す。
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+API_BASE = os.getenv("LINE_API_BASE", "https://api.line.me")
+POOL_SIZE = int(os.getenv("LINE_HTTP_POOL_SIZE", "32"))
+
+MULTICAST_PATH = "/v2/bot/message/multicast"
+VERIFY_PATH = "/oauth2/v2.1/verify"
+
+_lock = threading.Lock()
+_state = {"pid": None, "session": None}
+
+
+def http_session():
+    """このプロセス用の Session（fork 後の子プロセスでは作り直す）"""
+    if _state["pid"] == os.getpid():
+        return _state["session"]
+    with _lock:
+        if _state["pid"] != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.hooks["response"].append(metrics.observe_line_api)  # 呼び出しごとのレイテンシを記録
+            _state.update(pid=os.getpid(), session=session)
+        return _state["session"]
+
+
+def url(path, base=None):
+    return (base or API_BASE).rstrip("/") + path
@@ -0,0 +1,385 @@
+# LINE プッシュ配信ワーカー
+#
+# delivered_at が NULL の Notification を取り出し、同じ文面・同じチャネルの宛先を
+# まとめて multicast（1リクエスト最大500人）で送る。送信できた分だけ delivered_at を記録する。
+# - 全体向け（user が NULL）は salon が NULL ならリンク済み全員、salon があればそのサロンを予約したことの
+#   あるユーザに送る（受信箱の宛先と同じ。blueprints/info/inbox.py）
+# - 送れたチャンクの宛先はお知らせごとに NotificationPush に残し、再送ではその宛先を除く（送れた人には二度送らない）
+# - 429 / 5xx / 通信エラーで送れなかったお知らせは push_next_at まで待って再送する（回数ごとに間隔を倍に）。
+#   PUSH_MAX_ATTEMPTS 回で諦める
+# - チャネルのトークンが無い・4xx で断られた・再試行の上限に達したお知らせは、push_error に理由を残して
+#   delivered_at も記録する（送信待ちから外す。受信箱には出る）
+#
+#   python line_push.py            # 常駐（送信待ちが無ければ --interval 秒待つ）
+#   python line_push.py --once     # 送信待ちが無くなるまで送って終了
+import argparse
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+load_dotenv()   # database.py は import 時に DATABASE_URL などを読むので先に .env を読む
+from database import db, Notification, NotificationPush, UserChannelLink, LineChannel, Reservation
+from blueprints.info.inbox import bump, delivered_deltas
+import line_api
+
+MULTICAST_MAX_TO = 500
+DEFAULT_BATCH = 2000
+DEFAULT_RATE_PER_SEC = float(os.getenv("LINE_PUSH_RATE_PER_SEC", "100"))  # チャネルごとのリクエスト数/秒
+DEFAULT_CONCURRENCY = 8
+MAX_RETRIES = 5
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_MAX_SEC = 30.0
+RETRY_KEY_NS = uuid.UUID("6f1c8d1e-3a57-4d4b-9a3e-2f0d5c1b7a10")
+PUSH_MAX_ATTEMPTS = int(os.getenv("LINE_PUSH_MAX_ATTEMPTS", "8"))
+PUSH_RETRY_BASE_SEC = 60
+PUSH_RETRY_MAX_SEC = 3600
+
+# multicast() の結果
+SENT = "sent"
+RETRY = "retry"          # 429 / 5xx / 通信エラー（あとで再送する）
+REJECTED = "rejected"    # トークン無し・4xx（再送しても届かない）
+
+
+class TokenBucket:
+    """チャネル単位のレート制限（rate 件/秒、最大 burst 件まで溜められる）"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class LinePusher:
+    """multicast 送信（接続プール共有・チャネル別レート制限・指数バックオフ付き再試行）"""
+
+    def __init__(self, base_url=None, rate_per_sec=DEFAULT_RATE_PER_SEC, max_retries=MAX_RETRIES,
+                 session=None):
+        self.base_url = base_url
+        self.rate_per_sec = rate_per_sec
+        self.max_retries = max_retries
+        self.session = session or line_api.http_session()
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+
+    def _bucket(self, channel_id):
+        with self._lock:
+            bucket = self._buckets.get(channel_id)
+            if bucket is None:
+                bucket = self._buckets[channel_id] = TokenBucket(self.rate_per_sec)
+            return bucket
+
+    def multicast(self, channel_id, access_token, to, messages, retry_key):
+        """
+        送信できたら SENT。429 / 5xx / 通信エラーは指数バックオフで再試行し、それでも駄目なら RETRY。
+        それ以外の 4xx（宛先不正など）は再試行せず REJECTED。
+        X-Line-Retry-Key を付けるので、再試行で二重に届くことはない。
+        """
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "X-Line-Retry-Key": retry_key,
+        }
+        body = {"to": to, "messages": messages}
+        for attempt in range(self.max_retries + 1):
+            self._bucket(channel_id).acquire()
+            retry_after = None
+            try:
+                resp = self.session.post(
+                    line_api.url(line_api.MULTICAST_PATH, self.base_url),
+                    json=body, headers=headers, timeout=10,
+                )
+                with self._lock:
+                    self.requests += 1
+                # 409 は同じ Retry-Key で送信済み（= 前回の送信が届いている）
+                if resp.status_code in (200, 409):
+                    return SENT
+                if resp.status_code != 429 and resp.status_code < 500:
+                    return REJECTED
+                retry_after = resp.headers.get("Retry-After")
+            except Exception:
+                pass
+            if attempt == self.max_retries:
+                return RETRY
+            with self._lock:
+                self.retries += 1
+            delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * (2 ** attempt))
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            time.sleep(delay * (0.5 + random.random() / 2))
+        return RETRY
+
+
+def _message_text(title, body):
+    return f"{title}\n\n{body}" if body else title
+
+
+def _channels():
+    return {
+        cid: token for cid, token in
+        LineChannel.select(LineChannel.id, LineChannel.channel_access_token).tuples()
+    }
+
+
+def _recipients(user_ids, broadcast_salons):
+    """
+    宛先の (channel, channel_user_id) を引く。
+    個人宛ては該当ユーザのリンクのみ。全体向けは broadcast_salons（お知らせの salon の集合）ごとに、
+    None ならリンク済み全員、サロンならそのサロンを予約したことのあるユーザのリンク（受信箱と同じ宛先）。
+    """
+    personal = {}
+    if user_ids:
+        for user_id, channel_id, channel_user_id in (
+            UserChannelLink
+            .select(UserChannelLink.user, UserChannelLink.channel, UserChannelLink.channel_user_id)
+            .where(UserChannelLink.user.in_(list(user_ids)))
+            .tuples()
+        ):
+            personal.setdefault(user_id, []).append((channel_id, channel_user_id))
+    audiences = {}
+    for salon_id in broadcast_salons:
+        query = UserChannelLink.select(UserChannelLink.channel, UserChannelLink.channel_user_id)
+        if salon_id is not None:
+            customers = Reservation.select(Reservation.user).where(Reservation.salon == salon_id)
+            query = query.where(UserChannelLink.user.in_(customers))
+        audiences[salon_id] = list(
+            query.order_by(UserChannelLink.channel, UserChannelLink.channel_user_id).tuples()
+        )
+    return personal, audiences
+
+
+def _pushed(ids):
+    """{(notification_id, channel_id): {channel_user_id, ...}} 送信済みの宛先"""
+    sent = {}
+    for notification_id, channel_id, recipients in (
+        NotificationPush
+        .select(NotificationPush.notification, NotificationPush.channel, NotificationPush.recipients)
+        .where(NotificationPush.notification.in_(list(ids)))
+        .tuples()
+    ):
+        sent.setdefault((notification_id, channel_id), set()).update(recipients.split(","))
+    return sent
+
+
+def plan(notifications, pushed=None):
+    """
+    送信待ちのお知らせを multicast の単位にまとめる。
+    戻り値: [(channel_id, text, [channel_user_id, ...], {お知らせの id: [その id を送る宛先, ...]}), ...]
+    同じ文面のお知らせは宛先をまとめて1回で送るが、同じ宛先に同じ文面のお知らせが複数あるときは
+    2件目以降を別の multicast に回す（1回の送信で届くのは1通なので、まとめると1件分しか届かない）。
+    pushed（_pushed() の戻り値）にある宛先は送信済みとして除く。
+    チャンクは宛先の並び順で MULTICAST_MAX_TO 人ずつに切るので、一部のチャンクだけ失敗したあとの
+    再送でも同じ宛先が同じチャンクになり、同じ X-Line-Retry-Key になる。
+    """
+    pushed = pushed or {}
+    user_ids = {n["user"] for n in notifications if n["user"] is not None}
+    broadcast_salons = {n.get("salon") for n in notifications if n["user"] is None}
+    personal, audiences = _recipients(user_ids, broadcast_salons)
+
+    owed = {}   # (channel_id, text) → {channel_user_id: [お知らせの id, ...]}
+    for n in sorted(notifications, key=lambda n: n["id"]):
+        text = _message_text(n["title"], n["body"])
+        targets = audiences[n.get("salon")] if n["user"] is None else personal.get(n["user"], [])
+        for channel_id, channel_user_id in targets:
+            if channel_user_id in pushed.get((n["id"], channel_id), ()):
+                continue
+            owed.setdefault((channel_id, text), {}).setdefault(channel_user_id, []).append(n["id"])
+
+    batches = []
+    for (channel_id, text), by_recipient in sorted(owed.items(), key=lambda kv: kv[0]):
+        # k 回目の送信には、各宛先の k 件目のお知らせを載せる
+        rounds = max(len(ids) for ids in by_recipient.values())
+        for k in range(rounds):
+            to = sorted(r for r, ids in by_recipient.items() if len(ids) > k)
+            for i in range(0, len(to), MULTICAST_MAX_TO):
+                chunk = to[i:i + MULTICAST_MAX_TO]
+                sends = {}
+                for r in chunk:
+                    sends.setdefault(by_recipient[r][k], []).append(r)
+                batches.append((channel_id, text, chunk, sends))
+    return batches
+
+
+def retry_key(channel_id, to, ids):
+    """同じチャネル・同じ宛先・同じお知らせなら同じキー → 再実行しても LINE 側で重複排除される"""
+    return str(uuid.uuid5(RETRY_KEY_NS, f"{channel_id}|{','.join(map(str, sorted(ids)))}|{','.join(to)}"))
+
+
+def record_push(channel_id, sends):
+    """送れたチャンクのお知らせごとの宛先を記録する（次の再送でこの宛先を除く）"""
+    now = datetime.utcnow()
+    NotificationPush.insert_many([
+        {"notification": notification_id, "channel": channel_id, "recipients": ",".join(to),
+         "created_at": now, "updated_at": now}
+        for notification_id, to in sorted(sends.items())
+    ]).execute()
+
+
+def mark_delivered(ids, errors=None):
+    """
+    delivered_at を記録する。すでに記録済みの行は触らないので何度呼んでもよい。
+    errors（{id: 理由}）の行は送れなかった理由を push_error に残す。
+    実際に配信済みになった行の分だけ受信箱の未読数を増やし、送信済みの宛先の記録を消す。
+    """
+    ids = sorted(ids)
+    if not ids:
+        return 0
+    errors = errors or {}
+    now = datetime.utcnow()
+    with db.atomic():
+        rows = list(
+            Notification
+            .select(Notification.id, Notification.user, Notification.salon, Notification.is_read)
+            .where(Notification.id.in_(ids) & Notification.delivered_at.is_null())
+            .tuples()
+        )
+        if not rows:
+            return 0
+        done = [r[0] for r in rows]
+        (Notification
+         .update(delivered_at=now, updated_at=now, push_next_at=None)
+         .where(Notification.id.in_(done) & Notification.delivered_at.is_null())
+         .execute())
+        by_error = {}
+        for notification_id in done:
+            if notification_id in errors:
+                by_error.setdefault(errors[notification_id][:255], []).append(notification_id)
+        for error, error_ids in by_error.items():
+            Notification.update(push_error=error).where(Notification.id.in_(error_ids)).execute()
+        NotificationPush.delete().where(NotificationPush.notification.in_(done)).execute()
+        bump(delivered_deltas([row[1:] for row in rows]))
+    return len(rows)
+
+
+def _retry_delay(attempts):
+    return min(PUSH_RETRY_MAX_SEC, PUSH_RETRY_BASE_SEC * (2 ** (attempts - 1)))
+
+
+def reschedule(ids):
+    """
+    一時的に送れなかったお知らせの失敗回数を増やし、次の試行時刻を先に延ばす。
+    PUSH_MAX_ATTEMPTS 回目の失敗なら諦めて配信済みにする。戻り値: 諦めた id
+    """
+    now = datetime.utcnow()
+    given_up = set()
+    with db.atomic():
+        for notification_id, attempts in (
+            Notification
+            .select(Notification.id, Notification.push_attempts)
+            .where(Notification.id.in_(sorted(ids)))
+            .tuples()
+        ):
+            attempts = (attempts or 0) + 1
+            if attempts >= PUSH_MAX_ATTEMPTS:
+                given_up.add(notification_id)
+            (Notification
+             .update(push_attempts=attempts, push_next_at=now + timedelta(seconds=_retry_delay(attempts)),
+                     updated_at=now)
+             .where(Notification.id == notification_id)
+             .execute())
+    return given_up
+
+
+def drain_once(pusher, batch_size=DEFAULT_BATCH, concurrency=DEFAULT_CONCURRENCY):
+    """送信待ちを1バッチ分送る。戻り値: (対象お知らせ数, 配信済みにした数, 送信メッセージ数)"""
+    now = datetime.utcnow()
+    notifications = list(
+        Notification
+        .select(Notification.id, Notification.user, Notification.salon, Notification.title, Notification.body)
+        .where(
+            Notification.delivered_at.is_null()
+            & (Notification.push_next_at.is_null() | (Notification.push_next_at <= now))
+        )
+        .order_by(Notification.id)
+        .limit(batch_size)
+        .dicts()
+    )
+    if not notifications:
+        return 0, 0, 0
+
+    tokens = _channels()
+    batches = plan(notifications, _pushed(n["id"] for n in notifications))
+    retry, errors = set(), {}
+    sent = 0
+
+    def send(batch):
+        channel_id, text, to, sends = batch
+        token = tokens.get(channel_id)
+        if token is None:
+            return REJECTED, batch
+        result = pusher.multicast(
+            channel_id, token, to, [{"type": "text", "text": text[:5000]}], retry_key(channel_id, to, sends)
+        )
+        return result, batch
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for result, (channel_id, _, to, sends) in executor.map(send, batches):
+            if result == SENT:
+                sent += len(to)
+                record_push(channel_id, sends)
+            elif result == RETRY:
+                retry |= set(sends)
+            else:
+                reason = "no access token" if tokens.get(channel_id) is None else "rejected by LINE"
+                for notification_id in sends:
+                    errors.setdefault(notification_id, f"channel {channel_id}: {reason}")
+
+    # 一時的な失敗は後で再送（送れたチャンクの宛先は NotificationPush で除かれる）。上限に達したら諦める
+    for notification_id in reschedule(retry):
+        errors.setdefault(notification_id, f"gave up after {PUSH_MAX_ATTEMPTS} attempts")
+    # 宛先の無いお知らせ・断られたお知らせも配信済み扱いにして、次回以降取り出さないようにする
+    finished = {n["id"] for n in notifications} - (retry - set(errors))
+    delivered = mark_delivered(finished, errors)
+    return len(notifications), delivered, sent
+
+
+def run(pusher, once=False, interval=5.0, batch_size=DEFAULT_BATCH, concurrency=DEFAULT_CONCURRENCY):
+    total_sent = 0
+    while True:
+        with db.connection_context():
+            found, delivered, sent = drain_once(pusher, batch_size, concurrency)
+        total_sent += sent
+        # 送信待ちが無い、またはすべて失敗した（LINE 側の障害など。失敗分は push_next_at まで取り出されない）
+        # ときは待ってからやり直す
+        if not found or delivered == 0:
+            if once:
+                return total_sent
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--once", action="store_true")
+    parser.add_argument("--interval", type=float, default=5.0)
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE_PER_SEC, help="チャネルごとのリクエスト数/秒")
+    args = parser.parse_args()
+
+    pusher = LinePusher(rate_per_sec=args.rate)
+    sent = run(pusher, once=args.once, interval=args.interval,
+               batch_size=args.batch, concurrency=args.concurrency)
+    print(f"sent messages: {sent}")
+
+
+if __name__ == "__main__":
+    main()
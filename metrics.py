@@ -0,0 +1,261 @@
+# リクエスト単位のメトリクス（Prometheus テキスト形式で /metrics に出す）
+#
+#   http_requests_total{blueprint,endpoint,method,status}           … 件数
+#   http_request_duration_seconds{blueprint,endpoint}               … レイテンシのヒストグラム
+#   http_requests_in_flight{blueprint,endpoint}                     … 処理中の件数
+#   template_render_seconds{template}                               … テンプレートの描画時間
+#   line_api_request_duration_seconds{path,status}                  … LINE API 呼び出し（line_api のセッションのフック）
+#
+# 値はプロセス内のレジストリに溜める。gunicorn の複数ワーカーで動かすときは METRICS_DIR を指定すると、
+# 各ワーカーが METRICS_DIR/<pid>.json に METRICS_FLUSH_SEC ごとに書き出し、/metrics はディレクトリ内の
+# 全ファイルを合算して返す（件数・ヒストグラムは終了したワーカーの分も残し、処理中の件数は生きている
+# ワーカーの分だけ足す）。METRICS_DIR が無ければ、/metrics は応答したワーカー自身の値だけを返す。
+import atexit
+import json
+import os
+import threading
+import time
+
+from flask import Response, g, request, before_render_template, template_rendered
+
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+FLUSH_SEC = float(os.getenv("METRICS_FLUSH_SEC", "1"))
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "http_requests_total": ("counter", "HTTP requests by endpoint and status code"),
+    "http_request_duration_seconds": ("histogram", "HTTP request latency"),
+    "http_requests_in_flight": ("gauge", "HTTP requests currently being served"),
+    "template_render_seconds": ("histogram", "Jinja template render time"),
+    "line_api_request_duration_seconds": ("histogram", "Outbound LINE API call latency"),
+}
+
+
+class Registry:
+    """name → {labels(タプル) → 値}。ヒストグラムの値は [バケットごとの件数..., 合計, 件数]"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.dirty = False
+
+    def inc(self, name, labels, value=1):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+            self.dirty = True
+
+    def add_gauge(self, name, labels, value):
+        with self.lock:
+            series = self.gauges.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+            self.dirty = True
+
+    def observe(self, name, labels, seconds):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            values = series.get(labels)
+            if values is None:
+                values = series[labels] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    values[i] += 1
+                    break
+            values[-2] += seconds
+            values[-1] += 1
+            self.dirty = True
+
+    def dump(self):
+        with self.lock:
+            return {
+                kind: {name: [[list(labels), value] for labels, value in series.items()]
+                       for name, series in getattr(self, kind).items()}
+                for kind in ("counters", "gauges", "histograms")
+            }
+
+
+registry = Registry()
+_flusher = {"pid": None}
+
+
+# ---- ワーカー間の集約（ファイル）----
+def _path(pid):
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def flush():
+    """このプロセスの値を METRICS_DIR/<pid>.json に書き出す（一時ファイル経由で置き換え）"""
+    if not METRICS_DIR:
+        return
+    registry.dirty = False
+    data = dict(registry.dump(), pid=os.getpid())
+    tmp = _path(os.getpid()) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, _path(os.getpid()))
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_SEC)
+        if registry.dirty:
+            try:
+                flush()
+            except OSError:
+                pass
+
+
+def _ensure_flusher():
+    """ワーカーごと（fork 後は子プロセスで）に書き出しスレッドを1本起動する"""
+    if not METRICS_DIR or _flusher["pid"] == os.getpid():
+        return
+    with registry.lock:
+        if _flusher["pid"] == os.getpid():
+            return
+        _flusher["pid"] = os.getpid()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+    atexit.register(flush)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect():
+    """全ワーカーの値を合算した {kind: {name: {labels: value}}}"""
+    snapshots = [registry.dump()]   # 自分の分はファイルではなくメモリ上の最新値を使う
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.endswith(".json") or filename == f"{os.getpid()}.json":
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not _alive(data.get("pid", 0)):
+                data["gauges"] = {}   # 終了したワーカーの処理中件数は数えない
+            snapshots.append(data)
+
+    merged = {"counters": {}, "gauges": {}, "histograms": {}}
+    for data in snapshots:
+        for kind, names in merged.items():
+            for name, series in data.get(kind, {}).items():
+                target = names.setdefault(name, {})
+                for labels, value in series:
+                    key = tuple(tuple(pair) for pair in labels)
+                    if kind == "histograms":
+                        acc = target.setdefault(key, [0] * len(value))
+                        target[key] = [a + b for a, b in zip(acc, value)]
+                    else:
+                        target[key] = target.get(key, 0) + value
+    return merged
+
+
+# ---- Prometheus テキスト形式 ----
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render(merged):
+    lines = []
+    for name in sorted(set().union(*(merged[kind].keys() for kind in merged))):
+        kind, help_text = HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "histogram":
+            for labels, values in sorted(merged["histograms"].get(name, {}).items()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS, values):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_labels(labels, [('le', repr(bound))])} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {values[-1]}")
+                lines.append(f"{name}_sum{_labels(labels)} {values[-2]:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {values[-1]}")
+        else:
+            series = merged["counters" if kind == "counter" else "gauges"].get(name, {})
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ---- 計測点 ----
+def observe_line_api(response, *args, **kwargs):
+    """requests のレスポンスフック（line_api.http_session に登録する）"""
+    _ensure_flusher()
+    labels = (("path", response.request.path_url.split("?")[0]), ("status", str(response.status_code)))
+    registry.observe("line_api_request_duration_seconds", labels, response.elapsed.total_seconds())
+    return response
+
+
+def _request_labels():
+    return (("blueprint", request.blueprint or "app"), ("endpoint", request.endpoint or "unmatched"))
+
+
+def init_app(app):
+    """リクエスト・テンプレートの計測と /metrics を登録する"""
+    local = threading.local()
+
+    @app.before_request
+    def _metrics_start():
+        if request.endpoint == "metrics":
+            return
+        _ensure_flusher()
+        g.metrics_started = time.perf_counter()
+        g.metrics_labels = _request_labels()
+        registry.add_gauge("http_requests_in_flight", g.metrics_labels, 1)
+
+    @app.after_request
+    def _metrics_record(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            labels = g.metrics_labels
+            registry.observe("http_request_duration_seconds", labels, time.perf_counter() - started)
+            registry.inc("http_requests_total", labels + (("method", request.method),
+                                                           ("status", str(response.status_code))))
+        return response
+
+    @app.teardown_request
+    def _metrics_done(exc):
+        labels = g.pop("metrics_labels", None)
+        if labels is None:
+            return
+        if g.pop("metrics_started", None) is not None:
+            # after_request まで届かなかった（例外で中断した）リクエスト
+            registry.inc("http_requests_total", labels + (("method", request.method), ("status", "500")))
+        registry.add_gauge("http_requests_in_flight", labels, -1)
+
+    def _template_start(sender, template, context, **extra):
+        stack = getattr(local, "templates", None)
+        if stack is None:
+            stack = local.templates = []
+        stack.append(time.perf_counter())
+
+    def _template_done(sender, template, context, **extra):
+        stack = getattr(local, "templates", None)
+        if stack:
+            registry.observe("template_render_seconds", (("template", template.name or "-"),),
+                             time.perf_counter() - stack.pop())
+
+    before_render_template.connect(_template_start, app, weak=False)
+    template_rendered.connect(_template_done, app, weak=False)
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render(collect()), mimetype="text/plain; version=0.0.4")
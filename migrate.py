@@ -0,0 +1,277 @@
+# スキーマのマイグレーション
+#
+# database.py は import 時に DDL を実行しない。テーブルの作成・変更はこのコマンドで明示的に行う
+# （デプロイ時に1回。gunicorn.conf.py の MIGRATE_ON_START=1 ならマスタープロセスが起動時に1回だけ実行する）。
+#
+#   python migrate.py            # 最新まで適用
+#   python migrate.py --status   # 現在のバージョンと未適用のマイグレーション
+#   python migrate.py --to 3     # 指定バージョンまで
+#
+# - 空のDBには今のモデル定義でテーブルを作り、最新バージョンとして記録する（個々のマイグレーションは流さない）
+# - SchemaVersion が無いのにテーブルがあるDB（import 時にテーブルを作っていた頃のもの）は、
+#   足りないテーブル・索引を作ってバージョン1（初期スキーマ）として記録してから残りを適用する。
+#   読み取りモデル・集計（SalonCard・検索インデックス・口コミ集計・日別集計・未読数）は
+#   バージョン4で元テーブルから作り直す
+# - 新しいマイグレーションは MIGRATIONS の末尾に (番号, 名前, 関数) で足す。1件ずつ別トランザクション
+import argparse
+from datetime import datetime
+
+from peewee import fn
+from playhouse.migrate import SchemaMigrator, migrate
+
+from dotenv import load_dotenv
+load_dotenv()   # database.py は import 時に DATABASE_URL などを読むので先に .env を読む
+from database import (
+    db, create_tables, Salon, SchemaVersion, ReservationChangeLog, Address, SalonCard, Notification,
+    NotificationRead, NotificationPush, UserChannelLink,
+)
+
+IMPORT_CHUNK = 5000
+
+
+def _initial_schema():
+    """足りないテーブル・索引を作り、古いDBの列の定義を今のモデルに合わせる"""
+    create_tables()
+    migrator = SchemaMigrator.from_database(db)
+    table = Notification._meta.table_name
+    # 送信待ちを delivered_at = NULL で表すようになった（以前は NOT NULL）
+    if not _column(table, "delivered_at").null:
+        migrate(migrator.drop_not_null(table, "delivered_at"))
+
+
+def _column(table, name):
+    return next((c for c in db.get_columns(table) if c.name == name), None)
+
+
+def _add_columns(model, names):
+    """model のテーブルに無い列だけを足す（create_tables() が今の定義で作ったテーブルには足さない）"""
+    migrator = SchemaMigrator.from_database(db)
+    table = model._meta.table_name
+    missing = [name for name in names if _column(table, name) is None]
+    migrate(*[migrator.add_column(table, name, model._meta.fields[name]) for name in missing])
+
+
+def _journal_from_changelog():
+    """ReservationChangeLog の行を予約イベントジャーナルへ写す（変更前後の値は無いので action と detail だけ）"""
+    from blueprints.reservation.journal import event, import_events
+
+    last_id = 0
+    while True:
+        rows = list(
+            ReservationChangeLog
+            .select(ReservationChangeLog.id, ReservationChangeLog.reservation, ReservationChangeLog.actor,
+                    ReservationChangeLog.action, ReservationChangeLog.detail, ReservationChangeLog.created_at)
+            .where(ReservationChangeLog.id > last_id)
+            .order_by(ReservationChangeLog.id)
+            .limit(IMPORT_CHUNK)
+            .tuples()
+        )
+        if not rows:
+            return
+        import_events([
+            (reservation_id, event(action, actor=actor_id, at=created_at, detail=detail))
+            for _, reservation_id, actor_id, action, detail, created_at in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def _salon_locations():
+    """Address / SalonCard に緯度経度を足し、郵便番号から埋めてカードを作り直す（近くのサロン検索）"""
+    from blueprints.home.nearby import geocode_addresses
+    from blueprints.home.salon_cards import rebuild_salon_cards
+
+    _add_columns(Address, ("latitude", "longitude", "geo_approximate"))
+    _add_columns(SalonCard, ("latitude", "longitude", "geo_cell", "geo_approximate"))
+    create_tables()   # (weekday, geo_cell) の索引は IF NOT EXISTS で作られる
+    _report_geocode(geocode_addresses())
+    rebuild_salon_cards()
+
+
+def _report_geocode(result):
+    updated, missing = result
+    print(f"  geocoded addresses: {updated}, not found (postal code / prefecture not in table): {missing}")
+
+
+def _rebuild_derived():
+    """読み取りモデル・集計を元テーブルから作り直す（それらが無かった頃のDBを上げたとき用。何度流してもよい）"""
+    from blueprints.home.salon_cards import rebuild_salon_cards
+    from blueprints.home.search import rebuild_search_index
+    from blueprints.home.ratings import rebuild_ratings
+    from blueprints.reservation.stats import rebuild_daily_stats
+    from blueprints.info.inbox import rebuild_inbox_counters
+
+    create_tables()
+    rebuild_salon_cards()
+    rebuild_search_index()
+    rebuild_ratings()
+    rebuild_daily_stats()
+    rebuild_inbox_counters()
+
+
+def _push_retry_state():
+    """LINE 送信の失敗回数・次の試行時刻・失敗理由と、送れた宛先範囲（NotificationPush）"""
+    _add_columns(Notification, ("push_attempts", "push_next_at", "push_error"))
+    create_tables()
+
+
+def _approximate_locations():
+    """
+    バージョン3で郵便番号の表から埋めた Address の緯度経度を「おおよその位置」と記録し、
+    当時の表で引けなかった住所を都道府県の表で埋め直してカードを作り直す
+    """
+    from blueprints.home.nearby import geocode_addresses, _postal_table
+    from blueprints.home.salon_cards import rebuild_salon_cards
+
+    _add_columns(Address, ("geo_approximate",))
+    _add_columns(SalonCard, ("geo_approximate",))
+    table = _postal_table()
+    approximate = []
+    for address_id, postal_code, latitude, longitude in (
+        Address
+        .select(Address.id, Address.postal_code, Address.latitude, Address.longitude)
+        .where(Address.latitude.is_null(False) & Address.postal_code.is_null(False))
+        .tuples()
+    ):
+        # バージョン3の geocode は7桁の行か上3桁の代表点を入れた。代表点と同じ値なら表から埋めたもの
+        digits = "".join(ch for ch in postal_code if ch.isdigit())
+        if digits not in table and (latitude, longitude) == table.get(digits[:3]):
+            approximate.append(address_id)
+    for i in range(0, len(approximate), 500):
+        Address.update(geo_approximate=True).where(Address.id.in_(approximate[i:i + 500])).execute()
+    _report_geocode(geocode_addresses())
+    rebuild_salon_cards()
+
+
+def _scoped_broadcast_counters():
+    """
+    以前の既読処理が作った、まだ配信していない全体向けお知らせの既読行を消し、
+    全体向けお知らせの総数・既読数のカウンタを宛先（全員 / サロンごと）別に作り直す
+    """
+    from blueprints.info.inbox import rebuild_inbox_counters
+
+    undelivered = (
+        Notification
+        .select(Notification.id)
+        .where(Notification.user.is_null() & Notification.delivered_at.is_null())
+    )
+    removed = NotificationRead.delete().where(NotificationRead.notification.in_(undelivered)).execute()
+    print(f"  removed reads of undelivered broadcasts: {removed}")
+    rebuild_inbox_counters()
+
+
+def _push_recipient_lists():
+    """
+    NotificationPush を宛先範囲（first_to〜last_to）から送った宛先の一覧に変える。
+    送信途中の行は、範囲に入る今のリンクを送った宛先として写す（変える前の再送と同じ扱い）
+    """
+    table = NotificationPush._meta.table_name
+    if _column(table, "recipients") is not None:
+        return
+    rows = db.execute_sql(f'SELECT "notification_id", "channel_id", "first_to", "last_to", "created_at" '
+                          f'FROM "{table}"').fetchall()
+    converted = []
+    for notification_id, channel_id, first_to, last_to, created_at in rows:
+        recipients = [
+            to for (to,) in
+            UserChannelLink
+            .select(UserChannelLink.channel_user_id)
+            .where((UserChannelLink.channel == channel_id)
+                   & UserChannelLink.channel_user_id.between(first_to, last_to))
+            .order_by(UserChannelLink.channel_user_id)
+            .tuples()
+        ] or [first_to, last_to]
+        converted.append({"notification": notification_id, "channel": channel_id,
+                          "recipients": ",".join(recipients), "created_at": created_at, "updated_at": created_at})
+    NotificationPush.drop_table()
+    NotificationPush.create_table()
+    for i in range(0, len(converted), 500):
+        NotificationPush.insert_many(converted[i:i + 500]).execute()
+    print(f"  converted in-flight push records: {len(converted)}")
+
+
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "reservation event journal", _journal_from_changelog),
+    (3, "salon locations", _salon_locations),
+    (4, "rebuild read models and aggregates", _rebuild_derived),
+    (5, "line push retry state", _push_retry_state),
+    (6, "reservation updated_at index", create_tables),
+    (7, "coupon wallet order index", create_tables),
+    (8, "approximate salon locations", _approximate_locations),
+    (9, "scoped broadcast counters", _scoped_broadcast_counters),
+    (10, "line push recipient lists", _push_recipient_lists),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version():
+    """適用済みの最大バージョン（SchemaVersion が無ければ None）"""
+    if not SchemaVersion.table_exists():
+        return None
+    return SchemaVersion.select(fn.MAX(SchemaVersion.version)).scalar() or 0
+
+
+def pending(version=None):
+    version = current_version() if version is None else version
+    return [(v, name) for v, name, _ in MIGRATIONS if v > (version or 0)]
+
+
+def _record(version, name):
+    now = datetime.utcnow()
+    (SchemaVersion
+     .insert(version=version, name=name, created_at=now, updated_at=now)
+     .on_conflict_ignore()
+     .execute())
+
+
+def stamp(version=LATEST):
+    """マイグレーションを流さずに version までを適用済みとして記録する（テーブルを今の定義で作った直後など）"""
+    db.create_tables([SchemaVersion])
+    for v, name, _ in MIGRATIONS:
+        if v <= version:
+            _record(v, name)
+
+
+def upgrade(target=None, log=print):
+    """target（省略時は最新）まで適用して、適用後のバージョンを返す"""
+    target = LATEST if target is None else target
+    with db.connection_context():
+        version = current_version()
+        if not version:
+            if not Salon.table_exists():
+                create_tables()
+                stamp(LATEST)
+                log(f"created schema at version {LATEST}")
+                return LATEST
+            with db.atomic():
+                _initial_schema()
+                stamp(1)
+            version = 1
+            log("existing schema recorded as version 1")
+        for v, name, migration in MIGRATIONS:
+            if version < v <= target:
+                with db.atomic():
+                    migration()
+                    _record(v, name)
+                log(f"applied {v}: {name}")
+        return current_version()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--status", action="store_true")
+    parser.add_argument("--to", type=int, default=None, help="適用するバージョン（省略時は最新）")
+    args = parser.parse_args()
+    if args.status:
+        with db.connection_context():
+            version = current_version()
+            print(f"current: {version if version is not None else '(none)'}  latest: {LATEST}")
+            for v, name in pending(version):
+                print(f"  pending {v}: {name}")
+        return
+    version = upgrade(args.to)
+    print(f"schema version: {version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# キーセットページング用のカーソル
+#
+# OFFSET は読み飛ばす行数だけ遅くなるので、一覧は「最後に表示した行の並び順キー」を
+# 不透明な文字列（URL セーフな base64）にして次ページの起点として受け渡す。
+import base64
+import json
+from datetime import date, datetime
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return str(value)  # peewee が SQLite に保存する文字列と同じ形式
+    raise TypeError(type(value))
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, default=_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+_SCALARS = (str, int, float, type(None))
+
+
+def decode_cursor(cursor, size=None):
+    """不正なカーソル（JSON の配列でない・要素数が違う・要素に object や配列がある）は None（先頭ページ扱い）"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or (size is not None and len(values) != size):
+        return None
+    if not all(isinstance(v, _SCALARS) for v in values):
+        return None   # そのまま SQL のパラメータにするので、バインドできない値は受け付けない
+    return values
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(value, MAX_PAGE_SIZE))
+
+
+def split_page(rows, limit, key):
+    """limit+1 件取得した結果を (ページ, 次カーソル) に分ける"""
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
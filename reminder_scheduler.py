@@ -0,0 +1,268 @@
+# 予約リマインダのスケジューラ
+#
+# 「明日のご予約」（24時間前）と「まもなくご予約」（2時間前）の Notification(type='reminder') を作る。
+#   - Reservation.start_at の索引を「ここまで読んだ」ハイウォーターマークから先読み幅の分だけ読み進め、
+#     リマインダ時刻をメモリ上のヒープに積む（毎回全件は読まない）
+#   - 作成・日時変更・キャンセルは Reservation.updated_at の索引を「ここまで読んだ」時刻から追いかけて反映
+#     （予約の行そのものを読む）
+#   - 送信済みは ReminderSent（予約・種類・開始日時で一意）に記録し、二重に作らない
+#   - 期限が来た分をまとめて insert_many（delivered_at は NULL → line_push.py が LINE に送る）
+#
+#   python reminder_scheduler.py            # 常駐
+#   python reminder_scheduler.py --once     # 1回分だけ処理して終了
+import argparse
+import heapq
+import time
+from datetime import datetime, timedelta
+
+from peewee import fn
+
+from dotenv import load_dotenv
+load_dotenv()   # database.py は import 時に DATABASE_URL などを読むので先に .env を読む
+from database import (
+    db, Reservation, Salon, Service, Notification,
+    ReminderSent, SchedulerState,
+)
+
+# (種類, 開始の何時間前, タイトル, 本文) 開始に近い方を後ろに並べる
+KINDS = (
+    ("day_before", timedelta(hours=24), "明日のご予約のお知らせ",
+     "{salon} / {service}\n{start_at:%m/%d %H:%M} からご予約をいただいています。"),
+    ("two_hours", timedelta(hours=2), "まもなくご予約の時間です",
+     "{salon} / {service}\n本日 {start_at:%H:%M} からです。お気をつけてお越しください。"),
+)
+ACTIVE_STATUSES = (0, 1)
+HORIZON = KINDS[0][1] + timedelta(hours=2)   # 先読み幅（いちばん早いリマインダより少し先まで）
+LATE_GRACE = timedelta(minutes=30)           # 停止などで遅れたリマインダを送ってよい猶予
+CHANGE_OVERLAP = timedelta(minutes=1)        # updated_at はコミット前の時刻なので、少し手前から読み直す
+DEFAULT_BATCH = 500
+DEFAULT_INTERVAL_SEC = 30.0
+
+STATE_WINDOW = "reminder:start_at_hwm"
+STATE_CHANGES = "reminder:updated_at_hwm"
+
+_TEMPLATES = {kind: (title, body) for kind, _, title, body in KINDS}
+LAST_KIND = KINDS[-1][0]
+
+
+def load_state(key):
+    row = SchedulerState.get_or_none(SchedulerState.key == key)
+    return row.value if row else None
+
+
+def save_state(key, value):
+    now = datetime.utcnow()
+    (SchedulerState
+     .insert(key=key, value=str(value), created_at=now, updated_at=now)
+     .on_conflict(conflict_target=[SchedulerState.key],
+                  update={SchedulerState.value: str(value), SchedulerState.updated_at: now})
+     .execute())
+
+
+class ReminderScheduler:
+    def __init__(self, horizon=HORIZON, batch=DEFAULT_BATCH):
+        self.horizon = horizon
+        self.batch = batch
+        self.heap = []         # (due_at, reservation_id, kind, start_at)
+        self.planned = {}      # reservation_id → 現在の start_at（ヒープ内の古い項目はこれと比べて捨てる。
+                               # ヒープに有効な項目が残っている予約だけ）
+        self.window_end = None
+        self.changes_seen = None   # ここまで読んだ Reservation.updated_at（UTC）
+
+    # ---- 計画 ----
+    def plan(self, reservation_id, start_at, now):
+        """
+        予約のリマインダをヒープに積む。
+        時刻を過ぎた種類は LATE_GRACE 以内なら即時、それより前（直前の予約で「明日」が過ぎている等）は送らない。
+        積むものが無ければ planned にも残さない（planned はヒープに項目がある予約だけを持つ）
+        """
+        self.planned.pop(reservation_id, None)
+        if start_at <= now:
+            return
+        for kind, offset, _, _ in KINDS:
+            due_at = start_at - offset
+            if due_at > now - LATE_GRACE:
+                heapq.heappush(self.heap, (max(due_at, now), reservation_id, kind, start_at))
+                self.planned[reservation_id] = start_at
+
+    def unplan(self, reservation_id):
+        self.planned.pop(reservation_id, None)
+
+    def _scan(self, lo, hi, now):
+        """start_at が (lo, hi] の有効な予約を start_at 順に読んで積む"""
+        after = (lo, 0)
+        while True:
+            rows = list(
+                Reservation
+                .select(Reservation.id, Reservation.start_at)
+                .where(
+                    (Reservation.start_at > lo) & (Reservation.start_at <= hi)
+                    & ((Reservation.start_at > after[0])
+                       | ((Reservation.start_at == after[0]) & (Reservation.id > after[1])))
+                    & Reservation.status.in_(ACTIVE_STATUSES)
+                )
+                .order_by(Reservation.start_at, Reservation.id)
+                .limit(self.batch)
+                .tuples()
+            )
+            for reservation_id, start_at in rows:
+                self.plan(reservation_id, start_at, now)
+            if len(rows) < self.batch:
+                return
+            after = (rows[-1][1], rows[-1][0])
+
+    def start(self, now):
+        """保存済みの進捗から再開する（ヒープはメモリ上なので、読み済みの範囲を1回だけ読み直す）"""
+        window_end = load_state(STATE_WINDOW)
+        changes_seen = load_state(STATE_CHANGES)
+        self.window_end = max(datetime.fromisoformat(window_end), now) if window_end else now
+        if changes_seen is None:
+            # 窓の中は下の _scan で今の状態を読むので、それより前の変更は追わなくてよい
+            changes_seen = (Reservation.select(fn.MAX(Reservation.updated_at)).scalar()
+                            or datetime.utcnow()).isoformat()
+            save_state(STATE_CHANGES, changes_seen)
+        self.changes_seen = datetime.fromisoformat(changes_seen)
+        self._scan(now, self.window_end, now)
+
+    def extend_window(self, now):
+        hi = now + self.horizon
+        if hi <= self.window_end:
+            return
+        self._scan(self.window_end, hi, now)
+        self.window_end = hi
+        save_state(STATE_WINDOW, hi.isoformat())
+
+    def apply_changes(self, now):
+        """updated_at が前回読んだ時刻（の CHANGE_OVERLAP 手前）より後の予約を、今の状態で積み直す"""
+        after = (self.changes_seen - CHANGE_OVERLAP, 0)
+        latest = self.changes_seen
+        while True:
+            rows = list(
+                Reservation
+                .select(Reservation.id, Reservation.start_at, Reservation.status, Reservation.updated_at)
+                .where((Reservation.updated_at > after[0])
+                       | ((Reservation.updated_at == after[0]) & (Reservation.id > after[1])))
+                .order_by(Reservation.updated_at, Reservation.id)
+                .limit(self.batch)
+                .tuples()
+            )
+            for rid, start_at, status, _ in rows:
+                # 先読み幅より先の予約は、窓を広げたときに _scan が拾う
+                if status in ACTIVE_STATUSES and now < start_at <= self.window_end:
+                    # 読み直しで同じ予約が何度来ても、開始日時が変わっていなければ積み直さない
+                    if self.planned.get(rid) != start_at:
+                        self.plan(rid, start_at, now)
+                else:
+                    self.unplan(rid)
+            if rows:
+                latest = max(latest, rows[-1][3])
+            if len(rows) < self.batch:
+                break
+            after = (rows[-1][3], rows[-1][0])
+        if latest != self.changes_seen:
+            self.changes_seen = latest
+            save_state(STATE_CHANGES, latest.isoformat())
+
+    # ---- 送信 ----
+    def _pop_due(self, now):
+        due = {}
+        while self.heap and self.heap[0][0] <= now and len(due) < self.batch:
+            _, rid, kind, start_at = heapq.heappop(self.heap)
+            if self.planned.get(rid) == start_at:
+                due[(rid, kind, start_at)] = True
+                if kind == LAST_KIND:
+                    # 最後の種類を取り出したらこの予約の項目はもう無い（常駐中に planned が増え続けないように）
+                    del self.planned[rid]
+        return list(due)
+
+    def fire_due(self, now):
+        """期限の来たリマインダを Notification にする。作成した件数を返す"""
+        created = 0
+        while True:
+            due = self._pop_due(now)
+            if not due:
+                return created
+            created += self._create(due, now)
+
+    def _create(self, due, now):
+        rids = list({rid for rid, _, _ in due})
+        with db.atomic():
+            # ヒープに積んだ後で変わっていないか、まとめて確かめる
+            current = {
+                row["id"]: row for row in
+                Reservation
+                .select(Reservation.id, Reservation.user, Reservation.salon, Reservation.start_at,
+                        Reservation.status, Salon.name.alias("salon_name"), Service.name.alias("service_name"))
+                .join(Salon, on=(Reservation.salon == Salon.id))
+                .switch(Reservation)
+                .join(Service, on=(Reservation.service == Service.id))
+                .where(Reservation.id.in_(rids))
+                .dicts()
+            }
+            sent = set(
+                ReminderSent
+                .select(ReminderSent.reservation, ReminderSent.kind, ReminderSent.start_at)
+                .where(ReminderSent.reservation.in_(rids))
+                .tuples()
+            )
+            reminders, notifications = [], []
+            for rid, kind, start_at in due:
+                row = current.get(rid)
+                if (row is None or row["status"] not in ACTIVE_STATUSES or row["start_at"] != start_at
+                        or start_at <= now or (rid, kind, start_at) in sent):
+                    continue
+                title, body = _TEMPLATES[kind]
+                reminders.append({
+                    "reservation": rid, "kind": kind, "start_at": start_at,
+                    "created_at": now, "updated_at": now,
+                })
+                notifications.append({
+                    "user": row["user"], "salon": row["salon"], "type": "reminder",
+                    "title": title,
+                    "body": body.format(salon=row["salon_name"], service=row["service_name"], start_at=start_at),
+                    "delivered_at": None, "created_at": now, "updated_at": now,
+                })
+            if reminders:
+                ReminderSent.insert_many(reminders).on_conflict_ignore().execute()
+                Notification.insert_many(notifications).execute()
+        return len(notifications)
+
+    def next_due(self):
+        return self.heap[0][0] if self.heap else None
+
+    def tick(self, now=None):
+        now = now or datetime.now()
+        self.apply_changes(now)
+        self.extend_window(now)
+        return self.fire_due(now)
+
+
+def run(once=False, interval=DEFAULT_INTERVAL_SEC, batch=DEFAULT_BATCH):
+    scheduler = ReminderScheduler(batch=batch)
+    with db.connection_context():
+        scheduler.start(datetime.now())
+    while True:
+        with db.connection_context():
+            created = scheduler.tick()
+        if created:
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} reminders: {created}")
+        if once:
+            return scheduler
+        wait = interval
+        next_due = scheduler.next_due()
+        if next_due is not None:
+            wait = min(wait, max(0.0, (next_due - datetime.now()).total_seconds()))
+        time.sleep(wait)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--once", action="store_true")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL_SEC)
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+    args = parser.parse_args()
+    run(once=args.once, interval=args.interval, batch=args.batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# 予約イベントジャーナルの保守（blueprints/reservation/journal.py 参照）
+#
+#   python reservation_journal.py --list                         # 月ごとの行数・イベント数・サイズ
+#   python reservation_journal.py --compact 202501               # 締まった月を予約ごとに1行へまとめる
+#   python reservation_journal.py --compact-before 202504        # 202504 より前の月をすべてまとめる
+#   python reservation_journal.py --replay 123                   # 予約 123 の履歴と最新の状態
+#   python reservation_journal.py --replay 123 --at 2025-01-01T10:00   # その時点（UTC）の状態
+import argparse
+from datetime import datetime
+
+from peewee import fn
+
+from dotenv import load_dotenv
+load_dotenv()   # database.py は import 時に DATABASE_URL などを読むので先に .env を読む
+from database import db, reservation_event_partition
+from blueprints.reservation.journal import partitions, compact, history, replay
+
+
+def _list():
+    print(f"{'month':<8} {'rows':>10} {'events':>10} {'bytes':>12}")
+    for month in partitions():
+        model = reservation_event_partition(month)
+        rows, events, size = model.select(
+            fn.COUNT(model.id), fn.SUM(model.events), fn.SUM(fn.LENGTH(model.payload))
+        ).tuples().get()
+        print(f"{month:<8} {rows:>10} {events or 0:>10} {size or 0:>12}")
+
+
+def _compact(months):
+    for month in months:
+        rows, packed, size, packed_size = compact(month)
+        print(f"{month}: rows {rows} -> {packed}, bytes {size} -> {packed_size}")
+
+
+def _replay(reservation_id, at):
+    for e in history(reservation_id, until=at):
+        print(f"{e['at']:%Y-%m-%d %H:%M:%S} {e['action']:<8} actor={e.get('actor')} "
+              f"{e.get('before') or ''} -> {e.get('after') or e.get('detail') or ''}")
+    current = replay(reservation_id, at=at)
+    if current and current["missing_create"]:
+        print("warning: 作成イベントがありません（退避済みか、変更履歴の移行前に作られた予約）。変わった列しか組み立てられません")
+    print(current)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--list", action="store_true")
+    group.add_argument("--compact", metavar="YYYYMM", action="append")
+    group.add_argument("--compact-before", metavar="YYYYMM")
+    group.add_argument("--replay", type=int, metavar="RESERVATION_ID")
+    parser.add_argument("--at", type=datetime.fromisoformat, help="--replay の時点（UTC）")
+    args = parser.parse_args()
+
+    with db.connection_context():
+        if args.list:
+            _list()
+        elif args.compact:
+            _compact(args.compact)
+        elif args.compact_before:
+            _compact([m for m in partitions() if m < args.compact_before])
+        else:
+            _replay(args.replay, args.at)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,58 @@
 # seed_data.py
+#   python seed_data.py                     # 動作確認用の小さなデータ（既定）
+#   python seed_data.py --salons 500 --users 200000 --reservations 5000000 --seed 1   # 負荷試験用
+import argparse
+import time as pytime
 from datetime import datetime, timedelta, time, date
 import random
-from peewee import fn
+from peewee import fn, SqliteDatabase
+from dotenv import load_dotenv
+load_dotenv()   # database.py は import 時に DATABASE_URL などを読むので先に .env を読む
+
 from database import (
-    db, create_tables,
+    db, create_tables, sqlite_pragmas,
     LineChannel, User, UserChannelLink, LiffSession,
     Address, Salon, SalonStaff, SalonImage,
     WorkingHour, BlackoutDate, Service,
-    Reservation, ReservationChangeLog,
+    Reservation, ReservationChangeLog, SalonDailyStat,
     Coupon, CouponRedemption,
-    Notification, Review, SearchKeyword
+    Notification, NotificationRead, NotificationPush, InboxCounter,
+    ReminderSent, SchedulerState,
+    Review, SalonRating, SearchKeyword,
+    SalonCard, SalonSearch, SchemaVersion
 )
+import migrate
+from blueprints.reservation.journal import event, state, import_events, drop_partitions
+from blueprints.home.salon_cards import rebuild_salon_cards
+from blueprints.home.search import rebuild_search_index
+from blueprints.home.nearby import geocode
+from blueprints.info.inbox import rebuild_inbox_counters
+from blueprints.reservation.stats import rebuild_daily_stats
+from blueprints.home.ratings import rebuild_ratings
+from blueprints.coupon.engine import discount_for
 
 random.seed(42)
 
+TABLES = [
+    LineChannel, User, UserChannelLink, LiffSession,
+    Address, Salon, SalonStaff, SalonImage,
+    WorkingHour, BlackoutDate, Service,
+    Reservation, ReservationChangeLog, SalonDailyStat,
+    Coupon, CouponRedemption,
+    Notification, NotificationRead, NotificationPush, InboxCounter,
+    ReminderSent, SchedulerState,
+    Review, SalonRating, SearchKeyword,
+    SalonCard, SalonSearch, SchemaVersion
+]
+
+SERVICE_CATEGORIES = ["カット", "カラー", "パーマ", "トリートメント", "ヘッドスパ", "脱毛", "鍼灸", "整体", "まつエク", "ネイル"]
+KEYWORDS = ["カット", "カラー", "ヘッドスパ", "整体", "脱毛", "盛岡", "学割", "早朝", "メンズ", "レディース"]
+
 def reset_and_create_tables():
     with db:
-        db.drop_tables([
-            LineChannel, User, UserChannelLink, LiffSession,
-            Address, Salon, SalonStaff, SalonImage,
-            WorkingHour, BlackoutDate, Service,
-            Reservation, ReservationChangeLog,
-            Coupon, CouponRedemption,
-            Notification, Review, SearchKeyword
-        ], safe=True)
-    create_tables()
+        db.drop_tables(TABLES, safe=True)
+        drop_partitions()
+    migrate.upgrade(log=lambda message: None)   # 空のDBとして今の定義で作り、最新バージョンを記録
 
 def seed_line_channels():
     channels = []
@@ -203,7 +231,7 @@ def seed_blackouts(salons):
     return rows
 
 def seed_services(salons):
-    categories = ["カット", "カラー", "パーマ", "トリートメント", "ヘッドスパ", "脱毛", "鍼灸", "整体", "まつエク", "ネイル"]
+    categories = SERVICE_CATEGORIES
     svcs = []
     for i in range(10):
         salon = salons[i % len(salons)]
@@ -260,8 +288,7 @@ def seed_notifications(users, salons):
 
 def seed_search_keywords():
     kws = []
-    words = ["カット", "カラー", "ヘッドスパ", "整体", "脱毛", "盛岡", "学割", "早朝", "メンズ", "レディース"]
-    for w in words:
+    for w in KEYWORDS:
         kws.append(SearchKeyword.create(keyword=w, count=random.randint(1, 50), meta={"type": "service"}))
     return kws
 
@@ -269,6 +296,7 @@ def seed_reservations(users, salons, services, staff):
     # 予約10件：開始時刻の重複を避ける
     base = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
     reservations = []
+    events = []
     for i in range(10):
         user = users[i % len(users)]
         svc = services[i % len(services)]
@@ -293,13 +321,15 @@ def seed_reservations(users, salons, services, staff):
         )
         reservations.append(r)
 
-        ReservationChangeLog.create(
-            reservation=r, actor=user, action="create", detail="初回作成"
-        )
-        if r.status == 3:  # キャンセルされていればログ
-            ReservationChangeLog.create(
-                reservation=r, actor=user, action="cancel", detail="ユーザー都合"
-            )
+        # 変更イベント（キャンセルされていれば 作成 → キャンセル の2件）
+        created = state(r)
+        if r.status == 3:
+            created["status"] = 1
+        events.append((r.id, event("create", after=created, actor=user.id, at=r.created_at)))
+        if r.status == 3:
+            events.append((r.id, event("cancel", before={"status": 1}, after={"status": 3},
+                                       actor=user.id, at=r.created_at)))
+    import_events(events)
     return reservations
 
 def seed_coupon_redemptions(reservations, coupons, users):
@@ -342,7 +372,423 @@ def seed_sessions(users):
         ))
     return sess
 
+# ---------------- 負荷試験用の大量データ ----------------
+# python seed_data.py --salons 500 --users 200000 --reservations 5000000 --seed 1
+#   - 行はタプルで溜めて executemany、chunk 行ごとに1トランザクション（ID は採番済みのものを入れる）
+#   - 索引は投入後にまとめて作る（一意索引の作成が「同スタッフの予約が重ならない」等の検算も兼ねる）
+#   - 乱数は random.Random(seed) だけを使い、日付は --today 基準なので同じ引数なら同じデータになる
+#   - 予約はスタッフごとに営業時間内へ前から順に並べるので重ならない
+#   - クーポンは scope に合うサロン・メニューの予約にだけ使い、口コミは完了した予約にだけ付ける
+BULK_CHUNK = 50000
+BULK_DAYS_BACK = 365
+BULK_DAYS_AHEAD = 60
+BULK_STAFF_LOAD = 5             # スタッフ1人・1日あたりの予約数の目安（スタッフ数の決定に使う）
+
+BULK_AREAS = [
+    ("020", "岩手県", "盛岡市"), ("024", "岩手県", "北上市"), ("980", "宮城県", "仙台市青葉区"),
+    ("010", "秋田県", "秋田市"), ("030", "青森県", "青森市"), ("990", "山形県", "山形市"),
+    ("960", "福島県", "福島市"), ("150", "東京都", "渋谷区"), ("160", "東京都", "新宿区"),
+    ("530", "大阪府", "大阪市北区"), ("460", "愛知県", "名古屋市中区"), ("060", "北海道", "札幌市中央区"),
+]
+BULK_HOURS = [  # (開店, 閉店, 定休日の曜日)
+    (time(10, 0), time(19, 0), ()),
+    (time(9, 30), time(18, 30), (5, 6)),
+    (time(11, 0), time(20, 0), (1,)),
+    (time(9, 0), time(21, 0), ()),
+]
+BULK_FIELDS = {
+    LineChannel: (LineChannel.id, LineChannel.name, LineChannel.channel_id, LineChannel.channel_secret,
+                  LineChannel.channel_access_token, LineChannel.liff_id,
+                  LineChannel.created_at, LineChannel.updated_at),
+    User: (User.id, User.line_user_id, User.line_display_name, User.line_picture_url, User.email,
+           User.role, User.is_active, User.created_at, User.updated_at),
+    UserChannelLink: (UserChannelLink.user, UserChannelLink.channel, UserChannelLink.channel_user_id,
+                      UserChannelLink.created_at, UserChannelLink.updated_at),
+    LiffSession: (LiffSession.user, LiffSession.issued_at, LiffSession.expires_at, LiffSession.device_info,
+                  LiffSession.revoked, LiffSession.created_at, LiffSession.updated_at),
+    Address: (Address.id, Address.postal_code, Address.prefecture, Address.city, Address.line1,
+              Address.latitude, Address.longitude, Address.geo_approximate, Address.created_at, Address.updated_at),
+    Salon: (Salon.id, Salon.name, Salon.address, Salon.phone, Salon.description, Salon.is_active, Salon.owner,
+            Salon.created_at, Salon.updated_at),
+    SalonStaff: (SalonStaff.id, SalonStaff.salon, SalonStaff.user, SalonStaff.display_name, SalonStaff.is_active,
+                 SalonStaff.created_at, SalonStaff.updated_at),
+    SalonImage: (SalonImage.salon, SalonImage.url, SalonImage.alt, SalonImage.sort_order,
+                 SalonImage.created_at, SalonImage.updated_at),
+    WorkingHour: (WorkingHour.salon, WorkingHour.weekday, WorkingHour.start, WorkingHour.end, WorkingHour.is_closed,
+                  WorkingHour.created_at, WorkingHour.updated_at),
+    BlackoutDate: (BlackoutDate.salon, BlackoutDate.date, BlackoutDate.reason,
+                   BlackoutDate.created_at, BlackoutDate.updated_at),
+    Service: (Service.id, Service.salon, Service.name, Service.description, Service.duration_min, Service.price_jpy,
+              Service.category, Service.is_active, Service.created_at, Service.updated_at),
+    Coupon: (Coupon.id, Coupon.code, Coupon.name, Coupon.type, Coupon.value, Coupon.scope, Coupon.salon,
+             Coupon.service, Coupon.use_limit, Coupon.is_active, Coupon.created_at, Coupon.updated_at),
+    Reservation: (Reservation.id, Reservation.user, Reservation.salon, Reservation.service, Reservation.staff,
+                  Reservation.start_at, Reservation.end_at, Reservation.status, Reservation.payment_status,
+                  Reservation.amount_jpy, Reservation.created_at, Reservation.updated_at),
+    CouponRedemption: (CouponRedemption.coupon, CouponRedemption.user, CouponRedemption.reservation,
+                       CouponRedemption.used_at, CouponRedemption.created_at, CouponRedemption.updated_at),
+    Review: (Review.reservation, Review.salon, Review.user, Review.rating, Review.comment,
+             Review.created_at, Review.updated_at),
+    Notification: (Notification.id, Notification.user, Notification.salon, Notification.title, Notification.body,
+                   Notification.type, Notification.is_read, Notification.delivered_at, Notification.push_attempts,
+                   Notification.created_at, Notification.updated_at),
+    NotificationRead: (NotificationRead.user, NotificationRead.notification,
+                       NotificationRead.created_at, NotificationRead.updated_at),
+}
+
+
+class BulkWriter:
+    """
+    テーブルごとに行（BULK_FIELDS の順のタプル）を溜め、chunk 行ごとに1トランザクションで書く。
+    件数が多いので insert_many でクエリを組み立てず、値だけ db_value で変換して executemany する。
+    """
+
+    def __init__(self, chunk=BULK_CHUNK):
+        self.chunk = chunk
+        self.rows = {}
+        self.counts = {}
+
+    def add(self, model, row):
+        rows = self.rows.setdefault(model, [])
+        rows.append(row)
+        if len(rows) >= self.chunk:
+            self.flush(model)
+
+    def flush(self, model=None):
+        for m in ([model] if model else list(self.rows)):
+            rows = self.rows.get(m)
+            if not rows:
+                continue
+            fields = BULK_FIELDS[m]
+            sql, _ = m.insert_many(rows[:1], fields=fields).sql()   # 1行分の INSERT 文を使い回す
+            converters = [f.db_value for f in fields]
+            with db.atomic():
+                db.cursor().executemany(sql, [
+                    tuple(None if v is None else conv(v) for conv, v in zip(converters, row)) for row in rows
+                ])
+            self.counts[m] = self.counts.get(m, 0) + len(rows)
+            rows.clear()
+
+
+def _is_sqlite():
+    return isinstance(db, SqliteDatabase)
+
+
+def reset_tables_without_indexes():
+    """テーブルだけ作る（索引は create_bulk_indexes で投入後に作る）"""
+    with db:
+        db.drop_tables(TABLES, safe=True)
+        drop_partitions()
+    for model in TABLES:
+        if model is not SalonSearch:
+            model._schema.create_table(safe=True)
+    if _is_sqlite():
+        db.create_tables([SalonSearch])
+
+
+def create_bulk_indexes():
+    for model in TABLES:
+        if model is not SalonSearch:
+            model._schema.create_indexes(safe=True)
+    if _is_sqlite():
+        db.execute_sql("ANALYZE")
+
+
+def _fit_day(rng, durations, open_min):
+    """1日分の所要時間の並びを営業時間に収まるまで削り、(開店からの開始分, 所要分) を返す"""
+    while durations and sum(durations) > open_min:
+        durations.pop()
+    # 余った時間を15分単位で予約の間に振り分ける（前から順に置くので重ならない）
+    slack = (open_min - sum(durations)) // 15
+    cuts = sorted(rng.randint(0, slack) for _ in durations)
+    placed, offset = [], 0
+    for cut, duration in zip(cuts, durations):
+        placed.append((offset + cut * 15, duration))
+        offset += duration
+    return placed
+
+
+def _reservation_status(rng, start_at, now):
+    """(status, payment_status)。過去は完了が中心、未来は確定・仮予約・キャンセル"""
+    r = rng.random()
+    if start_at < now:
+        if r < 0.85:
+            return 2, (1 if rng.random() < 0.97 else 0)
+        if r < 0.95:
+            return 3, (2 if rng.random() < 0.2 else 0)
+        return 4, 0
+    if r < 0.75:
+        return 1, (1 if rng.random() < 0.2 else 0)
+    if r < 0.9:
+        return 0, 0
+    return 3, 0
+
+
+def bulk_seed(salons=500, users=200000, reservations=5000000, seed=42, chunk=BULK_CHUNK,
+              days_back=BULK_DAYS_BACK, days_ahead=BULK_DAYS_AHEAD, today=None, log=print):
+    """負荷試験用のデータを作る。users は顧客数（スタッフ・オーナー・管理者は別に作る）"""
+    rng = random.Random(seed)
+    today = today or date.today()
+    now = datetime.combine(today, time(9, 0))
+    first_day = today - timedelta(days=days_back)
+    days = [first_day + timedelta(days=i) for i in range(days_back + days_ahead)]
+    started = pytime.perf_counter()
+
+    def step(label):
+        log(f"[{pytime.perf_counter() - started:7.1f}s] {label}")
+
+    reset_tables_without_indexes()
+    if _is_sqlite():
+        db.execute_sql("PRAGMA synchronous=OFF")   # 作り直せるデータなので投入中だけ fsync しない
+    w = BulkWriter(chunk)
+
+    w.add(LineChannel, (1, "BulkChannel", "30001", "secret_bulk", "access_token_bulk", "liff_id_bulk", now, now))
+
+    # ---- ユーザ（顧客 → オーナー → スタッフ → 管理者の順に id を振る）----
+    def add_user(user_id, prefix, name, role, created_at):
+        line_id = f"U_{prefix}_{user_id:08d}"
+        w.add(User, (user_id, line_id, name, f"https://example.com/u{user_id}.png",
+                     f"{prefix}{user_id}@example.com", role, True, created_at, created_at))
+        w.add(UserChannelLink, (user_id, 1, line_id, created_at, created_at))
+
+    for user_id in range(1, users + 1):
+        created_at = now - timedelta(days=rng.randint(0, days_back * 2), minutes=rng.randint(0, 1439))
+        add_user(user_id, "customer", f"顧客{user_id}", 0, created_at)
+        if rng.random() < 0.1:
+            w.add(LiffSession, (user_id, now, now + timedelta(days=7),
+                                rng.choice(["iOS Safari", "Android Chrome", "LINE in-app"]), False, now, now))
+    # 過去のログインで発行された期限切れ・ログアウト済みのセッション（archive.py の対象）。
+    # 上の乱数列を変えないよう別の乱数で作る
+    history_rng = random.Random(seed + 1)
+    for user_id in range(1, users + 1):
+        for _ in range(history_rng.choice((0, 0, 1, 2, 4))):
+            issued_at = now - timedelta(days=history_rng.randint(8, days_back), minutes=history_rng.randint(0, 1439))
+            revoked = history_rng.random() < 0.3
+            ended_at = issued_at + timedelta(days=history_rng.randint(0, 6) if revoked else 7)
+            w.add(LiffSession, (user_id, issued_at, issued_at + timedelta(days=7), "LINE in-app", revoked,
+                                issued_at, ended_at))
+    owner_ids = list(range(users + 1, users + 1 + max(1, salons // 3)))
+    for user_id in owner_ids:
+        add_user(user_id, "owner", f"オーナー{user_id}", 2, now - timedelta(days=days_back * 2))
+    next_user_id = owner_ids[-1] + 1
+    step(f"users: {users} customers, {len(owner_ids)} owners")
+
+    # ---- サロン・メニュー・スタッフ・営業時間 ----
+    open_days = len(days) * 6 / 7
+    staff_per_salon = max(1, -(-reservations // max(1, int(salons * open_days * BULK_STAFF_LOAD))))
+    salon_info = []       # (salon_id, [(service_id, duration, price, category)], [staff_id], hours, blackout_days)
+    service_id = staff_id = coupon_id = 0
+    # 位置は地域の代表点（郵便番号の表）の周り数 km に散らす。上の乱数列を変えないよう別の乱数で作る
+    geo_rng = random.Random(seed + 2)
+    for salon_id in range(1, salons + 1):
+        postal, prefecture, city = rng.choice(BULK_AREAS)
+        categories = rng.sample(SERVICE_CATEGORIES, rng.randint(3, 8))
+        created_at = now - timedelta(days=days_back + rng.randint(1, 365))
+        latitude, longitude = geocode(postal)
+        w.add(Address, (salon_id, f"{postal}-{rng.randint(0, 9999):04d}", prefecture, city,
+                        f"{rng.randint(1, 9)}-{rng.randint(1, 30)}-{rng.randint(1, 30)}",
+                        round(latitude + geo_rng.gauss(0, 0.03), 6), round(longitude + geo_rng.gauss(0, 0.03), 6),
+                        False, created_at, created_at))
+        w.add(Salon, (salon_id, f"{city}サロン {salon_id}", salon_id, f"0{rng.randint(10, 99)}-600-{salon_id:04d}",
+                      f"{city}の{'・'.join(categories)}のお店です。", rng.random() < 0.97,
+                      rng.choice(owner_ids), created_at, created_at))
+        for j in range(2):
+            w.add(SalonImage, (salon_id, f"https://example.com/salon{salon_id}_img{j + 1}.jpg",
+                               f"Salon {salon_id} Image {j + 1}", j, created_at, created_at))
+        opens, closes, closed = rng.choice(BULK_HOURS)
+        for weekday in range(7):
+            if weekday in closed:
+                w.add(WorkingHour, (salon_id, weekday, time(0, 0), time(0, 0), True, created_at, created_at))
+            else:
+                w.add(WorkingHour, (salon_id, weekday, opens, closes, False, created_at, created_at))
+        blackouts = set()
+        if rng.random() < 0.3:
+            day = today + timedelta(days=rng.randint(1, max(1, days_ahead)))
+            blackouts.add(day)
+            w.add(BlackoutDate, (salon_id, day, "臨時休業", created_at, created_at))
+        services = []
+        for category in categories:
+            service_id += 1
+            duration = rng.choice([30, 45, 60, 90])
+            price = rng.choice([3000, 4500, 6000, 8000, 10000])
+            w.add(Service, (service_id, salon_id, category, f"{category}の説明です。", duration, price,
+                            category, True, created_at, created_at))
+            services.append((service_id, duration, price, category))
+        staff = []
+        for _ in range(max(1, staff_per_salon + rng.randint(-1, 1))):
+            staff_id += 1
+            add_user(next_user_id, "staff", f"スタッフ{staff_id}", 1, created_at)
+            w.add(SalonStaff, (staff_id, salon_id, next_user_id, f"スタッフ{staff_id}", True, created_at, created_at))
+            next_user_id += 1
+            staff.append(staff_id)
+        salon_info.append((salon_id, services, staff, (opens, closes, closed), blackouts))
+    add_user(next_user_id, "admin", "管理者", 3, now - timedelta(days=days_back * 2))
+    step(f"salons: {salons}, services: {service_id}, staff: {staff_id}")
+
+    # ---- クーポン（全体 / サロン限定 / メニュー限定）----
+    coupons = {}          # coupon_id → 判定用の dict
+    global_ids, salon_coupons, service_coupons = [], {}, {}
+
+    def add_coupon(code, name, kind, value, scope, salon_id=None, service_id=None, use_limit=None):
+        nonlocal coupon_id
+        coupon_id += 1
+        w.add(Coupon, (coupon_id, code, name, kind, value, scope, salon_id, service_id, use_limit, True, now, now))
+        coupons[coupon_id] = {"type": kind, "value": value, "use_limit": use_limit}
+        if scope == "global":
+            global_ids.append(coupon_id)
+        elif scope == "salon":
+            salon_coupons.setdefault(salon_id, []).append(coupon_id)
+        else:
+            service_coupons.setdefault(service_id, []).append(coupon_id)
+
+    add_coupon("WELCOME20", "新規20%OFF", "percent", 20.0, "global", use_limit=1)
+    add_coupon("WEEKDAY500", "平日500円OFF", "amount", 500, "global")
+    for salon_id, services, _, _, _ in salon_info:
+        if rng.random() < 0.5:
+            add_coupon(f"SALON{salon_id}_10", f"サロン{salon_id}限定10%OFF", "percent", 10.0, "salon", salon_id=salon_id)
+        if rng.random() < 0.5:
+            sid = rng.choice(services)[0]
+            add_coupon(f"MENU{sid}_1000", "メニュー限定1000円OFF", "amount", 1000, "service", service_id=sid)
+    limited_used = set()  # (coupon_id, user_id)：use_limit=1 のクーポンを使った顧客
+
+    # ---- 予約（スタッフごとに日を追って並べる）+ 変更履歴・クーポン利用・口コミ ----
+    n_staff = sum(len(info[2]) for info in salon_info)
+    reservation_id = 0
+    events = []   # 変更イベント（ジャーナルのイベント時刻の月のパーティションへ）
+    lane = 0
+    spill = 0     # 前の担当者に入りきらなかった件数（次の担当者に回して、合計をちょうど reservations 件にする）
+    for salon_id, services, staff, (opens, closes, closed), blackouts in salon_info:
+        open_min = (closes.hour * 60 + closes.minute) - (opens.hour * 60 + opens.minute)
+        lane_days = [d for d in days if d.weekday() not in closed and d not in blackouts]
+        for sid_staff in staff:
+            quota = reservations // n_staff + (1 if lane < reservations % n_staff else 0) + spill
+            lane += 1
+            carry = 0
+            lane_placed = 0
+            for i, day in enumerate(lane_days):
+                target = quota * (i + 1) // len(lane_days) - quota * i // len(lane_days) + carry
+                jitter = rng.choice((-1, 0, 0, 1))
+                if i == len(lane_days) - 1:
+                    jitter = 0
+                count = min(max(0, target + jitter), quota - lane_placed)
+                picks = [rng.choice(services) for _ in range(count)]
+                placed = _fit_day(rng, [p[1] for p in picks], open_min)
+                carry = target - len(placed)
+                lane_placed += len(placed)
+                day_open = datetime.combine(day, opens)
+                for (offset, duration), (service_id, _, price, category) in zip(placed, picks):
+                    reservation_id += 1
+                    user_id = rng.randint(1, users)
+                    start_at = day_open + timedelta(minutes=offset)
+                    end_at = start_at + timedelta(minutes=duration)
+                    created_at = min(now, start_at - timedelta(days=rng.randint(0, 30), minutes=rng.randint(0, 1439)))
+                    status, payment_status = _reservation_status(rng, start_at, now)
+                    amount = price
+                    if rng.random() < 0.12:
+                        candidates = global_ids + salon_coupons.get(salon_id, []) + service_coupons.get(service_id, [])
+                        cid = rng.choice(candidates)
+                        if coupons[cid]["use_limit"] and (cid, user_id) in limited_used:
+                            cid = None
+                        if cid is not None:
+                            if coupons[cid]["use_limit"]:
+                                limited_used.add((cid, user_id))
+                            amount = price - discount_for(coupons[cid], price)
+                            w.add(CouponRedemption, (cid, user_id, reservation_id, created_at, created_at, created_at))
+                    w.add(Reservation, (reservation_id, user_id, salon_id, service_id, sid_staff, start_at, end_at,
+                                        status, payment_status, amount, created_at, created_at))
+                    events.append((reservation_id, event("create", actor=user_id, at=created_at, after={
+                        "user": user_id, "salon": salon_id, "service": service_id, "staff": sid_staff,
+                        "start_at": start_at, "end_at": end_at, "status": 1 if status == 3 else status,
+                        "payment_status": payment_status, "amount_jpy": amount, "note": None,
+                    })))
+                    if status == 3:
+                        canceled_at = min(now, start_at - timedelta(hours=rng.randint(1, 48)))
+                        events.append((reservation_id, event("cancel", before={"status": 1}, after={"status": 3},
+                                                             actor=user_id, at=max(canceled_at, created_at))))
+                    if len(events) >= chunk:
+                        import_events(events)
+                        events = []
+                    if status == 2 and rng.random() < 0.3:
+                        reviewed_at = end_at + timedelta(hours=rng.randint(1, 72))
+                        if reviewed_at <= now:
+                            rating = rng.choices((1, 2, 3, 4, 5), weights=(2, 3, 10, 35, 50))[0]
+                            w.add(Review, (reservation_id, salon_id, user_id, rating,
+                                           f"{category} とても良かったです（{reservation_id}）",
+                                           reviewed_at, reviewed_at))
+            spill = quota - lane_placed
+        if salon_id % 50 == 0:
+            step(f"reservations: salon {salon_id}/{salons}, {reservation_id} rows")
+    import_events(events)
+    step(f"reservations: {reservation_id}" + (f" ({spill} did not fit in opening hours)" if spill else ""))
+
+    # ---- お知らせ（個人宛て・全体向け）と既読、検索キーワード ----
+    notification_id = 0
+    titles = ["キャンペーン", "予約確認", "誕生日クーポン", "新メニュー追加", "レビュー依頼", "システムお知らせ"]
+    for _ in range(users // 2):
+        notification_id += 1
+        title = rng.choice(titles)
+        created_at = now - timedelta(days=rng.randint(0, days_back), minutes=rng.randint(0, 1439))
+        w.add(Notification, (notification_id, rng.randint(1, users), rng.choice([None, rng.randint(1, salons)]),
+                             title, f"{title} の本文です。", rng.choice(["campaign", "reminder", "system"]),
+                             rng.random() < 0.5, created_at, 0, created_at, created_at))
+    for i in range(12):
+        notification_id += 1
+        created_at = now - timedelta(days=30 * i + rng.randint(0, 29))
+        w.add(Notification, (notification_id, None, None, f"キャンペーン {i + 1}", "全体向けのお知らせです。",
+                             "campaign", False, created_at, 0, created_at, created_at))
+        for user_id in rng.sample(range(1, users + 1), users // 10):
+            w.add(NotificationRead, (user_id, notification_id, created_at, created_at))
+    w.flush()
+    SearchKeyword.insert_many([
+        {"keyword": word, "count": rng.randint(1, 5000), "meta": {"type": "service"}, "created_at": now, "updated_at": now}
+        for word in KEYWORDS
+    ]).execute()
+    step("notifications")
+
+    create_bulk_indexes()
+    step("indexes")
+    if _is_sqlite():
+        db.execute_sql("PRAGMA synchronous=%s" % sqlite_pragmas()["synchronous"])
+    create_tables()   # 大量データの対象外のテーブル（Person など）があれば作る
+    migrate.stamp()
+
+    rebuild_salon_cards()
+    rebuild_search_index()
+    rebuild_inbox_counters()
+    step("salon cards / search index / inbox counters")
+    rebuild_daily_stats()
+    rebuild_ratings()
+    step("daily stats / ratings")
+    return w.counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="開発用の初期データ。件数を指定すると負荷試験用の大量データを作る")
+    parser.add_argument("--salons", type=int)
+    parser.add_argument("--users", type=int, help="顧客数（スタッフ・オーナー・管理者は別）")
+    parser.add_argument("--reservations", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk", type=int, default=BULK_CHUNK, help="1トランザクションで書く行数")
+    parser.add_argument("--days-back", type=int, default=BULK_DAYS_BACK)
+    parser.add_argument("--days-ahead", type=int, default=BULK_DAYS_AHEAD)
+    parser.add_argument("--today", type=date.fromisoformat, help="基準日（YYYY-MM-DD。既定は今日）")
+    return parser.parse_args(argv)
+
+
 def main():
+    args = parse_args()
+    if args.salons or args.users or args.reservations:
+        counts = bulk_seed(
+            salons=args.salons or 500, users=args.users or 200000, reservations=args.reservations or 5000000,
+            seed=args.seed, chunk=args.chunk, days_back=args.days_back, days_ahead=args.days_ahead,
+            today=args.today,
+        )
+        print("=== Bulk Seed Completed ===")
+        for model, n in counts.items():
+            print(f"{model.__name__}:", n)
+        return
+
+    random.seed(args.seed)
     reset_and_create_tables()
 
     with db.atomic():
@@ -362,6 +808,11 @@ def main():
         redemptions = seed_coupon_redemptions(reservations, coupons, customers)
         reviews = seed_reviews(reservations)
         sessions = seed_sessions(customers)
+        rebuild_salon_cards()
+        rebuild_search_index()
+        rebuild_inbox_counters()
+        rebuild_daily_stats()
+        rebuild_ratings()
 
     print("=== Seed Completed ===")
     print("Users:", User.select().count())
@@ -0,0 +1,147 @@
+# リクエストごとの SQL プロファイル
+#
+# db.execute_sql を包んで、1リクエスト中に発行した SQL の本数・合計時間・遅い文を記録する。
+#   - 同じ形の SQL（IN (?, ?, ...) の個数違いは同じ形とみなす）が SQL_NPLUS1_THRESHOLD 回以上なら N+1 の疑い
+#   - SQL_SLOW_MS 以上かかった文は EXPLAIN QUERY PLAN（SQLite のみ）付きで警告ログに出す
+# SQL_PROFILE で動作を切り替える:
+#   off     … 何も包まない（本番向け。オーバーヘッドなし）
+#   log     … リクエストごとの集計を INFO、N+1 と遅い文を WARNING で app.logger に出す
+#   headers … log に加えて X-SQL-Count / X-SQL-Time-ms / X-SQL-NPlus1 / Server-Timing をレスポンスに付ける（開発用）
+import logging
+import os
+import re
+import threading
+import time
+
+from flask import request
+
+MODES = ("off", "log", "headers")
+MODE = os.getenv("SQL_PROFILE", "off")
+SLOW_MS = float(os.getenv("SQL_SLOW_MS", "100"))
+NPLUS1_THRESHOLD = int(os.getenv("SQL_NPLUS1_THRESHOLD", "5"))
+TOP_N = 3
+
+_PARAM_LIST = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))+\s*\)")
+_EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "WITH")
+
+_local = threading.local()
+
+
+def shape(sql):
+    """IN (?, ?, ?) のようなパラメータ列を1つにまとめた「SQL の形」"""
+    return _PARAM_LIST.sub("(?...)", sql)
+
+
+class Profile:
+    def __init__(self):
+        self.statements = []   # (sql, params, ms)
+
+    def record(self, sql, params, ms):
+        self.statements.append((sql, params, ms))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def total_ms(self):
+        return sum(ms for _, _, ms in self.statements)
+
+    def slowest(self, n=TOP_N):
+        return sorted(self.statements, key=lambda s: s[2], reverse=True)[:n]
+
+    def repeated(self, threshold=NPLUS1_THRESHOLD):
+        """N+1 の疑いがある [(形, 回数)]（回数の多い順）"""
+        counts = {}
+        for sql, _, _ in self.statements:
+            key = shape(sql)
+            counts[key] = counts.get(key, 0) + 1
+        return sorted(((k, n) for k, n in counts.items() if n >= threshold), key=lambda kn: -kn[1])
+
+
+def current_profile():
+    """記録中のプロファイル（リクエスト外・SQL_PROFILE=off なら None）"""
+    return getattr(_local, "profile", None)
+
+
+def explain(db, sql, params):
+    """EXPLAIN QUERY PLAN の detail 列（SQLite 以外・説明できない文は None）"""
+    from peewee import SqliteDatabase
+
+    if not isinstance(db, SqliteDatabase) or not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    try:
+        rows = db.cursor().execute("EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()
+    except Exception as e:
+        return [f"(explain failed: {e})"]
+    return [row[-1] for row in rows]
+
+
+def wrap(db):
+    """db.execute_sql を包む（プロファイル中のスレッドだけ記録する）"""
+    if getattr(db, "_sql_profiler_wrapped", False):
+        return
+    execute_sql = db.execute_sql
+
+    def profiled_execute_sql(sql, params=None, *args, **kwargs):
+        profile = getattr(_local, "profile", None)
+        if profile is None:
+            return execute_sql(sql, params, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return execute_sql(sql, params, *args, **kwargs)
+        finally:
+            profile.record(sql, params, (time.perf_counter() - started) * 1000.0)
+
+    db.execute_sql = profiled_execute_sql
+    db._sql_profiler_wrapped = True
+
+
+def _report(app, db, profile):
+    logger = app.logger
+    path = f"{request.method} {request.path}"
+    logger.info("sql %s: %d statements, %.1f ms", path, profile.count, profile.total_ms)
+    for key, n in profile.repeated():
+        logger.warning("sql %s: possible N+1, %d x %s", path, n, key)
+    for sql, params, ms in profile.slowest():
+        if ms < SLOW_MS:
+            break
+        plan = explain(db, sql, params)
+        logger.warning("sql %s: slow statement %.1f ms: %s%s", path, ms, sql,
+                       "".join(f"\n    {line}" for line in plan or ()))
+
+
+def init_app(app, db, mode=None):
+    """SQL_PROFILE に応じて計測を組み込む。off なら何もしない"""
+    mode = mode or MODE
+    if mode not in MODES:
+        raise ValueError(f"SQL_PROFILE must be one of {MODES}: {mode!r}")
+    if mode == "off":
+        return
+    wrap(db)
+    if app.logger.level == logging.NOTSET:
+        app.logger.setLevel(logging.INFO)
+
+    @app.before_request
+    def _start_sql_profile():
+        _local.profile = Profile()
+
+    @app.after_request
+    def _finish_sql_profile(response):
+        profile = current_profile()
+        if profile is None:
+            return response
+        # 報告用の EXPLAIN を数えないよう、先に記録を止める
+        _local.profile = None
+        _report(app, db, profile)
+        if mode == "headers":
+            repeated = profile.repeated()
+            response.headers["X-SQL-Count"] = str(profile.count)
+            response.headers["X-SQL-Time-ms"] = f"{profile.total_ms:.2f}"
+            response.headers["X-SQL-NPlus1"] = str(len(repeated))
+            response.headers.add("Server-Timing", f'db;dur={profile.total_ms:.2f};desc="{profile.count} queries"')
+        return response
+
+    @app.teardown_request
+    def _drop_sql_profile(exc):
+        _local.profile = None
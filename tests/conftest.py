@@ -0,0 +1,53 @@
+# テスト共通のフィクスチャ
+#
+# テストごとに一時ディレクトリの SQLite を migrate.upgrade() で作り、プロセス内のキャッシュを空にする。
+#   python -m pytest -q
+import os
+import tempfile
+
+# database.py は import 時に DATABASE_URL を読むので、ほかの import より先に置き換える
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.gettempdir(), "many_booking_test.db")
+
+import pytest
+
+from database import db, sqlite_pragmas
+import auth
+import liff_auth
+import migrate
+from blueprints.coupon import engine
+from blueprints.reservation import journal
+
+
+def _quiet(*args):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def database(tmp_path):
+    db.init(str(tmp_path / "test.db"), pragmas=sqlite_pragmas())
+    journal._created.clear()
+    auth.identity_cache.clear()
+    liff_auth._cache.clear()
+    engine.invalidate()
+    yield db
+    if not db.is_closed():
+        db.close()
+
+
+@pytest.fixture
+def schema(database):
+    migrate.upgrade(log=_quiet)
+    return database
+
+
+@pytest.fixture
+def app(schema):
+    from app import create_app
+    app = create_app()
+    app.config["TESTING"] = True
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
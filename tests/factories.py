@@ -0,0 +1,44 @@
+# テスト用のデータを作る関数
+from datetime import datetime, time as dtime, timedelta
+
+from database import User, LiffSession, Salon, SalonStaff, WorkingHour, Service, Reservation
+
+
+def login_as(client, user):
+    """user の有効な LiffSession を作り、client の Flask セッションをログイン済みにする"""
+    now = datetime.utcnow()
+    liff_session = LiffSession.create(user=user, issued_at=now, expires_at=now + timedelta(days=1))
+    with client.session_transaction() as s:
+        s["line_id"] = user.line_user_id
+        s["user_id"] = user.id
+        s["liff_session_id"] = liff_session.id
+
+
+def make_user(name, role=0):
+    return User.create(line_user_id=f"U{name}", line_display_name=name, role=role)
+
+
+def make_salon(name="salon", hours=((dtime(10, 0), dtime(18, 0)),), staff=0, weekdays=range(7)):
+    """weekdays の各曜日に hours の営業時間（分割シフト可）を持つサロンと、staff 人のスタッフ"""
+    salon = Salon.create(name=name)
+    for weekday in weekdays:
+        for start, end in hours:
+            WorkingHour.create(salon=salon, weekday=weekday, start=start, end=end)
+    staff_ids = [
+        SalonStaff.create(salon=salon, user=make_user(f"{name}_staff{i}", role=1), display_name=f"staff{i}").id
+        for i in range(staff)
+    ]
+    return salon, staff_ids
+
+
+def make_service(salon, duration_min=30, price_jpy=5000, name="cut"):
+    return Service.create(salon=salon, name=name, duration_min=duration_min, price_jpy=price_jpy,
+                          category="cut")
+
+
+def make_reservation(user, service, start_at, staff=None, status=1):
+    return Reservation.create(
+        user=user, salon=service.salon_id, service=service, staff=staff, start_at=start_at,
+        end_at=start_at + timedelta(minutes=service.duration_min), status=status,
+        amount_jpy=service.price_jpy,
+    )
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask import session
+
+import auth
+from database import LiffSession, User
+from .factories import make_user, login_as
+
+
+@pytest.fixture
+def checks(monkeypatch):
+    """_still_valid（キャッシュのエントリを DB で確かめる）を呼んだ回数"""
+    calls = []
+    still_valid = auth._still_valid
+
+    def counted(entry, session_id):
+        calls.append(session_id)
+        return still_valid(entry, session_id)
+
+    monkeypatch.setattr(auth, "_still_valid", counted)
+    return calls
+
+
+@pytest.fixture
+def logged_in(app, schema):
+    user = make_user("member")
+    now = datetime.utcnow()
+    liff_session = LiffSession.create(user=user, issued_at=now, expires_at=now + timedelta(days=1))
+
+    def identity():
+        with app.test_request_context():
+            session.update(line_id=user.line_user_id, liff_session_id=liff_session.id)
+            return auth.current_identity()
+
+    return user, liff_session, identity
+
+
+def test_cache_hits_do_not_query(monkeypatch, logged_in, checks):
+    monkeypatch.setattr(auth.identity_cache, "revalidate", 60)
+    user, _, identity = logged_in
+    for _ in range(5):
+        assert identity()["user_id"] == user.id
+    assert checks == []
+
+
+def test_revocation_elsewhere_is_seen_after_revalidate(monkeypatch, logged_in, checks):
+    monkeypatch.setattr(auth.identity_cache, "revalidate", 60)
+    user, liff_session, identity = logged_in
+    assert identity()["user_id"] == user.id
+    # 別プロセスでの失効（on_write を通らない一括 UPDATE）はキャッシュに届かない
+    LiffSession.update(revoked=True).where(LiffSession.id == liff_session.id).execute()
+    assert identity() is not None
+    monkeypatch.setattr(auth.identity_cache, "revalidate", 0)
+    assert identity() is None
+    assert len(checks) == 1
+
+
+def test_changes_in_this_process_are_immediate(monkeypatch, logged_in):
+    monkeypatch.setattr(auth.identity_cache, "revalidate", 60)
+    user, liff_session, identity = logged_in
+    assert identity()["user_id"] == user.id
+    user = User.get_by_id(user.id)
+    user.is_active = False
+    user.save()
+    assert identity() is None
+
+
+def test_logout_ignores_non_object_body(client, schema):
+    user = make_user("member")
+    login_as(client, user)
+    assert client.post("/logout", json=["all"]).get_json() == {"ok": True}
+    assert LiffSession.select().where(LiffSession.revoked == True).count() == 1
+    with client.session_transaction() as s:
+        assert "liff_session_id" not in s
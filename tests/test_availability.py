@@ -0,0 +1,127 @@
+from datetime import date, datetime, time as dtime, timedelta
+
+import pytest
+
+from database import BlackoutDate, WorkingHour
+from blueprints.reservation.availability import find_free_slots
+from .factories import make_user, make_salon, make_service, make_reservation
+
+DAY = date(2030, 1, 7)            # 月曜日
+NOW = datetime(2030, 1, 1, 9, 0)  # DAY より前
+
+
+def at(hour, minute=0, day=DAY):
+    return datetime.combine(day, dtime(hour, minute))
+
+
+def starts(salon, service, **kwargs):
+    kwargs.setdefault("days", 1)
+    kwargs.setdefault("start_date", DAY)
+    kwargs.setdefault("now", NOW)
+    return [s["start_at"] for s in find_free_slots(salon.id, service.id, **kwargs)]
+
+
+@pytest.fixture
+def salon(schema):
+    salon, _ = make_salon(hours=((dtime(10, 0), dtime(12, 0)),))
+    return salon
+
+
+def test_slots_end_within_opening_hours(salon):
+    service = make_service(salon, duration_min=30)
+    slots = find_free_slots(salon.id, service.id, days=1, start_date=DAY, now=NOW)
+    assert [s["start_at"] for s in slots] == [at(10, m) for m in (0, 15, 30, 45)] + [at(11, m) for m in (0, 15, 30)]
+    assert slots[-1]["end_at"] == at(12)
+    assert all(s["staff_ids"] == [] for s in slots)
+
+
+def test_service_longer_than_opening_hours_has_no_slots(salon):
+    service = make_service(salon, duration_min=150)
+    assert starts(salon, service) == []
+
+
+def test_split_shifts(schema):
+    salon, _ = make_salon(hours=((dtime(10, 0), dtime(11, 0)), (dtime(13, 0), dtime(14, 0))))
+    service = make_service(salon, duration_min=60)
+    assert starts(salon, service) == [at(10), at(13)]
+
+
+def test_closed_weekday(schema):
+    salon, _ = make_salon(weekdays=range(1, 7))
+    WorkingHour.create(salon=salon, weekday=0, start=dtime(10, 0), end=dtime(18, 0), is_closed=True)
+    service = make_service(salon)
+    assert starts(salon, service) == []
+    assert starts(salon, service, start_date=DAY + timedelta(days=1))[0] == at(10, day=DAY + timedelta(days=1))
+
+
+def test_whole_day_blackout(salon):
+    service = make_service(salon)
+    BlackoutDate.create(salon=salon, date=DAY, reason="holiday")
+    assert starts(salon, service) == []
+    assert starts(salon, service, start_date=DAY + timedelta(days=1)) != []
+
+
+def test_partial_blackout(salon):
+    service = make_service(salon, duration_min=30)
+    BlackoutDate.create(salon=salon, date=DAY, start=dtime(10, 30), end=dtime(11, 0))
+    assert starts(salon, service) == [at(10), at(11), at(11, 15), at(11, 30)]
+
+
+def test_reservation_blocks_overlapping_slots(salon):
+    service = make_service(salon, duration_min=30)
+    make_reservation(make_user("a"), service, at(10, 30))
+    assert starts(salon, service) == [at(10), at(11), at(11, 15), at(11, 30)]
+
+
+@pytest.mark.parametrize("status", [3, 4])
+def test_canceled_and_no_show_do_not_block(salon, status):
+    service = make_service(salon, duration_min=30)
+    make_reservation(make_user("a"), service, at(10, 30), status=status)
+    assert len(starts(salon, service)) == 7
+
+
+def test_reservation_across_midnight_blocks_next_day(schema):
+    salon, _ = make_salon(hours=((dtime(0, 0), dtime(2, 0)), (dtime(22, 0), dtime(23, 59))))
+    service = make_service(salon, duration_min=60)
+    make_reservation(make_user("a"), service, at(23, 30, day=DAY - timedelta(days=1)))
+    assert starts(salon, service)[:2] == [at(0, 30), at(0, 45)]
+
+
+def test_staff_lanes(schema):
+    salon, (first, second) = make_salon(hours=((dtime(10, 0), dtime(11, 0)),), staff=2)
+    service = make_service(salon, duration_min=30)
+    make_reservation(make_user("a"), service, at(10), staff=first)
+    slots = find_free_slots(salon.id, service.id, days=1, start_date=DAY, now=NOW)
+    assert [(s["start_at"], s["staff_ids"]) for s in slots] == [
+        (at(10), [second]), (at(10, 15), [second]), (at(10, 30), [first, second]),
+    ]
+    assert starts(salon, service, staff_id=first) == [at(10, 30)]
+    assert starts(salon, service, staff_id=-1) == []
+
+
+def test_unassigned_reservation_takes_one_staff(schema):
+    salon, (first, second) = make_salon(hours=((dtime(10, 0), dtime(11, 0)),), staff=2)
+    service = make_service(salon, duration_min=30)
+    make_reservation(make_user("a"), service, at(10))
+    slots = find_free_slots(salon.id, service.id, days=1, start_date=DAY, now=NOW)
+    assert slots[0]["start_at"] == at(10) and len(slots[0]["staff_ids"]) == 1
+
+
+def test_past_times_today_are_excluded(salon):
+    service = make_service(salon, duration_min=30)
+    assert starts(salon, service, now=at(10, 20))[0] == at(10, 30)
+    assert starts(salon, service, start_date=DAY - timedelta(days=1), days=2, now=at(10, 20))[0] == at(10, 30)
+
+
+def test_step(salon):
+    service = make_service(salon, duration_min=60)
+    assert starts(salon, service, step_min=30) == [at(10), at(10, 30), at(11)]
+
+
+def test_unknown_or_inactive_service(salon):
+    service = make_service(salon)
+    other, _ = make_salon(name="other")
+    assert find_free_slots(other.id, service.id, start_date=DAY, now=NOW) is None
+    service.is_active = False
+    service.save()
+    assert find_free_slots(salon.id, service.id, start_date=DAY, now=NOW) is None
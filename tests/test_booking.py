@@ -0,0 +1,113 @@
+import threading
+from datetime import date, datetime, time as dtime, timedelta
+
+import pytest
+
+from database import db, Reservation
+from blueprints.reservation.booking import (
+    create_reservation, change_status, InvalidRequest, SlotUnavailable, BookingError,
+)
+from blueprints.reservation.journal import history
+from .factories import make_user, make_salon, make_service
+
+DAY = date(2030, 1, 7)
+
+
+def at(hour, minute=0):
+    return datetime.combine(DAY, dtime(hour, minute))
+
+
+@pytest.fixture
+def user(schema):
+    return make_user("customer")
+
+
+def test_overlap_on_salon_without_staff_is_rejected(user):
+    salon, _ = make_salon()
+    service = make_service(salon, duration_min=60)
+    create_reservation(user.id, salon.id, service.id, at(11))
+    for start_at in (at(11), at(10, 30), at(11, 59)):
+        with pytest.raises(SlotUnavailable):
+            create_reservation(user.id, salon.id, service.id, start_at)
+    # 終わりと始まりが接するだけなら重ならない
+    create_reservation(user.id, salon.id, service.id, at(12))
+    create_reservation(user.id, salon.id, service.id, at(10))
+    assert Reservation.select().count() == 3
+
+
+def test_overlap_on_same_staff_is_rejected(user):
+    salon, (first, second) = make_salon(staff=2)
+    service = make_service(salon, duration_min=60)
+    create_reservation(user.id, salon.id, service.id, at(10), staff_id=first)
+    with pytest.raises(SlotUnavailable):
+        create_reservation(user.id, salon.id, service.id, at(10, 30), staff_id=first)
+    reservation = create_reservation(user.id, salon.id, service.id, at(10, 30), staff_id=second)
+    assert reservation.staff_id == second
+
+
+def test_unassigned_bookings_fill_free_staff(user):
+    salon, staff_ids = make_salon(staff=2)
+    service = make_service(salon, duration_min=60)
+    lanes = {create_reservation(user.id, salon.id, service.id, at(10)).staff_id for _ in staff_ids}
+    assert lanes == set(staff_ids)
+    with pytest.raises(SlotUnavailable):
+        create_reservation(user.id, salon.id, service.id, at(10, 15))
+
+
+def test_outside_opening_hours_is_rejected(user):
+    salon, _ = make_salon(hours=((dtime(10, 0), dtime(12, 0)),))
+    service = make_service(salon, duration_min=60)
+    with pytest.raises(SlotUnavailable):
+        create_reservation(user.id, salon.id, service.id, at(11, 30))
+
+
+def test_rejected_booking_writes_nothing(user):
+    salon, _ = make_salon()
+    service = make_service(salon, duration_min=60)
+    first = create_reservation(user.id, salon.id, service.id, at(10))
+    with pytest.raises(SlotUnavailable):
+        create_reservation(user.id, salon.id, service.id, at(10, 30))
+    assert [r.id for r in Reservation.select()] == [first.id]
+    assert [e["action"] for e in history(first.id)] == ["create"]
+
+
+def test_canceled_slot_can_be_rebooked_but_not_restored(user):
+    salon, _ = make_salon()
+    service = make_service(salon, duration_min=60)
+    canceled = create_reservation(user.id, salon.id, service.id, at(10))
+    change_status(canceled.id, status=3)
+    create_reservation(user.id, salon.id, service.id, at(10, 30))
+    with pytest.raises(SlotUnavailable):
+        change_status(canceled.id, status=1)
+    assert Reservation.get_by_id(canceled.id).status == 3
+
+
+def test_invalid_requests(user):
+    salon, _ = make_salon()
+    service = make_service(salon)
+    other, _ = make_salon(name="other")
+    with pytest.raises(InvalidRequest):
+        create_reservation(user.id, salon.id, service.id, datetime.now() - timedelta(hours=1))
+    with pytest.raises(InvalidRequest):
+        create_reservation(user.id, other.id, service.id, at(10))
+
+
+def test_concurrent_bookings_for_one_slot(user):
+    salon, _ = make_salon()
+    service = make_service(salon, duration_min=60)
+    results = []
+
+    def book():
+        try:
+            with db.connection_context():
+                results.append(create_reservation(user.id, salon.id, service.id, at(10)).id)
+        except BookingError as e:
+            results.append(e.code)
+
+    threads = [threading.Thread(target=book) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 8 and results.count("slot_unavailable") == 7
+    assert Reservation.select().count() == 1
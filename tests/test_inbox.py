@@ -0,0 +1,159 @@
+import base64
+import json
+from datetime import date, datetime, time as dtime, timedelta
+
+import pytest
+
+from database import InboxCounter, Notification
+from blueprints.info.inbox import (
+    unread_count, mark_read, mark_all_read, inbox_page, rebuild_inbox_counters,
+)
+from .factories import make_user, make_salon, make_service, make_reservation, login_as
+
+T0 = datetime(2030, 1, 1, 9, 0)
+
+
+@pytest.fixture
+def people(schema):
+    """customer は salon を予約したことがあり、stranger は無い"""
+    salon, _ = make_salon()
+    customer, stranger = make_user("customer"), make_user("stranger")
+    make_reservation(customer, make_service(salon), datetime.combine(date(2030, 1, 7), dtime(10, 0)))
+    return customer, stranger, salon
+
+
+def notify(user=None, salon=None, minutes=0, delivered=True):
+    return Notification.create(user=user, salon=salon, title=f"n{minutes}",
+                               delivered_at=T0 + timedelta(minutes=minutes) if delivered else None)
+
+
+def counters():
+    return {key: value for key, value in InboxCounter.select(InboxCounter.key, InboxCounter.value).tuples() if value}
+
+
+def assert_counters_consistent():
+    """差分で保ったカウンタが数え直した値と同じ"""
+    kept = counters()
+    rebuild_inbox_counters()
+    assert kept == counters()
+
+
+def test_personal_read_and_delete(people):
+    customer, stranger, _ = people
+    first, second, third = (notify(customer, minutes=i) for i in range(3))
+    notify(customer, minutes=3, delivered=False)
+    assert unread_count(customer.id) == 3
+    assert unread_count(stranger.id) == 0
+
+    assert mark_read(customer.id, [first.id]) == 1
+    assert mark_read(customer.id, [first.id]) == 0
+    assert unread_count(customer.id) == 2
+
+    Notification.get_by_id(first.id).delete_instance()   # 既読を消しても変わらない
+    assert unread_count(customer.id) == 2
+    Notification.get_by_id(second.id).delete_instance()
+    assert unread_count(customer.id) == 1
+    assert_counters_consistent()
+
+
+def test_cannot_mark_someone_elses_notification(people):
+    customer, stranger, _ = people
+    notification = notify(customer)
+    assert mark_read(stranger.id, [notification.id]) == 0
+    assert unread_count(customer.id) == 1
+
+
+def test_broadcast_read_and_delete(people):
+    customer, stranger, _ = people
+    broadcast = notify()
+    assert unread_count(customer.id) == unread_count(stranger.id) == 1
+
+    assert mark_read(customer.id, [broadcast.id]) == 1
+    assert mark_read(customer.id, [broadcast.id]) == 0
+    assert unread_count(customer.id) == 0
+    assert unread_count(stranger.id) == 1
+
+    Notification.get_by_id(broadcast.id).delete_instance()
+    assert unread_count(customer.id) == unread_count(stranger.id) == 0
+    notify(minutes=1)
+    assert unread_count(customer.id) == unread_count(stranger.id) == 1
+    assert_counters_consistent()
+
+
+def test_salon_broadcast_reaches_only_its_customers(people):
+    customer, stranger, salon = people
+    broadcast = notify(salon=salon)
+    assert unread_count(customer.id) == 1
+    assert unread_count(stranger.id) == 0
+    assert mark_all_read(stranger.id) == 0
+    assert mark_read(stranger.id, [broadcast.id]) == 0
+    assert [row["id"] for row in inbox_page(stranger.id)[0]] == []
+
+    assert mark_all_read(customer.id) == 1
+    assert unread_count(customer.id) == 0
+
+    # 後から予約したユーザには未読として届く
+    make_reservation(stranger, salon.services.get(), datetime.combine(date(2030, 1, 8), dtime(10, 0)))
+    assert unread_count(stranger.id) == 1
+    assert [row["id"] for row in inbox_page(stranger.id, "unread")[0]] == [broadcast.id]
+    assert_counters_consistent()
+
+
+def test_undelivered_broadcast_cannot_be_read(people):
+    customer, _, _ = people
+    pending = notify(delivered=False)
+    assert mark_read(customer.id, [pending.id]) == 0
+    assert mark_all_read(customer.id) == 0
+    assert unread_count(customer.id) == 0
+    assert_counters_consistent()
+
+
+def test_mark_all_read(people):
+    customer, stranger, salon = people
+    notify(customer, minutes=0)
+    notify(minutes=1)
+    notify(salon=salon, minutes=2)
+    notify(stranger, minutes=3)
+    assert unread_count(customer.id) == 3
+    assert mark_all_read(customer.id) == 3
+    assert unread_count(customer.id) == 0
+    assert unread_count(stranger.id) == 2
+    assert_counters_consistent()
+
+
+def test_inbox_page_merges_personal_and_broadcasts(people):
+    customer, _, salon = people
+    ids = [notify(customer, minutes=0).id, notify(minutes=1).id, notify(salon=salon, minutes=2).id,
+           notify(customer, minutes=3).id]
+    mark_read(customer.id, [ids[1], ids[3]])
+
+    rows, cursor = inbox_page(customer.id, limit=3)
+    rest, last = inbox_page(customer.id, cursor=cursor, limit=3)
+    assert [r["id"] for r in rows + rest] == ids[::-1]
+    assert last is None
+    assert [(r["is_read"], r["is_broadcast"]) for r in rows + rest] == [
+        (True, False), (False, True), (True, True), (False, False),
+    ]
+    assert [r["id"] for r in inbox_page(customer.id, "unread")[0]] == [ids[2], ids[0]]
+    assert [r["id"] for r in inbox_page(customer.id, "read")[0]] == [ids[3], ids[1]]
+
+
+def test_read_endpoint(client, people):
+    customer, _, _ = people
+    notification = notify(customer)
+    login_as(client, customer)
+    assert client.post("/info/read", json=[notification.id]).status_code == 400
+    assert client.post("/info/read", json={"ids": ["x"]}).status_code == 400
+    resp = client.post("/info/read", json={"ids": [notification.id]})
+    assert resp.get_json() == {"ok": True, "updated": 1, "unread": 0}
+
+
+@pytest.mark.parametrize("values", [[[1], 2], [{"a": 1}, 2], [1], "x"])
+def test_malformed_cursor_is_first_page(client, people, values):
+    customer, _, _ = people
+    notify(customer)
+    login_as(client, customer)
+    cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+    resp = client.get(f"/api/v1/notifications?cursor={cursor}")
+    assert resp.status_code == 200
+    assert len(resp.get_json()["notifications"]) == 1
@@ -0,0 +1,162 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+
+import line_api
+import liff_auth
+from liff_auth import verify_id_token, VerifyError, VerifyTimeout
+
+CHANNEL_ID = "1234567890"
+SECRET = "channel-secret"
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _part(value):
+    return _b64(json.dumps(value).encode("utf-8"))
+
+
+def claims(**overrides):
+    values = {"iss": liff_auth.ISSUER, "aud": CHANNEL_ID, "sub": "Uuser", "exp": time.time() + 600,
+              "name": "user"}
+    values.update(overrides)
+    return {k: v for k, v in values.items() if v is not None}
+
+
+def token(payload=None, header=None, secret=SECRET):
+    signing_input = f"{_part(header or {'alg': 'HS256', 'typ': 'JWT'})}.{_part(payload or claims())}"
+    signature = hmac.new(secret.encode("utf-8"), signing_input.encode("ascii"), hashlib.sha256).digest()
+    return f"{signing_input}.{_b64(signature)}"
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = body if isinstance(body, str) else json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeSession:
+    """verify API の代わり。post() は responses を順に返す（例外なら送出する）"""
+
+    def __init__(self, *responses, delay=0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.calls = 0
+
+    def post(self, url, data=None, timeout=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    def install(*responses, delay=0):
+        session = FakeSession(*responses, delay=delay)
+        monkeypatch.setattr(line_api, "http_session", lambda: session)
+        return session
+    return install
+
+
+def test_valid_local_token_is_cached(remote):
+    session = remote()
+    id_token = token()
+    assert verify_id_token(id_token, CHANNEL_ID, SECRET)["sub"] == "Uuser"
+    assert verify_id_token(id_token, CHANNEL_ID, SECRET)["sub"] == "Uuser"
+    assert session.calls == 0
+    # キャッシュから返すときもクレームは確かめる
+    with pytest.raises(VerifyError, match="invalid aud"):
+        verify_id_token(id_token, "other-channel", SECRET)
+
+
+def test_malformed_tokens():
+    header = _part({"alg": "HS256"})
+    for id_token in ("not.a.token", f"{header}.{_b64(b'{')}.{_b64(b'sig')}",
+                     f"{header}.{_b64(bytes([0xff]))}.{_b64(b'sig')}",
+                     f"{_b64(b'[]')}.{_part(claims())}.{_b64(b'sig')}",
+                     f"{header}.{_b64(b'1')}.{_b64(b'sig')}"):
+        with pytest.raises(VerifyError, match="malformed id_token"):
+            verify_id_token(id_token, CHANNEL_ID, SECRET)
+
+
+def test_bad_signature():
+    with pytest.raises(VerifyError, match="invalid signature"):
+        verify_id_token(token(secret="wrong"), CHANNEL_ID, SECRET)
+
+
+@pytest.mark.parametrize("payload, nonce, detail", [
+    (claims(iss="https://example.com"), None, "invalid iss"),
+    (claims(aud="other-channel"), None, "invalid aud"),
+    (claims(exp=time.time() - 3600), None, "IdToken expired"),
+    (claims(exp="tomorrow"), None, "IdToken expired"),
+    (claims(exp=None), None, "IdToken expired"),
+    (claims(nonce="abc"), "xyz", "invalid nonce"),
+    (claims(sub=None), None, "no sub"),
+])
+def test_invalid_claims(payload, nonce, detail):
+    with pytest.raises(VerifyError) as e:
+        verify_id_token(token(payload), CHANNEL_ID, SECRET, nonce=nonce)
+    assert e.value.detail == detail
+
+
+def test_failures_are_not_cached(remote):
+    session = remote(FakeResponse(503, "unavailable"), FakeResponse(200, claims()))
+    id_token = token(header={"alg": "ES256"})
+    with pytest.raises(VerifyError, match="HTTP 503"):
+        verify_id_token(id_token, CHANNEL_ID, SECRET)
+    assert verify_id_token(id_token, CHANNEL_ID, SECRET)["sub"] == "Uuser"
+    assert verify_id_token(id_token, CHANNEL_ID, SECRET)["sub"] == "Uuser"
+    assert session.calls == 2
+
+
+@pytest.mark.parametrize("response, detail", [
+    (FakeResponse(500, "error"), "verify request failed: HTTP 500"),
+    (FakeResponse(400, '{"error":"invalid_request"}'), '{"error":"invalid_request"}'),
+    (FakeResponse(200, "<html>proxy error</html>"), "verify request failed: invalid response"),
+    (FakeResponse(200, ["not", "an", "object"]), "verify request failed: invalid response"),
+    (OSError("connection reset"), "verify request failed: connection reset"),
+])
+def test_remote_failures(remote, response, detail):
+    remote(response)
+    with pytest.raises(VerifyError) as e:
+        verify_id_token(token(header={"alg": "ES256"}), CHANNEL_ID, SECRET)
+    assert e.value.detail == detail
+
+
+def test_concurrent_mode_budget(remote):
+    remote(FakeResponse(200, claims()), delay=0.3)
+    id_token = token(header={"alg": "ES256"})
+    with pytest.raises(VerifyTimeout):
+        verify_id_token(id_token, CHANNEL_ID, mode="concurrent", budget=0.01)
+    # 検証は続いているので、終われば同じトークンはキャッシュから返る
+    liff_auth._inflight[liff_auth._token_key(id_token)].result(timeout=5)
+    assert verify_id_token(id_token, CHANNEL_ID, mode="concurrent", budget=0.01)["sub"] == "Uuser"
+
+
+def test_concurrent_mode_raises_verify_error(remote):
+    remote(FakeResponse(500, "error"))
+    with pytest.raises(VerifyError, match="HTTP 500"):
+        verify_id_token(token(header={"alg": "ES256"}), CHANNEL_ID, mode="concurrent", budget=5)
+
+
+def test_liff_login_endpoint(app, client):
+    app.config.update(ENV=None, LINE_CHANNEL_ID=CHANNEL_ID, LINE_CHANNEL_SECRET=SECRET)
+    assert client.post("/liff-login", json=["id_token"]).get_json()["error"] == "no id_token"
+    resp = client.post("/liff-login", json={"id_token": token(secret="wrong")})
+    assert resp.status_code == 400
+    assert resp.get_json() == {"ok": False, "error": "verify_failed", "detail": "invalid signature"}
+    resp = client.post("/liff-login", json={"id_token": token()})
+    assert resp.status_code == 200
+    assert resp.get_json()["user"]["line_id"] == "Uuser"
@@ -0,0 +1,84 @@
+from datetime import date, datetime, time as dtime
+
+import pytest
+
+import line_push
+from database import LineChannel, Notification, NotificationPush, UserChannelLink
+from blueprints.info.inbox import unread_count
+from .factories import make_user, make_salon, make_service, make_reservation
+
+
+class FakePusher:
+    """multicast の代わり。results を順に返し（尽きたら SENT）、送った (宛先, 文面) を記録する"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.sent = []
+
+    def multicast(self, channel_id, access_token, to, messages, retry_key):
+        result = self.results.pop(0) if self.results else line_push.SENT
+        if result == line_push.SENT:
+            self.sent.append((tuple(to), messages[0]["text"]))
+        return result
+
+
+@pytest.fixture
+def linked(schema):
+    """LINE にリンク済みのユーザ3人（a は salon を予約したことがある）"""
+    channel = LineChannel.create(name="ch", channel_id="ch", channel_secret="s", channel_access_token="t")
+    users = {}
+    for name in ("a", "b", "c"):
+        users[name] = make_user(name)
+        UserChannelLink.create(user=users[name], channel=channel, channel_user_id=f"U{name}")
+    salon, _ = make_salon()
+    make_reservation(users["a"], make_service(salon), datetime.combine(date(2030, 1, 7), dtime(10, 0)))
+    return users, salon
+
+
+def pending(user=None, salon=None, title="hello"):
+    return Notification.create(user=user, salon=salon, title=title, delivered_at=None)
+
+
+def drain(pusher):
+    # 1スレッドで送って、FakePusher の results をチャンクの順に当てる
+    return line_push.drain_once(pusher, concurrency=1)
+
+
+def test_same_text_for_one_recipient_is_sent_twice(linked):
+    users, _ = linked
+    pending(users["a"])
+    pending(users["a"])
+    pending(users["b"])
+    pusher = FakePusher()
+    assert drain(pusher) == (3, 3, 3)
+    assert sorted(pusher.sent) == [(("Ua",), "hello"), (("Ua", "Ub"), "hello")]
+    assert unread_count(users["a"].id) == 2
+    assert NotificationPush.select().count() == 0
+
+
+def test_salon_broadcast_goes_to_its_customers(linked):
+    users, salon = linked
+    pending(salon=salon, title="salon news")
+    pending(title="everyone")
+    pusher = FakePusher()
+    drain(pusher)
+    assert sorted(pusher.sent) == [(("Ua",), "salon news"), (("Ua", "Ub", "Uc"), "everyone")]
+    assert unread_count(users["a"].id) == 2
+    assert unread_count(users["b"].id) == 1
+
+
+def test_retry_skips_recipients_already_sent(monkeypatch, linked):
+    users, _ = linked
+    monkeypatch.setattr(line_push, "MULTICAST_MAX_TO", 2)
+    broadcast = pending()
+    pusher = FakePusher(line_push.SENT, line_push.RETRY)
+    assert drain(pusher) == (1, 0, 2)
+    assert Notification.get_by_id(broadcast.id).delivered_at is None
+    assert unread_count(users["c"].id) == 0
+
+    Notification.update(push_next_at=None).where(Notification.id == broadcast.id).execute()
+    pusher = FakePusher()
+    assert drain(pusher) == (1, 1, 1)
+    assert pusher.sent == [(("Uc",), "hello")]
+    assert unread_count(users["c"].id) == 1
+    assert NotificationPush.select().count() == 0
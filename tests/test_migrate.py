@@ -0,0 +1,144 @@
+import os
+import subprocess
+import sys
+from datetime import datetime, time as dtime
+
+from peewee import Model, AutoField, CharField, IntegerField, TextField, BooleanField, DateTimeField
+
+import migrate
+from database import (
+    db, Person, LineChannel, User, UserChannelLink, LiffSession, Salon, SalonStaff, SalonImage,
+    WorkingHour, BlackoutDate, Service, Reservation, ReservationChangeLog, Coupon, CouponRedemption,
+    Review, SearchKeyword, Notification, SalonCard, SalonRating, SchemaVersion,
+)
+from blueprints.info.inbox import unread_count
+from blueprints.reservation.journal import history
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+T0 = datetime(2024, 5, 1, 10, 0)
+
+
+# import 時にテーブルを作っていた頃の、その後に列が変わったテーブル
+class LegacyAddress(Model):
+    id = AutoField()
+    postal_code = CharField(null=True)
+    prefecture = CharField(null=True)
+    city = CharField(null=True)
+    line1 = CharField(null=True)
+    line2 = CharField(null=True)
+    created_at = DateTimeField(default=T0)
+    updated_at = DateTimeField(default=T0)
+
+    class Meta:
+        database = db
+        table_name = "address"
+
+
+class LegacyNotification(Model):
+    id = AutoField()
+    user = IntegerField(null=True, column_name="user_id")
+    salon = IntegerField(null=True, column_name="salon_id")
+    title = CharField()
+    body = TextField(null=True)
+    type = CharField(default="system")
+    is_read = BooleanField(default=False)
+    delivered_at = DateTimeField(default=T0)
+    created_at = DateTimeField(default=T0)
+    updated_at = DateTimeField(default=T0)
+
+    class Meta:
+        database = db
+        table_name = "notification"
+
+
+LEGACY_MODELS = [
+    Person, LineChannel, User, UserChannelLink, LiffSession,
+    LegacyAddress, Salon, SalonStaff, SalonImage, WorkingHour, BlackoutDate, Service,
+    Reservation, ReservationChangeLog, Coupon, CouponRedemption,
+    LegacyNotification, Review, SearchKeyword,
+]
+
+
+def _quiet(*args):
+    pass
+
+
+def legacy_database():
+    """SchemaVersion の無い古いDBを作る（フックを通さない一括クエリで行を入れる）"""
+    db.create_tables(LEGACY_MODELS)
+    stamp = {"created_at": T0, "updated_at": T0}
+    user = User.insert(line_user_id="Ulegacy", line_display_name="legacy", **stamp).execute()
+    address = LegacyAddress.insert(postal_code="150-0002", prefecture="東京都", city="渋谷区").execute()
+    salon = Salon.insert(name="渋谷サロン", address=address, **stamp).execute()
+    WorkingHour.insert_many([
+        {"salon": salon, "weekday": w, "start": dtime(10, 0), "end": dtime(19, 0), **stamp} for w in range(7)
+    ]).execute()
+    service = Service.insert(salon=salon, name="カット", duration_min=60, price_jpy=4000, category="cut",
+                             **stamp).execute()
+    reservation = Reservation.insert(user=user, salon=salon, service=service, start_at=T0,
+                                     end_at=datetime(2024, 5, 1, 11, 0), status=2, amount_jpy=4000,
+                                     **stamp).execute()
+    ReservationChangeLog.insert(reservation=reservation, actor=user, action="create", detail="legacy",
+                                **stamp).execute()
+    Review.insert(reservation=reservation, salon=salon, user=user, rating=4, **stamp).execute()
+    LegacyNotification.insert_many([
+        {"user": user, "title": "personal"},
+        {"user": None, "title": "broadcast"},
+        {"user": user, "title": "read", "is_read": True},
+    ]).execute()
+    return user, salon, reservation
+
+
+def test_upgrade_legacy_database(database):
+    user, salon, reservation = legacy_database()
+    assert migrate.current_version() is None
+
+    assert migrate.upgrade(log=_quiet) == migrate.LATEST
+    assert [v for (v,) in SchemaVersion.select(SchemaVersion.version).order_by(SchemaVersion.version).tuples()] \
+        == [v for v, _, _ in migrate.MIGRATIONS]
+
+    # 足された列・緩められた制約
+    assert migrate._column("address", "latitude") is not None
+    assert migrate._column("notification", "push_attempts") is not None
+    assert migrate._column("notification", "delivered_at").null
+    Notification.create(user=user, title="pending", delivered_at=None)
+
+    # 元テーブルから作り直した読み取りモデル・集計・ジャーナル
+    cards = list(SalonCard.select().where(SalonCard.salon == salon))
+    assert len(cards) == 7
+    assert all(card.latitude is not None and card.geo_approximate for card in cards)
+    rating = SalonRating.get(SalonRating.salon == salon)
+    assert (rating.count, rating.total, rating.r4) == (1, 4, 1)
+    assert unread_count(user) == 2
+    assert [(e["action"], e["detail"]) for e in history(reservation)] == [("create", "legacy")]
+
+
+def test_upgrade_is_idempotent(database):
+    legacy_database()
+    migrate.upgrade(log=_quiet)
+    messages = []
+    assert migrate.upgrade(log=messages.append) == migrate.LATEST
+    assert messages == []
+
+
+def test_upgrade_in_steps(database):
+    user, salon, _ = legacy_database()
+    assert migrate.upgrade(target=2, log=_quiet) == 2
+    assert [v for v, _ in migrate.pending()] == list(range(3, migrate.LATEST + 1))
+    assert not SalonCard.select().where(SalonCard.salon == salon).exists()
+    assert migrate.upgrade(log=_quiet) == migrate.LATEST
+    assert SalonCard.select().where(SalonCard.salon == salon).exists()
+
+
+def test_empty_database_is_created_at_latest(database):
+    messages = []
+    assert migrate.upgrade(log=messages.append) == migrate.LATEST
+    assert messages == [f"created schema at version {migrate.LATEST}"]
+    assert migrate.pending() == []
+
+
+def test_import_does_not_touch_the_database(tmp_path):
+    path = tmp_path / "untouched.db"
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}")
+    subprocess.run([sys.executable, "-c", "import app; app.create_app()"], cwd=ROOT, env=env, check=True)
+    assert not path.exists()
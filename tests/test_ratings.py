@@ -0,0 +1,126 @@
+from datetime import date, datetime, time as dtime, timedelta
+
+import pytest
+
+from database import Review, SalonRating
+from blueprints.home.ratings import (
+    ratings_for, refresh_ratings, review_page, top_rated_salon_ids,
+)
+from .factories import make_user, make_salon, make_service, make_reservation
+
+STAR_COLUMNS = ("r1", "r2", "r3", "r4", "r5")
+
+
+@pytest.fixture
+def review(schema):
+    """review(salon, rating) で予約1件付きの口コミを作る"""
+    made = []
+
+    def create(salon, rating):
+        user = make_user(f"reviewer{len(made)}")
+        start_at = datetime.combine(date(2030, 1, 7), dtime(10, 0)) + timedelta(days=len(made))
+        reservation = make_reservation(user, salon.services.get(), start_at)
+        made.append(Review.create(reservation=reservation, salon=salon, user=user, rating=rating))
+        return made[-1]
+
+    return create
+
+
+@pytest.fixture
+def salon(schema):
+    salon, _ = make_salon()
+    make_service(salon)
+    return salon
+
+
+def aggregate(salon):
+    row = SalonRating.select().where(SalonRating.salon == salon.id).dicts().first()
+    if row is None:
+        return None
+    return {k: row[k] for k in ("count", "total", "average") + STAR_COLUMNS}
+
+
+def assert_matches_reviews(salon):
+    """差分で保った集計が Review から数え直した値と同じ"""
+    kept = aggregate(salon)
+    refresh_ratings([salon.id])
+    assert kept == aggregate(salon)
+
+
+def test_create(salon, review):
+    review(salon, 5)
+    review(salon, 4)
+    review(salon, 4)
+    assert aggregate(salon) == {"count": 3, "total": 13, "average": 13 / 3,
+                                "r1": 0, "r2": 0, "r3": 0, "r4": 2, "r5": 1}
+    assert ratings_for([salon.id])[salon.id] == {
+        "count": 3, "average": 4.3, "histogram": {1: 0, 2: 0, 3: 0, 4: 2, 5: 1},
+    }
+    assert_matches_reviews(salon)
+
+
+def test_update(salon, review):
+    first = review(salon, 5)
+    review(salon, 3)
+    first.rating = 1
+    first.save()
+    assert aggregate(salon)["total"] == 4
+    assert aggregate(salon)["r5"] == 0 and aggregate(salon)["r1"] == 1
+    assert_matches_reviews(salon)
+
+
+def test_delete(salon, review):
+    first = review(salon, 5)
+    second = review(salon, 2)
+    first.delete_instance()
+    assert aggregate(salon) == {"count": 1, "total": 2, "average": 2.0,
+                                "r1": 0, "r2": 1, "r3": 0, "r4": 0, "r5": 0}
+    second.delete_instance()
+    assert aggregate(salon)["count"] == 0
+    assert aggregate(salon)["average"] is None
+    assert ratings_for([salon.id])[salon.id]["count"] == 0
+    assert_matches_reviews(salon)
+
+
+def test_delete_without_aggregate_row_recounts(salon, review):
+    first = review(salon, 5)
+    review(salon, 3)
+    SalonRating.delete().execute()
+    first.delete_instance()
+    assert aggregate(salon) == {"count": 1, "total": 3, "average": 3.0,
+                                "r1": 0, "r2": 0, "r3": 1, "r4": 0, "r5": 0}
+
+
+def test_salons_are_independent(salon, review):
+    other, _ = make_salon(name="other")
+    make_service(other)
+    review(salon, 5)
+    review(other, 1).delete_instance()
+    assert aggregate(salon)["count"] == 1
+    assert aggregate(other)["count"] == 0
+    assert ratings_for([salon.id, other.id, 999])[999]["count"] == 0
+
+
+def test_top_rated(salon, review):
+    other, _ = make_salon(name="other")
+    make_service(other)
+    few, _ = make_salon(name="few")
+    make_service(few)
+    for rating in (5, 5, 4):
+        review(salon, rating)
+    for rating in (5, 4, 4, 4):
+        review(other, rating)
+    for rating in (5, 5):
+        review(few, rating)
+    assert top_rated_salon_ids(min_count=3) == [salon.id, other.id]
+    salon.is_active = False
+    salon.save()
+    assert top_rated_salon_ids(min_count=3) == [other.id]
+
+
+def test_review_page(salon, review):
+    ids = [review(salon, 1 + i % 5).id for i in range(5)]
+    rows, cursor = review_page(salon.id, limit=3)
+    rest, last = review_page(salon.id, cursor=cursor, limit=3)
+    assert [r["id"] for r in rows + rest] == ids[::-1]
+    assert last is None
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import Notification, Reservation
+from reminder_scheduler import ReminderScheduler
+from .factories import make_user, make_salon, make_service, make_reservation
+
+NOW = datetime.now().replace(microsecond=0)
+
+
+@pytest.fixture
+def scheduler(schema):
+    scheduler = ReminderScheduler()
+    scheduler.start(NOW)
+    return scheduler
+
+
+@pytest.fixture
+def reservation(schema):
+    salon, _ = make_salon()
+    return make_reservation(make_user("customer"), make_service(salon), NOW + timedelta(hours=25))
+
+
+def reminders():
+    return [title for (title,) in Notification.select(Notification.title).order_by(Notification.id).tuples()]
+
+
+def test_both_reminders_then_forgotten(scheduler, reservation):
+    assert scheduler.tick(NOW) == 0
+    assert reservation.id in scheduler.planned
+    assert scheduler.tick(NOW + timedelta(hours=1)) == 1
+    assert scheduler.tick(NOW + timedelta(hours=2)) == 0
+    assert scheduler.tick(NOW + timedelta(hours=23)) == 1
+    assert reminders() == ["明日のご予約のお知らせ", "まもなくご予約の時間です"]
+    # 最後の種類を送ったら planned にもヒープにも残らない
+    assert scheduler.planned == {}
+    assert scheduler.heap == []
+
+
+def test_canceled_reservation_is_forgotten(scheduler, reservation):
+    scheduler.tick(NOW)
+    Reservation.update(status=3, updated_at=datetime.utcnow()).where(Reservation.id == reservation.id).execute()
+    assert scheduler.tick(NOW + timedelta(hours=1)) == 0
+    assert scheduler.planned == {}
+    assert scheduler.tick(NOW + timedelta(hours=23)) == 0
+    assert reminders() == []
+
+
+def test_rescheduled_reservation_uses_new_time(scheduler, reservation):
+    scheduler.tick(NOW)
+    new_start = NOW + timedelta(hours=5)
+    (Reservation
+     .update(start_at=new_start, end_at=new_start + timedelta(minutes=30), updated_at=datetime.utcnow())
+     .where(Reservation.id == reservation.id)
+     .execute())
+    # 「明日」の時刻は過ぎているので送らず、2時間前だけを送る
+    assert scheduler.tick(NOW + timedelta(hours=1)) == 0
+    assert scheduler.tick(NOW + timedelta(hours=3)) == 1
+    assert reminders() == ["まもなくご予約の時間です"]
+    assert scheduler.planned == {}